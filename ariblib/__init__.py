@@ -1,3 +1,15 @@
 __version__ = '0.0.5'
 
-from ariblib.packet import TransportStreamFile, tsopen
+# TransportStreamFile と tsopen は初めて参照された時に ariblib.packet から読み込む
+# (ariblib.sections だけを使う場合に packet の読み込みを省くため)
+_lazy = {'TransportStreamFile', 'tsopen'}
+
+
+def __getattr__(name):
+    if name in _lazy:
+        from ariblib import packet
+        value = getattr(packet, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(
+        "module '{}' has no attribute '{}'".format(__name__, name))
@@ -1,9 +1,10 @@
 #!/usr/bin/env python3.2
 # -*- coding: utf-8 -*-
 
+from functools import lru_cache
 import sys
-import io
 
+from ariblib import stats
 from ariblib.aribgaiji import *
 
 """
@@ -90,11 +91,6 @@ ARIB_HIRAGANA_MAP.update(ARIB_BASE)
 # 、 22     、 22
 # ・ 26     ・ 26
 
-ESC_SEQ_ASCII = (0x1B, 0x28, 0x42)
-ESC_SEQ_ZENKAKU = (0x1B, 0x24, 0x42)
-ESC_SEQ_HANKAKU = (0x1B, 0x28, 0x49)
-
-
 class Buffer:
     G0, G1, G2, G3 = range(4)
 
@@ -115,272 +111,368 @@ class DegignationError(Exception):
     pass
 
 
-class CodeSetController:
-
-    def __init__(self):
-        self.v_buffer = {
-            Buffer.G0: CODE_SET_G[0x42],  # KANJI
-            Buffer.G1: CODE_SET_G[0x4a],  # ALPHANUMERIC
-            Buffer.G2: CODE_SET_G[0x30],  # HIRAGANA
-            Buffer.G3: CODE_SET_G[0x31],  # KATAKANA
-        }
-        self.single_shift = None
-        self.graphic_left = Buffer.G0   # KANJI
-        self.graphic_right = Buffer.G2  # HIRAGANA
-        self.esc_seq_count = 0
-        self.esc_buffer_index = Buffer.G0
-        self.esc_drcs = False
-
-    def degignate(self, code):
-        if not code in CODE_SET_KEYS:
-            raise DegignationError(
-                'esc_seq_count=%i esc_buffer_index=%s code=0x%02X' % (
-                    self.esc_seq_count, self.esc_buffer_index, code
-                )
-            )
-        if self.esc_drcs:
-            self.v_buffer[self.esc_buffer_index] = CODE_SET_DRCS[code]
+# 変換表にない符号の代わりに出力する文字
+REPLACEMENT_CHARACTER = '\ufffd'
+
+# 符号集合ごとの変換表。最初に文字列をデコードしたときに作成する
+_tables = {}
+
+
+def _jis(char1, char2):
+    """JIS X 0208 の区点コードを Unicode 文字にする"""
+
+    try:
+        return bytes((0x1B, 0x24, 0x42, char1, char2)).decode('iso-2022-jp')
+    except UnicodeDecodeError:
+        return None
+
+
+def _kana_table(row, arib_map):
+    table = [None] * 0x80
+    for char in range(0x21, 0x7F):
+        if char >= 0x77:
+            table[char] = _jis(0x21, arib_map[char])
         else:
-            self.v_buffer[self.esc_buffer_index] = CODE_SET_G[code]
-        self.esc_seq_count = 0
+            table[char] = _jis(row, char)
+    return table
+
+
+def get_tables():
+    """(符号集合) -> 文字コード -> Unicode 文字 の変換表を返す
+
+    1バイト符号の集合は GL に正規化した文字コードで引くリスト、
+    2バイト符号の集合は (1バイト目 << 8 | 2バイト目) で引く辞書とする。
+    変換表に無い (None) 符号は外字として扱う。
+    """
+
+    if _tables:
+        return _tables
+
+    kanji = {}
+    for char1 in range(0x21, 0x7F):
+        for char2 in range(0x21, 0x7F):
+            uni = _jis(char1, char2)
+            if uni is not None:
+                kanji[(char1 << 8) | char2] = uni
+    alphanumeric = [None] * 0x21 + [chr(c) for c in range(0x21, 0x7F)] +\
+        [None]
+    hiragana = _kana_table(0x24, ARIB_HIRAGANA_MAP)
+    katakana = _kana_table(0x25, ARIB_KATAKANA_MAP)
+    # JIS X 0201 片仮名は半角カタカナ (U+FF61-U+FF9F) に対応する
+    hankaku = [None] * 0x80
+    for char in range(0x21, 0x60):
+        hankaku[char] = chr(0xFF61 + char - 0x21)
+
+    _tables.update({
+        Code.KANJI: kanji,
+        Code.JIS_KANJI_PLANE_1: kanji,
+        Code.JIS_KANJI_PLANE_2: kanji,
+        Code.ALPHANUMERIC: alphanumeric,
+        Code.PROP_ALPHANUMERIC: alphanumeric,
+        Code.HIRAGANA: hiragana,
+        Code.PROP_HIRAGANA: hiragana,
+        Code.KATAKANA: katakana,
+        Code.PROP_KATAKANA: katakana,
+        Code.JIS_X0201_KATAKANA: hankaku,
+    })
+    return _tables
+
+
+def _degignate(code, drcs, esc_seq_count, buffer_index):
+    if drcs:
+        code_set = CODE_SET_DRCS.get(code)
+    else:
+        code_set = CODE_SET_G.get(code)
+    if code_set is None:
+        raise DegignationError(
+            'esc_seq_count=%i esc_buffer_index=%s code=0x%02X' % (
+                esc_seq_count, buffer_index, code
+            )
+        )
+    return code_set
+
+
+def decode(data, with_gaiji=True, split_symbol=False):
+    """8単位符号の文字列を Unicode 文字列にデコードする
+
+    data の先頭から添字を進めながら、符号集合ごとの変換表を使って
+    一度の走査でデコードする。
+
+    return:
+    (本文, 記号) の tuple。
+    split_symbol が真の場合は番組名用の記号 ([字] など) を本文から分けて
+    記号の方に入れる。偽の場合は記号は常に空文字列となる。
+    """
+
+    tables = get_tables()
+    text = []
+    symbol = []
+
+    # G0: 漢字 G1: 英数 G2: 平仮名 G3: 片仮名
+    v_buffer = [
+        CODE_SET_G[0x42],
+        CODE_SET_G[0x4A],
+        CODE_SET_G[0x30],
+        CODE_SET_G[0x31],
+    ]
+    graphic_left = Buffer.G0
+    graphic_right = Buffer.G2
+    single_shift = None
+
+    size = len(data)
+    index = 0
+    while index < size:
+        data1 = data[index]
+        index += 1
+
+        if 0x21 <= data1 <= 0x7E or 0xA1 <= data1 <= 0xFE:
+            # GL/GR Table
+            if data1 < 0x80:
+                if single_shift is not None:
+                    code, length = v_buffer[single_shift]
+                    single_shift = None
+                else:
+                    code, length = v_buffer[graphic_left]
+                char1 = data1
+            else:
+                code, length = v_buffer[graphic_right]
+                char1 = data1 & 0x7F
+
+            if length == 2:
+                if index >= size:
+                    break
+                char2 = data[index]
+                index += 1
+                if data1 >= 0x80:
+                    char2 &= 0x7F
+                key = (char1 << 8) | char2
+            else:
+                key = char1
+
+            table = tables.get(code)
+            if table is not None:
+                uni = table.get(key) if length == 2 else table[key]
+                if uni is not None:
+                    text.append(uni)
+                    continue
+                if length == 1:
+                    text.append(REPLACEMENT_CHARACTER)
+                    continue
+            elif code != Code.ADDITIONAL_SYMBOLS:
+                # モザイク、DRCS などは出力しない
+                continue
+
+            # 追加記号集合、および漢字集合の90区以降に置かれた追加記号・追加漢字
+            if not with_gaiji:
+                continue
+            if split_symbol:
+                gaiji = GAIJI_MAP_TITLE.get(key)
+                if gaiji is not None:
+                    symbol.append(gaiji)
+                else:
+                    text.append(GAIJI_MAP_OTHER.get(key, "??"))
+            else:
+                text.append(GAIJI_MAP.get(key, "??"))
 
-    def invoke(self, buffer_index, area, locking_shift=True):
-        if CodeArea.LEFT == area:
-            if locking_shift:
-                self.graphic_left = buffer_index
+        elif data1 in (
+                0x20,  # space
+                0xA0,  # space (arib)
+                0x09,  # HT
+        ):
+            text.append(' ')
+        elif data1 in (
+                0x0D,  # CR
+                0x0A,  # LF
+        ):
+            text.append('\n')
+        elif data1 == 0x0F:
+            graphic_left = Buffer.G0   # LS0
+        elif data1 == 0x0E:
+            graphic_left = Buffer.G1   # LS1
+        elif data1 == 0x19:
+            single_shift = Buffer.G2   # SS2
+        elif data1 == 0x1D:
+            single_shift = Buffer.G3   # SS3
+        elif data1 == 0x1B:
+            # エスケープシーケンス
+            if index >= size:
+                break
+            data1 = data[index]
+            index += 1
+            if data1 == 0x6E:
+                graphic_left = Buffer.G2   # LS2
+                continue
+            elif data1 == 0x6F:
+                graphic_left = Buffer.G3   # LS3
+                continue
+            elif data1 == 0x7E:
+                graphic_right = Buffer.G1  # LS1R
+                continue
+            elif data1 == 0x7D:
+                graphic_right = Buffer.G2  # LS2R
+                continue
+            elif data1 == 0x7C:
+                graphic_right = Buffer.G3  # LS3R
+                continue
+            elif data1 in (0x24, 0x28):
+                buffer_index = Buffer.G0
+            elif 0x29 <= data1 <= 0x2B:
+                buffer_index = data1 - 0x28
             else:
-                self.single_shift = buffer_index
-        elif CodeArea.RIGHT == area:
-            self.graphic_right = buffer_index
-        self.esc_seq_count = 0
-
-    def get_current_code(self, data):
-        if 0x21 <= data <= 0x7E:
-            if self.single_shift:
-                code = self.v_buffer[self.single_shift]
-                self.single_shift = None
-                return code
-            return self.v_buffer[self.graphic_left]
-        elif 0xA1 <= data <= 0xFE:
-            return self.v_buffer[self.graphic_right]
-        return None
+                raise EscapeSequenceError('esc_seq_count=%i data=0x%02X' % (
+                    1, data1,
+                ))
 
-    def set_escape(self, buffer_index, drcs):
-        if buffer_index is not None:
-            self.esc_buffer_index = buffer_index
-        self.esc_drcs = drcs
-        self.esc_seq_count += 1
+            # 符号の指示
+            drcs = False
+            esc_seq_count = 2
+            while index < size:
+                data1 = data[index]
+                index += 1
+                if data1 == 0x20 and esc_seq_count < 4:
+                    drcs = True
+                elif esc_seq_count == 2 and 0x28 <= data1 <= 0x2B:
+                    buffer_index = data1 - 0x28
+                else:
+                    v_buffer[buffer_index] = _degignate(
+                        data1, drcs, esc_seq_count, buffer_index)
+                    break
+                esc_seq_count += 1
+        # それ以外の制御符号は無視する
 
+    return (''.join(text), ''.join(symbol))
 
-class AribArray(bytearray):
-    esc_seq = None
 
-    def pop0(self):
-        try:
-            return self.pop(0)
-        except IndexError:
-            raise AribIndexError
+# デコード結果キャッシュの最大件数
+CACHE_SIZE = 8192
+
+
+def _decode(data, with_gaiji, split_symbol):
+    if not stats.enabled:
+        return decode(data, with_gaiji, split_symbol)
+    stats.count('aribstr_decodes')
+    with stats.timer('aribstr'):
+        return decode(data, with_gaiji, split_symbol)
+
+_cached_decode = lru_cache(maxsize=CACHE_SIZE)(_decode)
+
+
+def cached_decode(data, with_gaiji=True, split_symbol=False):
+    """decode() の結果をバイト列とフラグをキーにキャッシュして返す
+
+    EPG では同じ番組名や番組詳細が何度も送出されるので、
+    プロセス全体で共有する LRU キャッシュでデコードを省略する。
+    """
+
+    if stats.enabled:
+        stats.count('aribstr_lookups')
+    return _cached_decode(bytes(data), with_gaiji, split_symbol)
 
-    def append_str(self, esc_seq, *string):
-        if self.esc_seq != esc_seq:
-            self.extend(esc_seq)
-        self.esc_seq = esc_seq
-        if len(string) > 1:
-            self.extend(string)
-        else:
-            self.append(string[0])
 
+def cache_info():
+    """デコードキャッシュの (hits, misses, maxsize, currsize) を返す"""
 
-class AribString:
-    def __init__(self, array):
-        self.control = CodeSetController()
-        self.arib_array = AribArray(array)
-        self.jis_array = AribArray()
-        self.utf_buffer = io.StringIO()
-        self.utf_buffer_symbol = io.StringIO()
-        self.split_symbol = False
+    return _cached_decode.cache_info()
+
+
+def set_cache_size(maxsize):
+    """デコードキャッシュの最大件数を変更する
+
+    キャッシュの内容と統計は破棄される。None を与えると無制限になる。
+    """
+
+    global _cached_decode
+    _cached_decode = lru_cache(maxsize=maxsize)(_decode)
+
+
+def clear_cache():
+    """デコードキャッシュの内容と統計を破棄する"""
+
+    _cached_decode.cache_clear()
+
+
+class AribString(object):
+
+    """8単位符号で符号化された文字列
+
+    イミュータブルな値として扱う。同じインスタンスを何度 str() しても
+    同じ結果を返し、デコード結果はインスタンスにキャッシュされるので
+    共有やキャッシュができる。
+
+    連結 (+) は新しいインスタンスを返す。連結元のバイト列は
+    デコードが必要になるまで結合しない。
+    """
+
+    __slots__ = ('_segments', '_array', '_utf', '_utf_split')
+
+    def __init__(self, array=b''):
+        if isinstance(array, AribString):
+            self._segments = array._segments
+        else:
+            self._segments = (bytes(array),)
+        self._array = None
+        self._utf = None
+        self._utf_split = None
+
+    @classmethod
+    def join(cls, segments):
+        """バイト列 (または AribString) のリストを連結した AribString を返す"""
+
+        result = cls()
+        result._segments = tuple(
+            part for segment in segments
+            for part in (segment._segments if isinstance(segment, AribString)
+                         else (bytes(segment),)))
+        return result
+
+    @property
+    def arib_array(self):
+        """連結済みの8単位符号のバイト列"""
+
+        if self._array is None:
+            if len(self._segments) == 1:
+                self._array = self._segments[0]
+            else:
+                self._array = b''.join(self._segments)
+                self._segments = (self._array,)
+        return self._array
 
     def __add__(self, other):
-        self.arib_array += other.arib_array
-        return self
+        return AribString.join((self, other))
 
     def __str__(self):
         return self.convert_utf().rstrip()
 
-    def __nonzero__(self):
-        return not self.arib_array
+    def __bool__(self):
+        return any(self._segments)
+
+    def __eq__(self, other):
+        if isinstance(other, AribString):
+            return self.arib_array == other.arib_array
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.arib_array)
 
     def convert_utf_split(self):
-        self.split_symbol = True
-        self.convert()
-        self.flush_jis_array()
-        return (self.utf_buffer.getvalue(), self.utf_buffer_symbol.getvalue())
+        if self._utf_split is None:
+            self._utf_split = self.convert(split_symbol=True)
+        return self._utf_split
 
     def convert_utf(self, with_gaiji=True):
-        self.convert(with_gaiji)
-        self.flush_jis_array()
-        return self.utf_buffer.getvalue()
-
-    def flush_jis_array(self):
-        if len(self.jis_array) > 0:
-            try:
-                uni = self.jis_array.decode('iso-2022-jp')
-            except UnicodeDecodeError:
-                uni = 'UnicodeDecodeError'
-            self.utf_buffer.write(uni)
-            self.jis_array = AribArray()
-
-    def convert(self, with_gaiji=True):
-        while True:
-            try:
-                data = self.arib_array.pop0()
-                if self.control.esc_seq_count:
-                    self.do_escape(data)
-                else:
-                    if 0x21 <= data <= 0x7E or 0xA1 <= data <= 0xFE:
-                        # GL/GR Table
-                        self.do_convert(data, with_gaiji)
-                    elif data in (
-                            0x20,   # space
-                            0xA0,   # space (arib)
-                            0x09,  # HT
-                    ):
-                        self.jis_array.append_str(ESC_SEQ_ASCII, 0x20)
-                    elif data in (
-                            0x0D,  # CR
-                            0x0A,  # LF
-                    ):
-                        self.jis_array.append_str(ESC_SEQ_ASCII, 0x0A)
-                    else:
-                         # Control Character
-                        self.do_control(data)
-            except AribIndexError:
-                break
-        return self.jis_array
-
-    def do_convert(self, data, with_gaiji=True):
-        code, size = self.control.get_current_code(data)
-        char = data
-        char2 = 0x0
-        if size == 2:
-            char2 = self.arib_array.pop0()
-        if 0xA1 <= char <= 0xFE:
-            char = char & 0x7F
-            char2 = char2 & 0x7F
-
-        if code in (
-            Code.KANJI, Code.JIS_KANJI_PLANE_1, Code.JIS_KANJI_PLANE_2
-        ):
-            # 漢字コード出力
-            self.jis_array.append_str(ESC_SEQ_ZENKAKU, char, char2)
-        elif code in (Code.ALPHANUMERIC, Code.PROP_ALPHANUMERIC):
-            # 英数字コード出力
-            self.jis_array.append_str(ESC_SEQ_ASCII, char)
-        elif code in (Code.HIRAGANA, Code.PROP_HIRAGANA):
-            # ひらがなコード出力
-            if char >= 0x77:
-                self.jis_array.append_str(
-                    ESC_SEQ_ZENKAKU, 0x21, ARIB_HIRAGANA_MAP[char])
-            else:
-                self.jis_array.append_str(
-                    ESC_SEQ_ZENKAKU, 0x24, char)
-        elif code in (Code.PROP_KATAKANA, Code.KATAKANA):
-            # カタカナコード出力
-            if char >= 0x77:
-                self.jis_array.append_str(
-                    ESC_SEQ_ZENKAKU, 0x21, ARIB_KATAKANA_MAP[char])
-            else:
-                self.jis_array.append_str(ESC_SEQ_ZENKAKU, 0x25, char)
-        elif code == Code.JIS_X0201_KATAKANA:
-            # 半角カタカナコード出力
-            self.jis_array.append_str(ESC_SEQ_HANKAKU, char)
-        elif code == Code.ADDITIONAL_SYMBOLS:
-            # 追加シンボル文字コード出力
-            self.flush_jis_array()
-            if with_gaiji:
-                if self.split_symbol:
-                    wchar = ((char << 8) + char2)
-                    gaiji = GAIJI_MAP_TITLE.get(wchar)
-                    if gaiji is not None:
-                        self.utf_buffer_symbol.write(gaiji)
-                    else:
-                        self.utf_buffer.write(GAIJI_MAP_OTHER.get(wchar, "??"))
-                else:
-                    self.utf_buffer.write(
-                        GAIJI_MAP.get(((char << 8) + char2), "??"))
-
-    def do_control(self, data):
-        if data == 0x0F:
-            self.control.invoke(Buffer.G0, CodeArea.LEFT, True)   # LS0
-        elif data == 0x0E:
-            self.control.invoke(Buffer.G1, CodeArea.LEFT, True)   # LS1
-        elif data == 0x19:
-            self.control.invoke(Buffer.G2, CodeArea.LEFT, False)  # SS2
-        elif data == 0x1D:
-            self.control.invoke(Buffer.G3, CodeArea.LEFT, False)  # SS3
-        elif data == 0x1B:
-            self.control.esc_seq_count = 1
-
-    def do_escape(self, data):
-        if self.control.esc_seq_count == 1:
-            if data == 0x6E:
-                self.control.invoke(Buffer.G2, CodeArea.LEFT, True)   # LS2
-            elif data == 0x6F:
-                self.control.invoke(Buffer.G3, CodeArea.LEFT, True)   # LS3
-            elif data == 0x7E:
-                self.control.invoke(Buffer.G1, CodeArea.RIGHT, True)  # LS1R
-            elif data == 0x7D:
-                self.control.invoke(Buffer.G2, CodeArea.RIGHT, True)  # LS2R
-            elif data == 0x7C:
-                self.control.invoke(Buffer.G3, CodeArea.RIGHT, True)  # LS3R
-            elif data in (0x24, 0x28):
-                self.control.set_escape(Buffer.G0, False)
-            elif data == 0x29:
-                self.control.set_escape(Buffer.G1, False)
-            elif data == 0x2A:
-                self.control.set_escape(Buffer.G2, False)
-            elif data == 0x2B:
-                self.control.set_escape(Buffer.G3, False)
-            else:
-                raise EscapeSequenceError('esc_seq_count=%i data=0x%02X' % (
-                    self.control.esc_seq_count, data,
-                ))
-        elif self.control.esc_seq_count == 2:
-            if data == 0x20:
-                self.control.set_escape(None, True)
-            elif data == 0x28:
-                self.control.set_escape(Buffer.G0, False)
-            elif data == 0x29:
-                self.control.set_escape(Buffer.G1, False)
-            elif data == 0x2A:
-                self.control.set_escape(Buffer.G2, False)
-            elif data == 0x2B:
-                self.control.set_escape(Buffer.G3, False)
-            else:
-                self.control.degignate(data)
-        elif self.control.esc_seq_count == 3:
-            if data == 0x20:
-                self.control.set_escape(None, True)
-            else:
-                self.control.degignate(data)
-        elif self.control.esc_seq_count == 4:
-            self.control.degignate(data)
+        if not with_gaiji:
+            return self.convert(with_gaiji)[0]
+        if self._utf is None:
+            self._utf = self.convert()[0]
+        return self._utf
+
+    def convert(self, with_gaiji=True, split_symbol=False):
+        return cached_decode(self.arib_array, with_gaiji, split_symbol)
 
     def __repr__(self):
         return self.convert_utf().rstrip()
 
 if __name__ == '__main__':
-    f = open(sys.argv[1], 'rb')
-    f.seek(0, 2)
-    byte = f.tell()
-    f.seek(0)
-    arr = array.array('B')
-    arr.fromfile(f, byte)
-    f.close()
-
-    arib = AribString(arr)
-    arib.convert()
-
-    f = open("output.txt", 'wb')
-    arib.jis_array.tofile(f)
-    f.close()
+    with open(sys.argv[1], 'rb') as f:
+        arib = AribString(f.read())
+    print(arib.convert_utf())
@@ -1,41 +1,40 @@
 """字幕処理関係"""
 
+from collections import deque
+
 from ariblib.aribgaiji import GAIJI_MAP
-from ariblib.drcs import DRCSImage, mapping
-from ariblib.packet import SynchronizedPacketizedElementaryStream
-from ariblib.sections import TimeOffsetSection
+from ariblib.clock import Clock
+from ariblib.descriptors import StreamIdentifierDescriptor
+from ariblib.drcs import get_mapping, store
+from ariblib.packet import (
+    PESParser,
+    SectionParser,
+    SynchronizedPacketizedElementaryStream,
+    pcr,
+    pid,
+)
+from ariblib.sections import (
+    ProgramAssociationSection,
+    ProgramMapSection,
+    TimeOffsetSection,
+)
 
 
 def captions(ts, color=False):
     """トランスポートストリームから字幕オブジェクトを返すジェネレータ"""
 
-    SynchronizedPacketizedElementaryStream._pids = [ts.get_caption_pid()]
     if color:
-        CProfileString = ColoredCProfileString
-
-    base_pcr = next(ts.pcrs())
-    base_time = next(ts.sections(TimeOffsetSection)).JST_time
-
-    for spes in ts.sections(SynchronizedPacketizedElementaryStream):
-        caption_date = base_time + (spes.pts - base_pcr)
-        for data in spes.data_units:
-            if data.data_unit_parameter == 0x20:
-                yield Caption(caption_date,
-                              CProfileString(data.data_unit_data))
-            elif data.data_unit_parameter == 0x30:
-                for code in data.codes:
-                    drcs_code = code.character_code & 0xFF
-                    for font in code.fonts:
-                        image = DRCSImage(font.width, font.height)
-                        image.point(font.patterns)
-                        CProfileString.drcs[drcs_code] = image.hash
-                        image.save()
+        stream = CaptionStream(ColoredCProfileString)
+    else:
+        stream = CaptionStream(CProfileString)
+    return stream.captions(ts)
 
 
 class Caption(object):
-    def __init__(self, datetime, body):
+    def __init__(self, datetime, body, pts=None):
         self.datetime = datetime
         self.body = body
+        self.pts = pts
 
 
 class CProfileString(object):
@@ -85,6 +84,7 @@ class CProfileString(object):
                         yield '(0x{:x})'.format(char1)
             elif 0x20 < char1 < 0x2f:
                 if char1 in self.drcs:
+                    mapping = get_mapping()
                     if self.drcs[char1] in mapping:
                         yield mapping[self.drcs[char1]]
                     else:
@@ -151,3 +151,146 @@ class WebVTTCProfileString(ColoredCProfileString):
             string += '</c>'
         self.__str__ = lambda self: string
         return string
+
+
+class CaptionStream(object):
+
+    """トランスポートストリームを1回走査するだけで字幕オブジェクトを返すパイプライン
+
+    PAT と PMT から字幕の PID を求め、PCR と TOT を受信するたびに clock
+    (ariblib.clock.Clock) に与えて PTS から日本時間への対応を作る。
+    最初の TOT を受信する前に受信した字幕だけを max_pending 個までバッファし、
+    それ以降は字幕を受信するたびに Caption を返す。PCR の一周や不連続は
+    clock が補う。feed() にパケットを一つずつ与えればライブストリームにも使える。
+
+    base_time を与えた場合は TOT を使わず、最初の PCR を base_time とする。
+    drcs が偽の場合は DRCS の画像を作成しない。
+    """
+
+    def __init__(self, CProfileString=CProfileString, base_time=None,
+                 drcs=True, max_pending=1024):
+        self.CProfileString = CProfileString
+        self.base_time = base_time
+        self.base_pcr = None
+        self.clock = Clock()
+        self.drcs = drcs
+        self.caption_pid = None
+        self.pcr_pid = None
+        self.pending = deque(maxlen=max_pending)
+        self.parser = SectionParser(ProgramAssociationSection)
+        self.pes_parser = PESParser()
+        if base_time is None:
+            self.parser.add(TimeOffsetSection)
+        self.last_pcr = None
+        self._tot = None
+
+    def captions(self, packets):
+        """パケットのイテラブルから Caption を返すジェネレータ"""
+
+        feed = self.feed
+        for packet in packets:
+            yield from feed(packet)
+        result = []
+        for section in self.parser.flush() + self.pes_parser.flush():
+            self._on_section(section, result)
+        yield from result
+
+    def feed(self, packet):
+        """パケットを一つ与え、時刻の決まった Caption のリストを返す"""
+
+        PID = pid(packet)
+        result = []
+        if PID == self.pcr_pid:
+            value = pcr(packet)
+            if value is not None:
+                self.last_pcr = value
+                self.clock.add_pcr(value)
+                if self.base_pcr is None:
+                    if self.base_time is not None:
+                        self._anchor(self.base_time, 0, result)
+                    elif self._tot is not None:
+                        self._anchor(self._tot, 1, result)
+        if PID == self.caption_pid:
+            for spes in self.pes_parser.feed(packet):
+                self._on_section(spes, result)
+        elif PID in self.parser.table_map:
+            for section in self.parser.feed(packet):
+                self._on_section(section, result)
+        return result
+
+    def _on_section(self, section, result):
+        if isinstance(section, SynchronizedPacketizedElementaryStream):
+            pts = section.pts
+            # PTS は受信した時点の PCR を基準に連続した位置に直しておく
+            position = self.clock.locate(pts)
+            for body in self._bodies(section):
+                if self.base_pcr is None:
+                    self.pending.append((position, pts, body))
+                else:
+                    result.append(Caption(
+                        self.clock.datetime(position), body, pts))
+        elif isinstance(section, TimeOffsetSection):
+            # TOT の直前の PCR を TOT の時刻とみなす
+            if self.last_pcr is None:
+                self._tot = section.JST_time
+            elif self.base_pcr is None:
+                self._anchor(section.JST_time, 1, result)
+            else:
+                self.clock.add_time(section.JST_time)
+        elif isinstance(section, ProgramAssociationSection):
+            self.parser.discard(ProgramAssociationSection._pids[0])
+            self.parser.add(ProgramMapSection, list(section.pmt_pids))
+        elif isinstance(section, ProgramMapSection):
+            caption_pid = self._caption_pid(section)
+            if caption_pid is None:
+                return
+            for PID, table_ids in list(self.parser.table_map.items()):
+                if ProgramMapSection._table_ids[0] in table_ids:
+                    self.parser.discard(PID)
+            self.caption_pid = caption_pid
+            self.pcr_pid = section.PCR_PID
+            self.pes_parser.add(SynchronizedPacketizedElementaryStream,
+                                [caption_pid])
+
+    def _anchor(self, base_time, precision, result):
+        self.base_pcr = self.last_pcr
+        self.base_time = base_time
+        clock = self.clock
+        clock.add_time(base_time, precision)
+        while self.pending:
+            position, pts, body = self.pending.popleft()
+            if position is None:
+                position = clock.locate(pts)
+            result.append(Caption(clock.datetime(position), body, pts))
+
+    @staticmethod
+    def _caption_pid(pmt):
+        """字幕パケットの PID を返す
+
+        FIXME: 2か国語対応の場合複数の PID で字幕が提供されているかも? (未確認)
+        """
+
+        for tsmap in pmt.maps:
+            if tsmap.stream_type != 0x06:
+                continue
+            for si in tsmap.descriptors.get(StreamIdentifierDescriptor, []):
+                if si.component_tag == 0x87:
+                    return tsmap.elementary_PID
+
+    def _bodies(self, spes):
+        """字幕 PES から字幕文を返し、DRCS を登録する"""
+
+        CProfileString = self.CProfileString
+        for data in spes.data_units:
+            if data.data_unit_parameter == 0x20:
+                yield CProfileString(data.data_unit_data)
+            elif data.data_unit_parameter == 0x30 and self.drcs:
+                for code in data.codes:
+                    drcs_code = code.character_code & 0xFF
+                    for font in code.fonts:
+                        # 幾何図形による DRCS には対応していない
+                        if font.mode not in (0b0000, 0b0001):
+                            continue
+                        CProfileString.drcs[drcs_code] = store.add(
+                            font.width, font.height, font.pattern_data,
+                            font.depth)
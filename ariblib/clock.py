@@ -0,0 +1,212 @@
+"""PCR と TOT から日本時間を求める時計
+
+TOT を受信するたびに、その直前の PCR と TOT の時刻を組にして記録し、
+PCR (と PTS) から日本時間への区分線形の対応を作る。
+
+- PCR は33ビットで一周するので、受け取った順に一周分を補って連続した
+  位置 (90kHz) に直す。前の PCR から戻った場合や max_gap 秒以上進んだ
+  場合は不連続とみなし、位置を max_gap 進めて新しい区間を始める。
+  区間の境目は空けた位置の中央とし、不連続の直前や直後に locate した PTS
+  (PCR から前後に少しずれる) が隣の区間に入らないようにする。
+- TOT の時刻は秒未満が切り捨てられているので、区間ごとに window 秒ずつ
+  まとめ、窓の中の全ての組と矛盾しない「日本時間 - 位置」の範囲の中央を
+  その窓の節点の値とする。節点の間は線形に補間し、区間の最初と最後の
+  節点より外側はその節点の値を使う。区間をまたいで補間はしない。
+  TOT の無い区間は直前の区間の最後の値を、空けた位置の分だけ戻して
+  引き継ぐ (不連続の前後で日本時間が続くようにする)。
+
+節点は array に持ち、位置から日本時間を求めるときは二分探索で節点を探す。
+
+    clock = Clock()
+    for packet in ts:
+        value = pcr(packet)
+        if value is not None:
+            clock.add_pcr(value)
+        ...
+        clock.add_time(tot.JST_time)
+        ...
+        jst = clock.datetime(clock.locate(spes.pts))
+"""
+
+from array import array
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+# PCR・PTS の周波数と周期 (90kHz, 33ビット)
+CLOCK_FREQUENCY = 90000
+PCR_WRAP = 2 ** 33
+
+# 日本時間を秒で持つときの基準
+EPOCH = datetime(2000, 1, 1)
+
+
+def ticks(value):
+    """timedelta で表された PCR や PTS を 90kHz の値に戻す"""
+
+    return round(value.total_seconds() * CLOCK_FREQUENCY)
+
+
+class Clock(object):
+
+    """PCR と TOT の組から作る、PCR の位置から日本時間への区分線形の対応
+
+    window は節点を作る間隔 (秒)、max_gap はこれ以上 PCR が進んだら
+    不連続とみなす秒数"""
+
+    def __init__(self, window=300, max_gap=10):
+        self.window = window * CLOCK_FREQUENCY
+        self.max_gap = max_gap * CLOCK_FREQUENCY
+        # 節点の位置と「日本時間 - 位置」(秒)
+        self.positions = array('q')
+        self.offsets = array('d')
+        # 区間の始まりの位置と、その区間の最初の節点の番号
+        self.starts = array('q', [0])
+        self.first_knots = array('q', [0])
+        self.position = None
+        self.last_pcr = None
+        # 組み立て中の窓 (最初の位置, 位置の和, 組の数, 範囲の下限, 上限)
+        self._window = None
+
+    @property
+    def anchored(self):
+        """日本時間を求められるかどうか"""
+
+        return len(self.positions) > 0 or self._window is not None
+
+    def add_pcr(self, value):
+        """PCR (timedelta) を与え、その連続した位置を返す"""
+
+        value = ticks(value)
+        if self.last_pcr is None:
+            self.position = 0
+        else:
+            delta = (value - self.last_pcr) % PCR_WRAP
+            if delta > self.max_gap:
+                # 不連続: 位置を max_gap 空けて新しい区間を始める
+                self._close_window()
+                self.starts.append(self.position + self.max_gap // 2)
+                self.first_knots.append(len(self.positions))
+                self.position += self.max_gap
+            else:
+                self.position += delta
+        self.last_pcr = value
+        return self.position
+
+    def add_time(self, jst, precision=1):
+        """日本時間を与え、直前の PCR の位置と組にする
+
+        precision は jst の精度 (秒)。TOT の時刻は秒未満が切り捨てられて
+        いるので 1、正確な時刻であれば 0 にする"""
+
+        if self.position is None or jst is None:
+            return
+        position = self.position
+        seconds = (jst - EPOCH).total_seconds() - position / CLOCK_FREQUENCY
+        window = self._window
+        if window is not None and position - window[0] >= self.window:
+            self._close_window()
+            window = None
+        if window is None:
+            self._window = [position, position, 1, seconds,
+                            seconds + precision]
+            return
+        window[1] += position
+        window[2] += 1
+        window[3] = max(window[3], seconds)
+        window[4] = min(window[4], seconds + precision)
+        if window[3] > window[4]:
+            # 揺らぎで範囲が無くなった場合は最後の組からやり直す
+            window[3] = seconds
+            window[4] = seconds + precision
+
+    def _close_window(self):
+        """組み立て中の窓を節点にする"""
+
+        window = self._window
+        if window is None:
+            return
+        self._window = None
+        position, offset = self._knot(window)
+        self.positions.append(position)
+        self.offsets.append(offset)
+
+    @staticmethod
+    def _knot(window):
+        return window[1] // window[2], (window[3] + window[4]) / 2
+
+    def locate(self, pts):
+        """PTS (timedelta) の連続した位置を返す
+
+        最後に与えた PCR から前後半周以内にあるとみなすので、PES を
+        受信した時点で呼ぶこと"""
+
+        if self.position is None:
+            return None
+        delta = (ticks(pts) - self.last_pcr) % PCR_WRAP
+        if delta >= PCR_WRAP // 2:
+            delta -= PCR_WRAP
+        return self.position + delta
+
+    def datetime(self, position):
+        """連続した位置の日本時間を返す (求められなければ None)"""
+
+        if position is None:
+            return None
+        offset = self.offset(position)
+        if offset is None:
+            return None
+        return EPOCH + timedelta(
+            seconds=offset + position / CLOCK_FREQUENCY)
+
+    def offset(self, position):
+        """位置での「日本時間 - 位置」(秒) を返す"""
+
+        positions = self.positions
+        offsets = self.offsets
+        segment = max(bisect_right(self.starts, position) - 1, 0)
+        first = self.first_knots[segment]
+        if segment + 1 < len(self.first_knots):
+            last = self.first_knots[segment + 1]
+        else:
+            last = len(positions)
+        # 最後の区間では組み立て中の窓も節点として使う
+        pending = None
+        if self._window is not None and segment == len(self.starts) - 1:
+            pending = self._knot(self._window)
+
+        if first == last and pending is None:
+            # この区間に TOT が無ければ前の区間の値を引き継ぐ
+            if first > 0:
+                return self._shift(offsets[first - 1], first - 1, segment)
+            if len(positions):
+                return self._shift(offsets[0], 0, segment)
+            if self._window is not None:
+                return self._shift(self._knot(self._window)[1],
+                                   len(positions), segment)
+            return None
+
+        index = bisect_right(positions, position, first, last)
+        if index == first:
+            if first < last:
+                return offsets[first]
+            return pending[1]
+        left = (positions[index - 1], offsets[index - 1])
+        if index < last:
+            right = (positions[index], offsets[index])
+        elif pending is not None:
+            right = pending
+        else:
+            return left[1]
+        if position >= right[0] or right[0] == left[0]:
+            return right[1]
+        rate = (position - left[0]) / (right[0] - left[0])
+        return left[1] + (right[1] - left[1]) * rate
+
+    def _shift(self, offset, knot, segment):
+        """knot 番目の節点の区間の offset を segment 番目の区間で使う値にする
+
+        区間の間で空けた位置の分だけずらし、日本時間が続くようにする"""
+
+        owner = bisect_right(self.first_knots, knot) - 1
+        gap = self.max_gap / CLOCK_FREQUENCY
+        return offset - (segment - owner) * gap
@@ -0,0 +1,483 @@
+"""録画から EIT のイベント (番組) の範囲だけを切り出す
+
+番組の開始・終了時刻 (EIT の start_time と duration) を、TOT と PCR の
+対応から PCR の値に直し、PCR が単調に増えることを使って二分探索で
+ファイル上の位置を求める。開始時刻がずれた (前の番組が延長した、
+早く終わった、番組の間が空いた) 場合や番組が延長した場合は、
+EIT[p/f] の現在のイベントが切り替わる位置を同じく二分探索で求めてそちらを使う。
+開始位置は映像のランダムアクセス点 (adaptation field の
+random_access_indicator) まで戻し、終了位置は次のランダムアクセス点まで進める。
+ファイル全体を読むことはなく、求めた範囲はまとめてコピーする。
+"""
+
+from datetime import timedelta
+import os
+import sys
+
+from ariblib.clock import PCR_WRAP, ticks
+from ariblib.packet import (
+    SectionParser,
+    adaptation_field,
+    pcr,
+    pid,
+)
+from ariblib.sections import (
+    ActualStreamPresentFollowingEventInformationSection,
+    ProgramAssociationSection,
+    ProgramMapSection,
+    TimeOffsetSection,
+)
+
+PACKET_SIZE = 188
+
+# PAT/PMT, EIT[p/f], TOT を探すときに読む長さの上限
+PROBE_SIZE = PACKET_SIZE * 100000
+
+# 録画の末尾の EIT[p/f] を探す長さ
+TAIL_SIZE = PACKET_SIZE * 50000
+
+# PCR やランダムアクセス点を探すときに一度に読む長さ
+READ_SIZE = PACKET_SIZE * 1024
+
+# ランダムアクセス点を探す範囲
+RANDOM_ACCESS_SEARCH = PACKET_SIZE * 100000
+
+# 映像の stream_type (MPEG-1, MPEG-2, H.264, H.265)
+VIDEO_STREAM_TYPES = (0x01, 0x02, 0x1B, 0x24)
+
+# まとめてコピーするときの1回の長さ
+COPY_SIZE = 1 << 24
+
+
+class TransitionNotFound(Exception):
+
+    """EIT[p/f] で対象のイベントに切り替わる (または終わる) 位置が見つからない"""
+
+
+class Recording(object):
+
+    """位置を指定して読み込む録画ファイル
+
+    PCR はファイル先頭の PCR からの経過 (90kHz) として扱い、
+    33ビットの周期で一周した分も補う"""
+
+    def __init__(self, path, service_id=None):
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.size -= self.size % PACKET_SIZE
+        self.service_id = service_id
+        self.pcr_pid = None
+        self.video_pid = None
+        try:
+            self._find_program()
+            first = self.pcr_at(0)
+            if first is None:
+                raise ValueError('PCR is not found')
+        except Exception:
+            self.file.close()
+            raise
+        self.base = first[0]
+
+    def close(self):
+        self.file.close()
+
+    def read(self, offset, size):
+        """offset から size バイト (パケット単位に切り詰める) を読む"""
+
+        self.file.seek(offset)
+        data = self.file.read(size)
+        return data[:len(data) - len(data) % PACKET_SIZE]
+
+    def packets(self, offset, size=PROBE_SIZE):
+        """offset から読んだパケットを (位置, パケット) で返すジェネレータ"""
+
+        end = min(self.size, offset + size)
+        while offset < end:
+            data = self.read(offset, min(READ_SIZE, end - offset))
+            if not data:
+                return
+            for start in range(0, len(data), PACKET_SIZE):
+                yield offset + start, data[start:start + PACKET_SIZE]
+            offset += len(data)
+
+    def elapsed(self, value):
+        """PCR をファイル先頭からの経過 (90kHz) にする"""
+
+        return (value - self.base) % PCR_WRAP
+
+    def _find_program(self):
+        """サービスの PCR と映像の PID を PAT/PMT から求める"""
+
+        parser = SectionParser(ProgramAssociationSection)
+        for _, p in self.packets(0):
+            if pid(p) not in parser.table_map:
+                continue
+            for section in parser.feed(p):
+                if isinstance(section, ProgramAssociationSection):
+                    programs = dict(section.pmt_items)
+                    if self.service_id is None and programs:
+                        self.service_id = next(iter(programs))
+                    if self.service_id not in programs:
+                        raise ValueError('service_id {} is not found'.format(
+                            self.service_id))
+                    parser.add(ProgramMapSection,
+                               [programs[self.service_id]])
+                elif section.program_number == self.service_id:
+                    self.pcr_pid = section.PCR_PID
+                    for stream in section.maps:
+                        if stream.stream_type in VIDEO_STREAM_TYPES:
+                            self.video_pid = stream.elementary_PID
+                            break
+                    return
+        raise ValueError('PMT is not found')
+
+    def pcr_at(self, offset):
+        """offset 以降で最初の PCR を (90kHz の値, 位置) で返す
+
+        ファイルの終わりまで無ければ None を返す"""
+
+        pcr_pid = self.pcr_pid
+        for position, p in self.packets(offset, self.size):
+            if pid(p) == pcr_pid:
+                value = pcr(p)
+                if value is not None:
+                    return ticks(value), position
+        return None
+
+    def last_elapsed(self):
+        """ファイルの最後の PCR の経過"""
+
+        offset = self.size
+        while offset > 0:
+            offset = max(0, offset - READ_SIZE)
+            found = self.pcr_at(offset)
+            if found is not None:
+                return self.elapsed(found[0])
+        return 0
+
+    def seek_elapsed(self, target):
+        """PCR の経過が target 以上になる最初の位置を二分探索で求める"""
+
+        low = 0
+        high = self.size // PACKET_SIZE
+        while low < high:
+            middle = (low + high) // 2
+            found = self.pcr_at(middle * PACKET_SIZE)
+            if found is not None and self.elapsed(found[0]) < target:
+                low = found[1] // PACKET_SIZE + 1
+            else:
+                high = middle
+        found = self.pcr_at(low * PACKET_SIZE)
+        return self.size if found is None else found[1]
+
+    def clock(self, offset):
+        """offset 以降の TOT から (JST の日時, その時点の PCR の経過) を返す
+
+        TOT はセクションが揃った時点で取り出し、その直前に読んだ PCR と
+        対応させる"""
+
+        parser = SectionParser(TimeOffsetSection)
+        last_pcr = None
+        pcr_pid = self.pcr_pid
+        for _, p in self.packets(offset):
+            PID = pid(p)
+            if PID == pcr_pid:
+                value = pcr(p)
+                if value is not None:
+                    last_pcr = ticks(value)
+            if PID not in parser.table_map or last_pcr is None:
+                continue
+            for section in parser.feed(p):
+                if section.JST_time is not None:
+                    return section.JST_time, self.elapsed(last_pcr)
+        return None
+
+    def present(self, offset):
+        """offset 以降の EIT[p/f] から現在のイベントを (event, 位置) で返す
+
+        見つからなければ (None, ファイルの終わり) を返す"""
+
+        (present, _), position = self.present_following(offset)
+        return present, position
+
+    def present_following(self, offset):
+        """offset 以降の EIT[p/f] から ((現在のイベント, 次のイベント), 位置) を返す
+
+        位置は現在のイベントのセクションが揃ったパケットの位置。
+        イベントが無い場合は None とし、現在のイベントのセクションが
+        見つからなければ ((None, None), ファイルの終わり) を返す"""
+
+        parser = SectionParser(
+            ActualStreamPresentFollowingEventInformationSection)
+        found = {}
+        present_position = None
+        for position, p in self.packets(offset):
+            if pid(p) not in parser.table_map:
+                continue
+            for section in parser.feed(p):
+                number = section.section_number
+                if section.service_id != self.service_id or \
+                        number > 1 or number in found:
+                    continue
+                events = section.events
+                found[number] = events[0] if events else None
+                if number == 0:
+                    present_position = position
+            if len(found) == 2 and present_position is not None:
+                break
+        if present_position is None:
+            return (None, None), self.size
+        return (found[0], found.get(1)), present_position
+
+    def events(self, offset, size=PROBE_SIZE, latest=False):
+        """offset から size バイトの EIT[p/f] の現在と次のイベントのリスト
+
+        latest なら範囲の最後まで読んで最も新しいものを返す"""
+
+        parser = SectionParser(
+            ActualStreamPresentFollowingEventInformationSection)
+        result = {}
+        for _, p in self.packets(offset, size):
+            if pid(p) not in parser.table_map:
+                continue
+            for section in parser.feed(p):
+                if section.service_id == self.service_id:
+                    result[section.section_number] = section.events
+            if len(result) == 2 and not latest:
+                break
+        return [event for number in sorted(result) for event in result[number]]
+
+    def seek_transition(self, low, high, changed):
+        """[low, high) で EIT[p/f] の (現在, 次) のイベントが changed を満たす
+        最初の位置を二分探索で求める
+
+        changed はある位置より前では偽、以降では真になる条件とする。
+        見つからなければ TransitionNotFound を投げる"""
+
+        size = self.size
+        low //= PACKET_SIZE
+        high //= PACKET_SIZE
+        while low < high:
+            middle = (low + high) // 2
+            events, position = self.present_following(middle * PACKET_SIZE)
+            if position < size and changed(*events):
+                high = middle
+            else:
+                low = position // PACKET_SIZE + 1
+        events, position = self.present_following(low * PACKET_SIZE)
+        if position >= size or not changed(*events):
+            raise TransitionNotFound('no transition in EIT[p/f]')
+        return position
+
+    def random_access(self, offset, backward):
+        """offset の前 (backward) または後にある映像のランダムアクセス点
+
+        offset のパケット自体がランダムアクセス点ならそれを返し、
+        見つからなければ offset をそのまま返す"""
+
+        video_pid = self.video_pid or self.pcr_pid
+        if backward:
+            start = min(self.size, offset + PACKET_SIZE)
+            limit = max(0, offset - RANDOM_ACCESS_SEARCH)
+            while start > limit:
+                end, start = start, max(limit, start - READ_SIZE)
+                found = None
+                for position, p in self.packets(start, end - start):
+                    if pid(p) == video_pid and is_random_access(p):
+                        found = position
+                if found is not None:
+                    return found
+            return offset
+        for position, p in self.packets(offset, RANDOM_ACCESS_SEARCH):
+            if pid(p) == video_pid and is_random_access(p):
+                return position
+        return offset
+
+
+def is_random_access(packet):
+    """adaptation field の random_access_indicator が立っているかどうか"""
+
+    if not packet[3] & 0x20 or packet[4] == 0:
+        return False
+    return adaptation_field(packet).random_access_indicator == 1
+
+
+def find_event(recording, event_id=None):
+    """対象のイベントを探す
+
+    event_id を指定した場合は録画の先頭、中央、末尾の EIT[p/f] から探し
+    (末尾は最後に送られたものを使う)、
+    指定しない場合は録画の中央で放送中のイベントにする"""
+
+    middle = recording.size // 2 // PACKET_SIZE * PACKET_SIZE
+    if event_id is None:
+        event, _ = recording.present(middle)
+        return event
+    tail = max(0, recording.size - TAIL_SIZE)
+    probes = ((0, False), (middle, False), (tail, True))
+    for offset, latest in probes:
+        for event in recording.events(offset, latest=latest):
+            if event.event_id == event_id:
+                return event
+    return None
+
+
+def is_later(event, target):
+    """event が target より後に始まるイベントかどうか"""
+
+    return (event.start_time is not None and
+            target.start_time is not None and
+            event.start_time > target.start_time)
+
+
+def seek_start(recording, event, offset):
+    """offset で event が放送中でない場合に、event が始まる位置を求める
+
+    offset の現在と次のイベントから、event がまだ始まっていないのか、
+    既に始まっている (前の番組が早く終わった、event が早く終わった) のかを
+    判断して二分探索する。event が見つからなければ TransitionNotFound を投げる"""
+
+    event_id = event.event_id
+
+    def reached(present, following):
+        # event か、それより後のイベントになっているか。
+        # 番組の間 (現在のイベントが無い) は次のイベントで判断する
+        if present is None:
+            return following is not None and is_later(following, event)
+        return present.event_id == event_id or is_later(present, event)
+
+    (present, following), _ = recording.present_following(offset)
+    if reached(present, following):
+        low, high = 0, offset
+    else:
+        if present is not None and following is not None and \
+                following.event_id != event_id and \
+                is_later(following, event):
+            # 次のイベントが event より後なら、event は放送されない
+            raise TransitionNotFound(
+                'event {} is not followed by {}'.format(
+                    present.event_id, event_id))
+        low, high = offset, recording.size
+    position = recording.seek_transition(low, high, reached)
+    present, _ = recording.present(position)
+    if present is None or present.event_id != event_id:
+        raise TransitionNotFound('event {} is not on air'.format(event_id))
+    return position
+
+
+def seek_end(recording, event, offset):
+    """offset 以降で event が終わる位置。録画の最後まで続いていればファイルの終わり"""
+
+    event_id = event.event_id
+    try:
+        return recording.seek_transition(
+            offset, recording.size,
+            lambda present, _: present is None or present.event_id != event_id)
+    except TransitionNotFound:
+        return recording.size
+
+
+def locate(recording, event):
+    """イベントの (開始位置, 終了位置) を求める
+
+    開始位置で EIT[p/f] の現在のイベントが event でない場合は
+    (前の番組の延長や番組の間の空き、既に終わっているなど)、
+    EIT[p/f] の切り替わりから開始・終了位置を求める。
+    イベントが録画に含まれない場合は TransitionNotFound を投げる"""
+
+    event_id = event.event_id
+    start = 0
+    end = recording.size
+    clock = recording.clock(0)
+    if clock is not None and event.start_time is not None:
+        jst, elapsed = clock
+        begin = elapsed + ticks(event.start_time - jst)
+        if begin > 0:
+            start = recording.seek_elapsed(begin)
+        if event.duration is not None:
+            finish = begin + ticks(event.duration)
+            if finish <= recording.last_elapsed():
+                end = recording.seek_elapsed(finish)
+
+    present, _ = recording.present(start)
+    if present is None or present.event_id != event_id:
+        # EIT の時刻どおりではないので、終了位置も切り替わりから求める
+        start = seek_start(recording, event, start)
+        end = seek_end(recording, event, start)
+    elif end < recording.size:
+        # 番組が延長した場合
+        present, _ = recording.present(end)
+        if present is not None and present.event_id == event_id:
+            end = seek_end(recording, event, end)
+    if start >= end:
+        raise TransitionNotFound('event {} is not in the input'.format(
+            event_id))
+
+    start = recording.random_access(start, backward=True)
+    if end < recording.size:
+        end = recording.random_access(end, backward=False)
+    return start, end
+
+
+def copy_range(inpath, outpath, start, end):
+    """inpath の [start, end) を outpath にまとめてコピーする"""
+
+    with open(inpath, 'rb') as src, open(outpath, 'wb') as dst:
+        offset = start
+        try:
+            while offset < end:
+                sent = os.sendfile(dst.fileno(), src.fileno(), offset,
+                                   min(COPY_SIZE, end - offset))
+                if sent == 0:
+                    break
+                offset += sent
+        except (AttributeError, OSError):
+            # sendfile が使えない環境ではそのまま読み書きする
+            src.seek(offset)
+            while offset < end:
+                data = src.read(min(COPY_SIZE, end - offset))
+                if not data:
+                    break
+                dst.write(data)
+                offset += len(data)
+
+
+def cut(args):
+    """EIT のイベントの範囲だけを切り出す"""
+
+    try:
+        recording = Recording(args.inpath, args.service_id)
+    except ValueError as e:
+        # PCR や PMT、指定のサービスが見つからない
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    try:
+        event = find_event(recording, args.event_id)
+        if event is None:
+            print('event is not found', file=sys.stderr)
+            sys.exit(1)
+        start, end = locate(recording, event)
+    except TransitionNotFound as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        recording.close()
+    duration = event.duration or timedelta(0)
+    print('event_id {} {} +{} bytes {}-{}'.format(
+        event.event_id, event.start_time, duration, start, end),
+        file=sys.stderr)
+    copy_range(args.inpath, args.outpath, start, end)
+
+
+def add_parser(parsers):
+    parser = parsers.add_parser('cut')
+    parser.set_defaults(command=cut)
+    parser.add_argument('inpath', help='input file path')
+    parser.add_argument('outpath', help='output file path')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--event-id', type=lambda v: int(v, 0),
+                       help='cut the event with this event_id')
+    group.add_argument('--by-eit', action='store_true',
+                       help='cut the event on air in the middle of the input')
+    parser.add_argument('--service-id', type=lambda v: int(v, 0),
+                        help='service_id (default: the first one in PAT)')
@@ -0,0 +1,49 @@
+import sys
+
+from ariblib import tsopen
+from ariblib.logo import LOGO_SIZES, LogoCollector, LogoStore
+
+
+def logo(args):
+    """CDT の局ロゴを PNG として保存する
+
+    全ての入力を順に読む。入力ごとに、SDT にある全てのサービスのロゴが
+    揃った時点か CDT が一巡した時点でその入力の読み込みを止める
+    (--all を指定した場合は最後まで読む)。"""
+
+    store = LogoStore(args.outdir)
+    collector = LogoCollector(store, args.types)
+    # SDT を読めなかったか、ロゴが揃わないまま終わった入力があったか
+    incomplete = False
+    try:
+        for path in args.inpaths:
+            collector.reset()
+            with tsopen(path) as ts:
+                for packet in ts:
+                    for saved in collector.feed(packet):
+                        print(saved)
+                    if collector.done and not args.all:
+                        break
+            if not collector.done:
+                incomplete = True
+    finally:
+        store.save()
+    if incomplete:
+        print('some logos are not found', file=sys.stderr)
+    elif not collector.collected():
+        print('some logo types are not sent', file=sys.stderr)
+
+def add_parser(parsers):
+    parser = parsers.add_parser('logo')
+    parser.set_defaults(command=logo)
+    parser.add_argument('inpaths', nargs='+', metavar='inpath',
+                        help='input file paths')
+    parser.add_argument('outdir', help='output directory (with index.json)')
+    parser.add_argument('--types', metavar='LOGO_TYPE[,LOGO_TYPE...]',
+                        type=lambda v: [int(i, 0) for i in v.split(',')],
+                        default=list(LOGO_SIZES),
+                        help='logo_type values required for every service '
+                             '(default: 0-5; types not sent in a CDT cycle '
+                             'are given up)')
+    parser.add_argument('--all', action='store_true',
+                        help='read every input to the end')
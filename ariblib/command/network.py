@@ -0,0 +1,66 @@
+import json
+import sys
+
+from ariblib import tsopen
+from ariblib.network import NetworkDatabase
+
+
+def network(args):
+    """NIT, SDT, BIT からネットワーク・TS・サービスの一覧を JSON で出力する
+
+    全ての入力を順に読み、入力ごとに、その入力のテーブルが揃った時点で
+    その入力の読み込みを止めて次の入力に進む"""
+
+    database = NetworkDatabase(other_streams=args.other_streams)
+    for path in args.inpaths:
+        with tsopen(path) as ts:
+            database.scan(ts)
+    if not database.complete:
+        print('some tables are incomplete', file=sys.stderr)
+
+    result = {
+        'networks': [
+            {'network_id': item.network_id, 'name': item.name}
+            for _, item in sorted(database.networks.items())
+        ],
+        'transport_streams': [
+            {'original_network_id': item.original_network_id,
+             'transport_stream_id': item.transport_stream_id,
+             'network_id': item.network_id,
+             'name': item.name,
+             'remote_control_key_id': item.remote_control_key_id,
+             'delivery_system': item.delivery_system,
+             'frequency': item.frequency,
+             'channel': item.channel}
+            for _, item in sorted(database.transport_streams.items())
+        ],
+        'services': [
+            {'original_network_id': item.original_network_id,
+             'transport_stream_id': item.transport_stream_id,
+             'service_id': item.service_id,
+             'service_type': item.service_type,
+             'provider': item.provider,
+             'name': item.name,
+             'logo_id': item.logo_id,
+             'channel': item.channel}
+            for item in database.services()
+        ],
+        'broadcasters': [
+            {'original_network_id': item.original_network_id,
+             'broadcaster_id': item.broadcaster_id,
+             'name': item.name}
+            for _, item in sorted(database.broadcasters.items())
+        ],
+    }
+    json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+
+
+def add_parser(parsers):
+    parser = parsers.add_parser('network')
+    parser.set_defaults(command=network)
+    parser.add_argument('inpaths', nargs='+', metavar='inpath',
+                        help='input file paths')
+    parser.add_argument('--other-streams', action='store_true',
+                        help='also wait for SDT of every transport stream '
+                             'in NIT')
@@ -0,0 +1,48 @@
+import sys
+
+from ariblib.packet import LiveTransportStreamFile
+from ariblib.ring import OVERRUN_POLICIES, RingBufferWriter
+
+
+def ring(args):
+    """TS を読みながら共有メモリのリングバッファに書き込む"""
+
+    if args.inpath == '-':
+        inpath = sys.stdin.fileno()
+    else:
+        inpath = args.inpath
+    with RingBufferWriter(args.name, capacity=args.capacity,
+                          consumers=args.consumers, overrun=args.overrun,
+                          stall_timeout=args.stall_timeout) as writer:
+        if args.wait and not writer.wait(args.wait, args.wait_timeout):
+            print('only {} consumers attached'.format(writer.attached()),
+                  file=sys.stderr)
+        with LiveTransportStreamFile(inpath,
+                                     idle_timeout=args.idle_timeout) as ts:
+            writer.write_from(ts)
+
+
+def add_parser(parsers):
+    parser = parsers.add_parser('ring')
+    parser.set_defaults(command=ring)
+    parser.add_argument('inpath', help='input file path (- for stdin)')
+    parser.add_argument('name', help='shared memory name')
+    parser.add_argument('--capacity', type=int, default=1 << 16,
+                        help='number of packets in the ring buffer')
+    parser.add_argument('--consumers', type=int, default=4,
+                        help='number of consumer slots')
+    parser.add_argument('--overrun', choices=OVERRUN_POLICIES,
+                        default='block',
+                        help='wait for slow consumers (block) or let them '
+                             'skip packets (drop)')
+    parser.add_argument('--stall-timeout', type=float,
+                        help='detach a consumer that does not advance for '
+                             'this many seconds (block)')
+    parser.add_argument('--wait', type=int, default=0,
+                        help='wait until this many consumers attach')
+    parser.add_argument('--wait-timeout', type=float,
+                        help='give up waiting for consumers after this many '
+                             'seconds')
+    parser.add_argument('--idle-timeout', type=float, default=10,
+                        help='stop after the input file stops growing for '
+                             'this many seconds')
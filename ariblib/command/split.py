@@ -1,67 +1,307 @@
-import itertools
-import struct
+import os
+import sys
 
 from ariblib import packet, tsopen
-from ariblib.sections import ProgramAssociationSection, ProgramMapSection
+from ariblib.encoder import SectionPacketizer, encode, raw_bytes
+from ariblib.packet import SectionParser
+from ariblib.sections import (EventInformationSection,
+                              ProgramAssociationSection, ProgramMapSection)
 
+# サービスごとに書き出す場合に各出力に残す SI の PID (NIT, SDT/BAT, TDT/TOT)
+SI_PIDS = (0x10, 0x11, 0x14)
 
-def bits(data):
-    masks = range(7, -1, -1)
-    return ((x >> mask) & 0x01 for x, mask in itertools.product(data, masks))
+# EIT の PID (地上デジタルの EIT を含む)。セクションを組み立て、
+# そのサービスの EIT だけを出力ごとにパケットにし直す
+EIT_PIDS = tuple(EventInformationSection._pids)
 
+# PMT が揃うまでに溜めておくパケット数の上限
+MAX_PENDING = 100000
 
-def crc32(data):
-    """CRC32を計算する"""
+# 出力ごとにまとめて書き込むパケット数
+WRITE_PACKETS = 2048
 
-    crc = 0xFFFFFFFF
-    for bit in bits(data):
-        c = 1 if crc & 0x80000000 else 0
-        crc <<= 1
-        if c ^ bit:
-            crc ^= 0x04c11db7
-        crc &= 0xFFFFFFFF
-    return crc
 
+def make_pat(pat, program_number, pmt_pid):
+    """元の PAT から、NIT と指定のサービスだけを含む PAT のセクションを作る"""
 
-def replace_pat(pat):
-    new_pat = bytearray(pat[:16])
-    new_pat[2] = 0x11
-    crc = crc32(new_pat)
-    new_pat.extend(struct.pack('>L', crc))
-    new_pat.extend([0xFF] * 163)
-    return new_pat
+    pids = [{'program_number': 0, 'program_map_PID': item.program_map_PID}
+            for item in pat.pids if item.program_number == 0]
+    pids.append({'program_number': program_number,
+                 'program_map_PID': pmt_pid})
+    return encode(ProgramAssociationSection, {
+        'transport_stream_id': pat.transport_stream_id,
+        'version_number': pat.version_number,
+        'pids': pids,
+    })
+
+
+def output_path(outpath, service_id):
+    """サービスごとの出力先のパス
+
+    outpath に {service_id} があればそこに、無ければ拡張子の前に service_id を入れる"""
+
+    if '{service_id' in outpath:
+        return outpath.format(service_id=service_id)
+    root, ext = os.path.splitext(outpath)
+    return '{}_{}{}'.format(root, service_id, ext)
+
+
+class Output(object):
+
+    """サービスひとつぶんの出力先
+
+    si_pids はそのまま残す SI の PID。mode はファイルを開くモードで、
+    PAT から一度消えたサービスが戻ってきた場合は追記する"""
+
+    def __init__(self, path, service_id, pmt_pid, si_pids=(), mode='wb'):
+        self.path = path
+        self.service_id = service_id
+        self.si_pids = si_pids
+        self.pmt_pid = pmt_pid
+        self.pids = set(si_pids)
+        self.pids.add(pmt_pid)
+        # 置き換え後の PAT のセクション
+        self.pat = None
+        self.pat_packetizer = SectionPacketizer(
+            ProgramAssociationSection._pids[0])
+        # PID ごとの EIT の SectionPacketizer
+        self.eit_packetizers = {}
+        self.ready = False
+        self.buffer = []
+        self.file = open(path, mode)
+
+    def set_pmt_pid(self, pmt_pid):
+        """PMT の PID が変わった場合は、新しい PMT が届くまで PMT と SI だけを残す"""
+
+        if pmt_pid == self.pmt_pid:
+            return
+        self.pmt_pid = pmt_pid
+        self.pids = set(self.si_pids)
+        self.pids.add(pmt_pid)
+
+    def write(self, p):
+        # まとめて書き出すまで取っておくのでコピーする (bytes ならそのまま)
+        self.buffer.append(bytes(p))
+        if len(self.buffer) >= WRITE_PACKETS:
+            self.flush()
+
+    def write_eit(self, PID, section):
+        packetizer = self.eit_packetizers.get(PID)
+        if packetizer is None:
+            packetizer = SectionPacketizer(PID)
+            self.eit_packetizers[PID] = packetizer
+        for p in packetizer.packetize(raw_bytes(section)):
+            self.write(p)
+
+    def flush(self):
+        self.file.write(b''.join(self.buffer))
+        self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class Splitter(object):
+
+    """入力を1回読むだけで、サービスごとに必要なストリームを書き出す
+
+    services が None なら PAT の最初のサービスの PMT・PCR・映像・音声などだけを
+    outpath に書き出す。'all' なら全てのサービスを、service_id の集合なら
+    それらをサービスごとのファイルに書き出し、NIT・SDT・TOT とそのサービスの
+    EIT も残す。
+    全ての出力の PMT が揃うまでは入力のパケットを溜めておき、
+    揃った時点で先頭から振り分ける。
+    PAT が更新されると、消えたサービスの出力は閉じ、PMT の PID の変更に追従する。
+    """
+
+    def __init__(self, outpath, services=None):
+        self.outpath = outpath
+        self.services = services
+        self.parser = SectionParser(ProgramAssociationSection)
+        self.eit_parser = None
+        self.si_pids = ()
+        if services is not None:
+            self.eit_parser = SectionParser(EventInformationSection)
+            self.si_pids = SI_PIDS
+        self.pat_version = None
+        # service_id ごとの出力
+        self.outputs = {}
+        # PAT から消えて閉じた出力の service_id
+        self.closed = set()
+        # PID ごとの出力先のリスト
+        self.routes = {}
+        self.pending = []
+
+    def feed(self, p):
+        if packet.pid(p) in self.parser.table_map:
+            for section in self.parser.feed(p):
+                if section.table_id == ProgramAssociationSection._table_ids[0]:
+                    self._on_pat(section)
+                else:
+                    self._on_pmt(section)
+
+        if self.pending is None:
+            self._write(p)
+            return
+        # 入力 (共有メモリのリングバッファなど) はパケットを再利用することが
+        # あるので、取っておくパケットはコピーする (bytes ならそのまま)
+        self.pending.append(bytes(p))
+        if self.outputs and all(output.ready
+                                for output in self.outputs.values()):
+            self._flush_pending()
+        elif len(self.pending) >= MAX_PENDING:
+            # PMT が見つからないサービスがあっても書き出しを始める
+            self._flush_pending()
+
+    def close(self):
+        if self.pending:
+            self._flush_pending()
+        for output in self.outputs.values():
+            output.close()
+        if isinstance(self.services, set):
+            found = set(self.outputs) | self.closed
+            for service_id in self.services - found:
+                print('service_id {} is not found'.format(service_id),
+                      file=sys.stderr)
+
+    def _flush_pending(self):
+        pending, self.pending = self.pending, None
+        for p in pending:
+            self._write(p)
+
+    def _write(self, p):
+        PID = packet.pid(p)
+        if PID == ProgramAssociationSection._pids[0]:
+            if packet.payload_unit_start_indicator(p):
+                for output in self.outputs.values():
+                    if output.pat is not None:
+                        for pat in output.pat_packetizer.packetize(
+                                output.pat):
+                            output.write(pat)
+            return
+        if self.eit_parser is not None and PID in EIT_PIDS:
+            for section in self.eit_parser.feed(p):
+                output = self.outputs.get(section.service_id)
+                if output is not None:
+                    output.write_eit(PID, section)
+            return
+        for output in self.routes.get(PID, ()):
+            output.write(p)
+
+    def _on_pat(self, pat):
+        if pat.version_number == self.pat_version:
+            return
+        self.pat_version = pat.version_number
+        programs = list(pat.pmt_items)
+        if self.services is None:
+            programs = programs[:1]
+        elif self.services != 'all':
+            programs = [program for program in programs
+                        if program[0] in self.services]
+
+        # PAT から消えたサービス
+        spare = None
+        current = set(service_id for service_id, _ in programs)
+        for service_id in list(self.outputs):
+            if service_id in current:
+                continue
+            output = self.outputs.pop(service_id)
+            if self.services is None:
+                # 最初のサービスが変わった場合は同じファイルに続けて書く
+                spare = output
+            else:
+                output.close()
+                self.closed.add(service_id)
+
+        for service_id, pmt_pid in programs:
+            output = self.outputs.get(service_id)
+            if output is None and spare is not None:
+                output, spare = spare, None
+                output.service_id = service_id
+                output.set_pmt_pid(pmt_pid)
+                output.ready = False
+            elif output is None:
+                path = self.outpath
+                mode = 'wb'
+                if self.services is not None:
+                    path = output_path(self.outpath, service_id)
+                    if service_id in self.closed:
+                        mode = 'ab'
+                        self.closed.discard(service_id)
+                output = Output(path, service_id, pmt_pid, self.si_pids,
+                                mode)
+            else:
+                output.set_pmt_pid(pmt_pid)
+            self.outputs[service_id] = output
+            output.pat = make_pat(pat, service_id, pmt_pid)
+
+        # 使わなくなった PMT の PID を外す
+        pmt_pids = set(output.pmt_pid for output in self.outputs.values())
+        for PID in list(self.parser.table_map):
+            if PID not in ProgramAssociationSection._pids and \
+                    PID not in pmt_pids:
+                self.parser.discard(PID)
+        for PID in pmt_pids:
+            if PID not in self.parser.table_map:
+                self.parser.add(ProgramMapSection, [PID])
+        self._update_routes()
+
+    def _on_pmt(self, pmt):
+        output = self.outputs.get(pmt.program_number)
+        if output is None:
+            return
+        # PCR と各ストリーム (データ放送を除く) の PID を残す
+        pids = set(output.si_pids)
+        pids.add(output.pmt_pid)
+        pids.add(pmt.PCR_PID)
+        pids.update(pmt_map.elementary_PID for pmt_map in pmt.maps
+                    if pmt_map.stream_type != 0x0d)
+        output.pids = pids
+        output.ready = True
+        self._update_routes()
+
+    def _update_routes(self):
+        routes = {}
+        for output in self.outputs.values():
+            for PID in output.pids:
+                routes.setdefault(PID, []).append(output)
+        self.routes = routes
 
 
 def split(args):
-    """必要なストリームのみ残す"""
-
-    remained_pids = set()
-    with tsopen(args.inpath) as ts:
-        pat = next(ts.sections(ProgramAssociationSection))
-        # 置き換え後の新しいPAT
-        new_pat = replace_pat(pat._packet)
-        remained_pmt_pid = next(pat.pmt_pids)
-        remained_pids.add(remained_pmt_pid)
-        ProgramMapSection._pids = [remained_pmt_pid]
-        pmt = next(ts.sections(ProgramMapSection))
-        # PCRと最初のストリームのPIDを残す
-        remained_pids.add(pmt.PCR_PID)
-        remained_pids.update(pmt_map.elementary_PID for pmt_map in pmt.maps
-                             if pmt_map.stream_type != 0x0d)
-
-    pat_pid = ProgramAssociationSection._pids[0]
-    with tsopen(args.inpath) as ts, open(args.outpath, 'wb') as out:
-        for p in ts:
-            pid = packet.pid(p)
-            if pid == pat_pid:
-                out.write(p[:5])
-                out.write(new_pat)
-            elif pid in remained_pids:
-                out.write(p)
+    """必要なストリームのみ残す
+
+    --all-services または --services を指定した場合はサービスごとに別のファイルに
+    書き出す。いずれの場合も入力は1回だけ読み込む。"""
+
+    services = None
+    if args.all_services:
+        services = 'all'
+    elif args.services:
+        services = set(args.services)
+
+    splitter = Splitter(args.outpath, services)
+    try:
+        with tsopen(args.inpath) as ts:
+            for p in ts:
+                splitter.feed(p)
+    finally:
+        splitter.close()
 
 
 def add_parser(parsers):
     parser = parsers.add_parser('split')
     parser.set_defaults(command=split)
     parser.add_argument('inpath', help='input file path')
-    parser.add_argument('outpath', help='output file path')
+    parser.add_argument(
+        'outpath',
+        help='output file path. with --all-services or --services, '
+             'the service_id is inserted before the extension '
+             '(or replaces {service_id})')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--all-services', action='store_true',
+                       help='write every service to its own file')
+    group.add_argument('--services', metavar='SERVICE_ID[,SERVICE_ID...]',
+                       type=lambda v: [int(i, 0) for i in v.split(',')],
+                       help='write the given services to their own files')
@@ -1,49 +1,200 @@
-from datetime import datetime, timedelta
-from hashlib import md5
-import os.path
+from datetime import datetime
+import os
 import sys
 
 from ariblib import tsopen
-from ariblib.caption import WebVTTCProfileString
-from ariblib.packet import SynchronizedPacketizedElementaryStream
-from ariblib.sections import TimeOffsetSection
-from ariblib.mnemonics import hexdump
+from ariblib.caption import CaptionStream, WebVTTCProfileString
+from ariblib.packet import LiveTransportStreamFile, pid
+
+
+def timestamp(seconds):
+    """秒数を WebVTT のタイムスタンプ (HH:MM:SS.mmm) にする"""
+
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return '{:02d}:{:02d}:{:02d}.{:03d}'.format(
+        hours, minutes, seconds, milliseconds)
+
+
+class LiveSegmenter(object):
+
+    """字幕を一定時間ごとの WebVTT ファイルに分割し、HLS のプレイリストを書き出す
+
+    時刻はすべて最初の PCR からの秒数で扱い、各セグメントには
+    その PCR を MPEGTS とする X-TIMESTAMP-MAP を付ける。
+    字幕は次の字幕を受信した時点か、セグメントが閉じる時点で書き出す。
+    セグメントをまたぐ字幕は次のセグメントにも書き出す。
+    """
+
+    def __init__(self, outdir, base_pcr, segment_duration=2, list_size=0,
+                 name='subtitles'):
+        self.outdir = outdir
+        self.name = name
+        self.segment_duration = segment_duration
+        self.list_size = list_size
+        # X-TIMESTAMP-MAP の MPEGTS は 90kHz で 33bit
+        self.mpegts = int(round(base_pcr.total_seconds() * 90000)) % 2 ** 33
+        self.number = 1
+        self.sequence = 0
+        self.segments = []
+        self.pending = None
+        self.out = None
+        self._open()
+
+    def add(self, seconds, text):
+        """seconds 秒に表示された字幕を追加する"""
+
+        self.advance(seconds)
+        self._flush_pending(seconds)
+        if text:
+            self.pending = (seconds, text)
+
+    def advance(self, seconds):
+        """seconds 秒までに終わったセグメントを閉じる"""
+
+        while seconds >= self.segment_end:
+            end = self.segment_end
+            pending = self.pending
+            self._flush_pending(end)
+            self._close(self.segment_duration)
+            self._open()
+            if pending is not None:
+                self.pending = (end, pending[1])
+
+    def close(self, seconds=None):
+        """残った字幕を書き出し、プレイリストを終了する"""
+
+        duration = self.segment_duration
+        if seconds is not None:
+            self.advance(seconds)
+            self._flush_pending(seconds)
+            duration = seconds - self.sequence * self.segment_duration
+        self._close(duration, last=True)
+
+    @property
+    def segment_end(self):
+        return (self.sequence + 1) * self.segment_duration
+
+    def _segment_name(self, sequence):
+        return '{}{:05d}.vtt'.format(self.name, sequence)
+
+    def _open(self):
+        path = os.path.join(self.outdir, self._segment_name(self.sequence))
+        self.out = open(path, 'w')
+        self.out.write('WEBVTT\nX-TIMESTAMP-MAP=MPEGTS:{},'
+                       'LOCAL:00:00:00.000\n\n'.format(self.mpegts))
+        self.out.flush()
+
+    def _flush_pending(self, end):
+        if self.pending is None:
+            return
+        start, text = self.pending
+        if start < end:
+            self.out.write('{}\n{} --> {}\n{}\n\n'.format(
+                self.number, timestamp(start), timestamp(end), text))
+            self.out.flush()
+            self.number += 1
+        self.pending = None
+
+    def _close(self, duration, last=False):
+        self.out.close()
+        self.segments.append((self._segment_name(self.sequence), duration))
+        self.sequence += 1
+        if self.list_size:
+            del self.segments[:-self.list_size]
+        self._write_playlist(last)
+
+    def _write_playlist(self, last):
+        first = self.sequence - len(self.segments)
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            '#EXT-X-TARGETDURATION:{}'.format(
+                int(-(-self.segment_duration // 1))),
+            '#EXT-X-MEDIA-SEQUENCE:{}'.format(first),
+        ]
+        for segment, duration in self.segments:
+            lines.append('#EXTINF:{:.3f},'.format(duration))
+            lines.append(segment)
+        if last:
+            lines.append('#EXT-X-ENDLIST')
+        path = os.path.join(self.outdir, self.name + '.m3u8')
+        # 書き込み途中のプレイリストを読まれないように置き換える
+        with open(path + '.tmp', 'w') as out:
+            out.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
+
+
+def live(args):
+    """追記されている TS または標準入力から HLS 用の WebVTT を逐次書き出す"""
+
+    if args.inpath == '-':
+        inpath = sys.stdin.fileno()
+    else:
+        inpath = args.inpath
+    os.makedirs(args.outpath, exist_ok=True)
+    base_time = datetime(2000, 1, 1)
+    stream = CaptionStream(WebVTTCProfileString, base_time=base_time,
+                           drcs=False)
+    clock = stream.clock
+
+    def elapsed():
+        # 字幕と同じく clock の日本時間から求めるので、PCR が一周したり
+        # 不連続になったりしても戻らない
+        return (clock.datetime(clock.position) - base_time).total_seconds()
+
+    segmenter = None
+    with LiveTransportStreamFile(inpath,
+                                 idle_timeout=args.idle_timeout) as ts:
+        for packet in ts:
+            captions = stream.feed(packet)
+            if stream.base_pcr is None:
+                continue
+            if segmenter is None:
+                segmenter = LiveSegmenter(
+                    args.outpath, stream.base_pcr, args.segment_duration,
+                    args.list_size)
+            for caption in captions:
+                segmenter.add(
+                    (caption.datetime - base_time).total_seconds(),
+                    str(caption.body))
+            if pid(packet) == stream.pcr_pid:
+                segmenter.advance(elapsed())
+    if segmenter is not None:
+        segmenter.close(elapsed())
 
 
 def vtt(args):
+    if args.live:
+        return live(args)
     if args.outpath == '-':
         outpath = sys.stdout.fileno()
     else:
         outpath = args.outpath
     with tsopen(args.inpath) as ts, open(outpath, 'w') as out:
-        SynchronizedPacketizedElementaryStream._pids = [ts.get_caption_pid()]
-
-        base_pcr = next(ts.pcrs())
-        base_time = next(ts.sections(TimeOffsetSection)).JST_time
+        # 最初の PCR を 00:00:00 とする
+        base_date = datetime(2000, 1, 1)
+        stream = CaptionStream(WebVTTCProfileString, base_time=base_date,
+                               drcs=False)
 
         out.write('WEBVTT\n\n')
         number = 1
-        base_date = datetime(2000, 1, 1)
-        #fixme: DRCS処理を隠蔽して字幕文字オブジェクトだけ返すラッパークラスが必要
-        # for caption in ts.captions(drcs=True, color=True):
-        #     print(caption.datetime, caption.body) みたいな
         prev_caption_date = None
         prev_caption = ''
-        for spes in ts.sections(SynchronizedPacketizedElementaryStream):
-            caption_date = base_date + (spes.pts - base_pcr)
-            for data in spes.data_units:
-                if data.data_unit_parameter == 0x20:
-                    caption = WebVTTCProfileString(data.data_unit_data)
-                    if prev_caption_date:
-                        out.write('{}\n{}.{:03d} --> {}.{:03d}\n{}\n\n'.format(
-                            number, prev_caption_date.strftime('%H:%M:%S'),
-                            prev_caption_date.microsecond // 1000,
-                            caption_date.strftime('%H:%M:%S'),
-                            caption_date.microsecond // 1000,
-                            prev_caption))
-                    number += 1
-                    prev_caption_date = caption_date
-                    prev_caption = caption
+        for caption in stream.captions(ts):
+            caption_date = caption.datetime
+            if prev_caption_date:
+                out.write('{}\n{}.{:03d} --> {}.{:03d}\n{}\n\n'.format(
+                    number, prev_caption_date.strftime('%H:%M:%S'),
+                    prev_caption_date.microsecond // 1000,
+                    caption_date.strftime('%H:%M:%S'),
+                    caption_date.microsecond // 1000,
+                    prev_caption))
+            number += 1
+            prev_caption_date = caption_date
+            prev_caption = caption.body
         if prev_caption:
             out.write('{}\n{}.{:03d} --> {}.{:03d}\n{}\n\n'.format(
                 number, prev_caption_date.strftime('%H:%M:%S'),
@@ -57,4 +208,16 @@ def add_parser(parsers):
     parser = parsers.add_parser('vtt')
     parser.set_defaults(command=vtt)
     parser.add_argument('inpath', help='input file path')
-    parser.add_argument('outpath', help='output file path')
+    parser.add_argument('outpath',
+                        help='output file path (output directory with --live)')
+    parser.add_argument('--live', action='store_true',
+                        help='read a growing file or stdin and write '
+                             'segmented WebVTT with an HLS playlist')
+    parser.add_argument('--segment-duration', type=float, default=2,
+                        help='segment duration in seconds (--live)')
+    parser.add_argument('--list-size', type=int, default=0,
+                        help='number of segments kept in the playlist, '
+                             '0 keeps all (--live)')
+    parser.add_argument('--idle-timeout', type=float, default=10,
+                        help='stop after the input file stops growing for '
+                             'this many seconds (--live)')
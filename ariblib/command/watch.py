@@ -0,0 +1,64 @@
+import json
+import sys
+
+from ariblib.descriptors import ShortEventDescriptor
+from ariblib.packet import LiveTransportStreamFile
+from ariblib.watch import ProgramWatcher
+
+
+def change_to_dict(change):
+    """ProgramChange を JSON にできる辞書にする"""
+
+    result = {
+        'packet': change.packets,
+        'latency': change.latency,
+        'service_id': change.service_id,
+        'section_number': change.section_number,
+        'version_number': change.version_number,
+        'event_id': change.event_id,
+        'previous_event_id': None,
+        'previous_version_number': None,
+    }
+    if change.previous is not None:
+        result['previous_event_id'], result['previous_version_number'] = \
+            change.previous
+    event = change.event
+    if event is not None:
+        start_time = event.start_time
+        duration = event.duration
+        result['start_time'] = start_time and start_time.isoformat()
+        result['duration'] = duration and duration.total_seconds()
+        for descriptor in event.descriptors.get(ShortEventDescriptor, []):
+            result['name'] = str(descriptor.event_name_char)
+    return result
+
+
+def watch(args):
+    """追記されている TS または標準入力から番組の切り替わりを1行ずつ JSON で出力する"""
+
+    if args.inpath == '-':
+        inpath = sys.stdin.fileno()
+    else:
+        inpath = args.inpath
+    section_numbers = (0,) if args.present_only else (0, 1)
+    watcher = ProgramWatcher(args.services, section_numbers)
+    with LiveTransportStreamFile(inpath,
+                                 idle_timeout=args.idle_timeout) as ts:
+        for packet in ts:
+            for change in watcher.feed(packet):
+                print(json.dumps(change_to_dict(change), ensure_ascii=False),
+                      flush=True)
+
+
+def add_parser(parsers):
+    parser = parsers.add_parser('watch')
+    parser.set_defaults(command=watch)
+    parser.add_argument('inpath', help='input file path (- for stdin)')
+    parser.add_argument('--services', metavar='SERVICE_ID[,SERVICE_ID...]',
+                        type=lambda v: [int(i, 0) for i in v.split(',')],
+                        help='comma separated service_ids to watch')
+    parser.add_argument('--present-only', action='store_true',
+                        help='ignore changes of the following event')
+    parser.add_argument('--idle-timeout', type=float, default=10,
+                        help='stop after the input file stops growing for '
+                             'this many seconds')
@@ -1,7 +1,8 @@
 """記述子の実装"""
 
-from collections import defaultdict
+from collections.abc import Mapping
 
+from ariblib import stats
 from ariblib.mnemonics import (
     aribstr,
     bcd,
@@ -31,24 +32,98 @@ def tag(tag_id):
 
 class descriptors(mnemonic):
 
-    """記述子リスト"""
+    """記述子リスト
+
+    記述子の (タグ, 開始位置) の索引だけを作り、記述子クラスごとの解析は
+    DescriptorIndex で参照された時に行う。
+    セクションに解析対象のタグ (_descriptor_tags) が指定されている場合は
+    それ以外のタグを索引に含めない。"""
 
     @cache
     def __get__(self, instance, owner):
+        packet = instance._packet
         length = self.real_length(instance) // 8
         start = self.start(instance) // 8
         end = start + length
-        result = defaultdict(list)
+        wanted = instance._descriptor_tags
+        entries = []
         while start < end:
-            descriptor_tag = instance._packet[start]
-            descriptor_length = instance._packet[start + 1] + 2
-            block_end = start + descriptor_length
-            desc_class = Descriptor.get(descriptor_tag)
-            inner = desc_class(instance._packet[start:block_end])
-            result[desc_class].append(inner)
-            start = block_end
+            descriptor_tag = packet[start]
+            if wanted is None or descriptor_tag in wanted:
+                entries.append((descriptor_tag, start))
+            start += packet[start + 1] + 2
+        return DescriptorIndex(packet, entries)
+
+
+class DescriptorIndex(Mapping):
+
+    """記述子クラスから、その記述子のリストを引く辞書
+
+    記述子は参照された記述子クラスの分だけ、パケットを複製せずに解析する。
+    含まれない記述子クラスを [] で参照すると空のリストを返す
+    (以前の defaultdict(list) と同じ)。"""
+
+    def __init__(self, packet, entries):
+        self._packet = packet
+        self._entries = entries
+        self._parsed = {}
+        self._classes = None
+
+    def classes(self):
+        """含まれる記述子クラスを出現順に返す"""
+
+        if self._classes is None:
+            classes = {}
+            for descriptor_tag, _ in self._entries:
+                classes.setdefault(Descriptor.get(descriptor_tag), None)
+            self._classes = list(classes)
+        return self._classes
+
+    def __getitem__(self, desc_class):
+        result = self._parsed.get(desc_class)
+        if result is None:
+            counting = stats.enabled
+            result = []
+            for descriptor_tag, start in self._entries:
+                if Descriptor.get(descriptor_tag) is desc_class:
+                    if counting:
+                        stats.count('descriptors', descriptor_tag)
+                    result.append(desc_class(self._packet, pos=start * 8))
+            self._parsed[desc_class] = result
         return result
 
+    def raw(self):
+        """記述子のバイト列を出現順に返す (解析対象外のタグのものは含まない)"""
+
+        packet = self._packet
+        return [bytes(packet[start:start + packet[start + 1] + 2])
+                for _, start in self._entries]
+
+    def get(self, desc_class, default=None):
+        if desc_class in self:
+            return self[desc_class]
+        return default
+
+    def __contains__(self, desc_class):
+        return desc_class in self.classes()
+
+    def __iter__(self):
+        return iter(self.classes())
+
+    def __len__(self):
+        return len(self.classes())
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, dict(self))
+
+
+def descriptor_tags(Descriptors):
+    """記述子クラスまたはタグの並びを、解析対象のタグの集合にする"""
+
+    if Descriptors is None:
+        return None
+    return frozenset(getattr(item, '_tag', item) for item in Descriptors)
+
 
 class Descriptor(Syntax):
 
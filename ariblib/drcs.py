@@ -1,63 +1,201 @@
-from hashlib import md5
+"""DRCS (外字) パターンの展開と保存
 
-try:
-    from PIL import Image
-    from PIL.ImageDraw import Draw
-except ImportError:
-    text_output = True
-else:
-    text_output = False
+import しただけではファイルシステムに触れず、PIL や numpy、hashlib、csv も
+読み込まない。対応表の読み込み、保存先ディレクトリの作成、PIL の読み込みは
+それぞれ初めて必要になった時に行う。
+"""
 
-import csv
+import atexit
 import os.path
+import queue
+import sys
+import threading
 
 import ariblib
 
 save_dir = os.path.expanduser('~/.ariblib/drcs/')
 mapping_path = os.path.join((os.path.split(ariblib.__file__)[0]), 'drcs.tsv')
 user_mapping_path = os.path.expanduser('~/.ariblib/drcs.tsv')
-mapping = {}
 
-# DRCSイメージ保存ディレクトリが存在しない場合は作成する
-if not os.path.isdir(save_dir):
-    import os
-    os.makedirs(save_dir)
+# 初めて使う時に読み込むもの
+Image = None
+_mapping = None
+_renderer = None
+_numpy = None
 
-for path in (mapping_path, user_mapping_path):
-    try:
-        with open(path) as f:
-            reader = csv.reader(f, delimiter='\t')
-            mapping.update(line for line in reader)
-    except IOError:
-        pass
+
+def get_mapping():
+    """DRCS のハッシュから文字への対応表を返す
+
+    同梱の対応表とユーザーの対応表を初回だけ読み込み、以降は同じ辞書を返す"""
+
+    global _mapping
+    if _mapping is None:
+        import csv
+        mapping = {}
+        for path in (mapping_path, user_mapping_path):
+            try:
+                with open(path) as f:
+                    reader = csv.reader(f, delimiter='\t')
+                    mapping.update(line for line in reader)
+            except IOError:
+                pass
+        _mapping = mapping
+    return _mapping
+
+
+def renderer():
+    """DRCS の画像を作るクラスを返す
+
+    PIL が使えなければテキスト出力を行う DRCSText を返す"""
+
+    global Image, _renderer
+    if _renderer is None:
+        try:
+            from PIL import Image
+        except ImportError:
+            _renderer = DRCSText
+        else:
+            _renderer = DRCSImage
+    return _renderer
+
+
+def _get_numpy():
+    """numpy があれば返す。無ければ False"""
+
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+        _numpy = numpy
+    return _numpy
+
+
+def pattern_hash(pattern_data):
+    """DRCS のパターンデータから対応表で使うハッシュを求める"""
+
+    from hashlib import md5
+    return md5(pattern_data).hexdigest()
+
+
+def _ensure_save_dir():
+    """DRCSイメージ保存ディレクトリが存在しない場合は作成する"""
+
+    if not os.path.isdir(save_dir):
+        os.makedirs(save_dir, exist_ok=True)
+
+
+def __getattr__(name):
+    # 以前はモジュール変数だったものを、初めて参照された時に求める
+    if name == 'mapping':
+        return get_mapping()
+    if name == 'text_output':
+        return renderer() is DRCSText
+    raise AttributeError(
+        "module '{}' has no attribute '{}'".format(__name__, name))
+
+
+def depth_bits(depth):
+    """階調数 (depth + 2) を表すのに必要な1画素あたりのビット数"""
+
+    return (depth + 1).bit_length()
+
+
+# 1バイトを画素値の並びに展開する表 (1画素あたりのビット数ごと)
+_unpack_tables = {}
+
+
+def _unpack_table(bits):
+    table = _unpack_tables.get(bits)
+    if table is None:
+        count = 8 // bits
+        mask = (1 << bits) - 1
+        table = [
+            bytes((byte >> (8 - bits * (i + 1))) & mask for i in range(count))
+            for byte in range(256)
+        ]
+        _unpack_tables[bits] = table
+    return table
+
+
+def unpack(pattern_data, width, height, depth=0):
+    """詰められたパターンデータを1画素1バイトの階調値の並びに展開する
+
+    numpy があれば unpackbits で、無ければバイトごとの展開表でまとめて展開する"""
+
+    bits = depth_bits(depth)
+    size = width * height
+    pattern_data = bytes(pattern_data).ljust((size * bits + 7) // 8, b'\x00')
+    numpy = _get_numpy()
+    if numpy:
+        plane = numpy.unpackbits(numpy.frombuffer(pattern_data, numpy.uint8))
+        plane = plane[:size * bits]
+        if bits > 1:
+            weights = 1 << numpy.arange(bits - 1, -1, -1)
+            plane = plane.reshape(size, bits).dot(weights).astype(numpy.uint8)
+        return plane.tobytes()
+    if 8 % bits == 0:
+        table = _unpack_table(bits)
+        return b''.join(map(table.__getitem__, pattern_data))[:size]
+    # 画素がバイト境界をまたぐ場合 (5階調以上) は整数として切り出す
+    value = int.from_bytes(pattern_data, 'big')
+    total = len(pattern_data) * 8
+    mask = (1 << bits) - 1
+    return bytes((value >> (total - bits * (i + 1))) & mask
+                 for i in range(size))
+
+
+class DRCSGlyph(object):
+
+    """展開済みの DRCS パターン
+
+    pixels は左上から行順に並べた1画素1バイトの階調値 (0 が背景) で、
+    そのまま比較や文字認識の入力に使える"""
+
+    __slots__ = ('width', 'height', 'depth', 'pattern_data', 'pixels')
+
+    def __init__(self, width, height, pattern_data, depth=0):
+        self.width = width
+        self.height = height
+        self.depth = depth
+        self.pattern_data = bytes(pattern_data)
+        self.pixels = unpack(self.pattern_data, width, height, depth)
+
+    @property
+    def hash(self):
+        return pattern_hash(self.pattern_data)
+
+    @property
+    def levels(self):
+        """階調数"""
+
+        return self.depth + 2
+
+    def rows(self):
+        width = self.width
+        for start in range(0, width * self.height, width):
+            yield self.pixels[start:start + width]
 
 
 class DRCSImage(object):
 
     """DRCSの画像イメージ"""
 
-    def __init__(self, width, height, bgcolor='white'):
-        self.image = Image.new('RGB', (width, height), bgcolor)
-        self.hash = None
-
-    def point(self, patterns, color='black'):
-        hasher = md5()
-        draw = Draw(self.image)
-        for y, pattern in enumerate(patterns):
-            pattern_data = pattern.pattern_data
-            hasher.update(pattern_data)
-            points = [
-                (x, y)
-                for x, dot in enumerate(_to_bit(pattern_data)) if dot == '1'
-            ]
-            draw.point(points, color)
-        self.hash = hasher.hexdigest()
+    def __init__(self, glyph):
+        self.hash = glyph.hash
+        # 階調値を背景の白から前景の黒までの濃淡に割り当てる
+        top = glyph.levels - 1
+        shades = bytes(255 - min(level, top) * 255 // top
+                       for level in range(256))
+        self.image = Image.frombytes('L', (glyph.width, glyph.height),
+                                     glyph.pixels.translate(shades))
 
     def save(self, ext='png', path=None):
         if path is None:
-            if self.hash is None:
-                raise ValueError('画像イメージが作成されていません')
             path = self.hash
+        _ensure_save_dir()
         self.image.save(os.path.join(save_dir, path + '.' + ext))
 
 
@@ -65,33 +203,77 @@ class DRCSText(object):
 
     """DRCSのテキストイメージ"""
 
-    def __init__(self, width, height, bgcolor='white'):
-        self.hash = None
-        self.dots = []
-
-    def point(self, patterns, color='black'):
-        hasher = md5()
-        for pattern in patterns:
-            pattern_data = pattern.pattern_data
-            hasher.update(pattern_data)
-            points = _to_bit(pattern_data).replace('0', '　').replace('1', '■')
-            self.dots.append(points)
-        self.hash = hasher.hexdigest()
+    def __init__(self, glyph):
+        self.hash = glyph.hash
+        top = glyph.levels - 1
+        shades = ['　'] + ['▒'] * (top - 1) + ['■']
+        self.dots = [''.join(shades[min(level, top)] for level in row)
+                     for row in glyph.rows()]
 
     def save(self, ext='txt', path=None):
         if path is None:
-            if self.hash is None:
-                raise ValueError('画像イメージが作成されていません')
             path = self.hash
+        _ensure_save_dir()
         with open(os.path.join(save_dir, path + '.' + ext), 'w') as out:
             out.write('\n'.join(self.dots))
 
 
-def _to_bit(raw):
-    """bytearrayを0,1のビットを表す文字列に変換する"""
+class DRCSStore(object):
+
+    """DRCS のパターンをハッシュで管理し、初めて見たものだけ画像を保存する
+
+    同じパターンは何度も送出されるので、一度見たハッシュはメモリ上で、
+    以前に保存したものは保存先のファイルの有無で判定して作成を省く。
+    画像の作成と保存はバックグラウンドのスレッドで行う。
+    """
+
+    def __init__(self):
+        self.known = set()
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def add(self, width, height, pattern_data, depth=0):
+        """パターンを登録してハッシュを返す"""
+
+        pattern_data = bytes(pattern_data)
+        hash = pattern_hash(pattern_data)
+        if hash in self.known:
+            return hash
+        self.known.add(hash)
+        ext = 'txt' if renderer() is DRCSText else 'png'
+        if not os.path.exists(os.path.join(save_dir, hash + '.' + ext)):
+            self._submit((width, height, pattern_data, depth))
+        return hash
+
+    def flush(self):
+        """保存待ちの画像を全て保存し終えるまで待つ"""
+
+        # スレッドが止まっていれば残りは保存されないので待たない
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.join()
+
+    def _submit(self, item):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._worker,
+                                               daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+        self.queue.put(item)
+
+    def _worker(self):
+        while True:
+            width, height, pattern_data, depth = self.queue.get()
+            try:
+                renderer()(DRCSGlyph(width, height, pattern_data, depth)).save()
+            except Exception as e:
+                # 保存できなくても残りのパターンの保存を続ける
+                print('cannot save DRCS {}: {}'.format(
+                    pattern_hash(pattern_data), e), file=sys.stderr)
+            finally:
+                self.queue.task_done()
 
-    return ''.join(map(lambda s: format(s, '08b'), raw))
 
-# 画像出力ができないときはテキスト出力を行う
-if text_output:
-    DRCSImage = DRCSText
+# プロセス全体で共有する DRCS の保存先
+store = DRCSStore()
@@ -0,0 +1,394 @@
+"""セクションの組み立てと TS パケットへの分割
+
+sections.py や descriptors.py のシンタックス宣言をそのまま使って、
+フィールドの値からセクションや記述子のバイト列を作る。
+
+    from ariblib.encoder import SectionPacketizer, build, encode
+    from ariblib.sections import ProgramAssociationSection
+
+    data = encode(ProgramAssociationSection, {
+        'transport_stream_id': 0x7FE0,
+        'pids': [{'program_number': 0, 'program_map_PID': 0x10},
+                 {'program_number': 1024, 'program_map_PID': 0x1F0}],
+    })
+    packets = SectionPacketizer(0x00).packetize(data)
+
+値の与え方:
+    整数のフィールド (uimsbf, bslbf, bcd)  int (bcd は小数も可)
+    mjd                                    datetime (16ビットのものは date も可)、None
+    bcdtime                                timedelta、None
+    char                                   str (ISO 8859-1)
+    aribstr, raw などの可変長のフィールド  bytes (aribstr は8単位符号のまま)
+    ループ (loop, times)                   辞書、解析済みのシンタックス、bytes のリスト
+    記述子の並び                           (記述子クラス, 辞書)、descriptor_tag を含む
+                                           辞書、解析済みの記述子、bytes のリスト、
+                                           または DescriptorIndex
+    if シンタックス (case)                 同じ辞書にフィールドを並べるか、
+                                           シンタックス名をキーにした辞書
+
+どのフィールドにも、ちょうどその長さの bytes を与えれば、そのまま書き込む。
+
+次のフィールドは値を与えなくても決まる。
+    - 長さや回数を表すフィールド (ループや記述子の並びの長さ、section_length、
+      descriptor_length) は組み立てた結果から計算する (与えた値より優先する)
+    - CRC_32 (rpchof) はそこまでのバイト列から計算する
+    - reserved で始まるフィールドは全て 1 (PAT, CAT, PMT の
+      section_syntax_indicator の次の reserved_future_use だけは 0)
+    - table_id はクラスの最初の table_id、descriptor_tag は記述子のタグ
+    - section_syntax_indicator は section_number を持つセクションなら 1、
+      current_next_indicator は 1
+    - それ以外は 0
+
+if シンタックスは、その名前をキーにした辞書が与えられた場合か、
+与えられた値で条件が成り立つ場合に書き込む。条件となるフラグなどは
+自動では立てないので、合わせて与えること。
+"""
+
+from collections.abc import Mapping
+from datetime import date, datetime
+
+from ariblib.descriptors import Descriptor, DescriptorIndex, descriptors
+from ariblib.mnemonics import (
+    bcd,
+    bcdtime,
+    case_table,
+    char,
+    fixed_count_loop,
+    fixed_size_loop,
+    mjd,
+    mnemonic,
+    rpchof,
+    uimsbf,
+)
+from ariblib.sections import Section
+
+# 組み立てた結果の長さから値を決めるフィールド。フィールドの終わりから
+# シンタックスの終わりまでのバイト数になる
+LENGTH_FIELDS = ('section_length', 'descriptor_length')
+
+# ISO/IEC 13818-1 で決まっているセクション (PAT, CAT, PMT) の table_id。
+# これらは section_syntax_indicator の次のビット (reserved_future_use) が '0'
+ISO_TABLE_IDS = (0x00, 0x01, 0x02)
+
+# TS パケットのペイロードの長さ
+PAYLOAD_SIZE = 184
+
+
+def _crc32_table():
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = (crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+CRC32_TABLE = _crc32_table()
+
+
+def crc32(data):
+    """CRC32 (ISO 13818-1 付録A) を計算する"""
+
+    crc = 0xFFFFFFFF
+    table = CRC32_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ table[(crc >> 24) ^ byte]
+    return crc
+
+
+def encode(Syntax, values=None, **kwargs):
+    """シンタックスクラスとフィールドの値からバイト列を作る"""
+
+    values = dict(values or {}, **kwargs)
+    items = _items(Syntax, values)
+    return _pack(Syntax, items)
+
+
+def build(Syntax, values=None, **kwargs):
+    """encode したバイト列を解析するシンタックスのインスタンスを返す"""
+
+    return Syntax(encode(Syntax, values, **kwargs))
+
+
+def raw_bytes(obj):
+    """解析済みのシンタックスが占めるバイト列を返す"""
+
+    packet = obj._packet
+    if isinstance(obj, Section):
+        return bytes(packet[:obj.section_length + 3])
+    start = obj._pos // 8
+    return bytes(packet[start:start + len(obj) // 8])
+
+
+class _View(object):
+
+    """if シンタックスの条件を、与えられた値で評価するための入れ物"""
+
+    def __init__(self, Syntax, values):
+        self._Syntax = Syntax
+        self._values = values
+
+    def __getattr__(self, name):
+        if name in self._values:
+            return self._values[name]
+        for item in self._Syntax._mnemonics:
+            if item.name == name:
+                return _default(self._Syntax, item)
+        return 0
+
+
+def _default(Syntax, item):
+    """値が与えられなかったフィールドの値"""
+
+    name = item.name
+    if name == 'reserved_future_use' and issubclass(Syntax, Section) and \
+            Syntax._table_ids[0] in ISO_TABLE_IDS:
+        return 0
+    if name.startswith('reserved') and isinstance(item.length, int):
+        return (1 << item.length) - 1
+    if name == 'section_syntax_indicator':
+        return 1 if 'section_number' in Syntax._mnemonic_names else 0
+    if name == 'current_next_indicator':
+        return 1
+    if name == 'table_id':
+        return Syntax._table_ids[0]
+    if name == 'descriptor_tag':
+        return getattr(Syntax, '_tag', 0)
+    return 0
+
+
+def _items(Syntax, values):
+    """フィールドごとに (ビット表記, ビット数, 値) のリストを作る
+
+    ビット数が None のものはバイト列、値が None のものは長さなど、
+    後から決めるもの"""
+
+    items = []
+    # 長さや回数のフィールド名から、その値
+    lengths = {}
+    for item in Syntax._mnemonics:
+        name = item.name
+        if isinstance(item, case_table):
+            sub = values.get(name)
+            if isinstance(sub, Mapping):
+                items.extend(_items(item.cls, sub))
+            elif item.condition(_View(Syntax, values)):
+                items.extend(_items(item.cls, values))
+            continue
+
+        value = values.get(name)
+        if isinstance(value, (bytes, bytearray, memoryview)) and (
+                not isinstance(item.length, int) or
+                len(value) * 8 == item.length):
+            data = bytes(value)
+        elif isinstance(item, (fixed_size_loop, fixed_count_loop)):
+            children = value or ()
+            data = b''.join(_child(item.cls, child) for child in children)
+            if isinstance(item, fixed_count_loop):
+                _reference(lengths, item.count, len(children))
+        elif isinstance(item, descriptors):
+            data = b''.join(_descriptor(child)
+                            for child in _descriptor_list(value))
+        elif isinstance(item, rpchof):
+            items.append((item, item.length, None))
+            continue
+        elif isinstance(item, uimsbf) and isinstance(item.length, int):
+            items.append((item, item.length, value))
+            continue
+        elif isinstance(item, (mjd, bcd, bcdtime)):
+            items.append((item, item.length, _time_or_bcd(item, value)))
+            continue
+        elif isinstance(item, char) and isinstance(value, str):
+            data = value.encode('latin-1')
+        elif value is None:
+            data = b''
+        else:
+            raise TypeError('{}.{}: cannot encode {!r}'.format(
+                Syntax.__name__, name, value))
+
+        if isinstance(item.length, int) and len(data) * 8 != item.length:
+            raise ValueError('{}.{} must be {} bytes'.format(
+                Syntax.__name__, name, item.length // 8))
+        _reference(lengths, item.length, len(data))
+        items.append((item, None, data))
+
+    # 長さのフィールドと省略されたフィールドの値を決める
+    result = []
+    for item, length, value in items:
+        if length is not None and not isinstance(item, rpchof):
+            name = item.name
+            if name in lengths:
+                value = lengths[name]
+            elif name in LENGTH_FIELDS and item in Syntax._mnemonics:
+                value = _remaining(Syntax, items, item)
+            elif value is None:
+                value = _default(Syntax, item)
+        result.append((item, length, value))
+    return result
+
+
+def _reference(lengths, length, value):
+    """長さや回数を他のフィールドで表している場合、そのフィールドの値を決める"""
+
+    if isinstance(length, mnemonic):
+        lengths[length.name] = value
+    elif isinstance(length, str):
+        lengths[length] = value
+
+
+def _remaining(Syntax, items, target):
+    """target の終わりからシンタックスの終わりまでのバイト数"""
+
+    bits = 0
+    found = False
+    for item, length, value in items:
+        if found:
+            bits += length if length is not None else len(value) * 8
+        elif item is target:
+            found = True
+    return bits // 8
+
+
+def _child(Syntax, value):
+    """ループの要素をバイト列にする"""
+
+    if isinstance(value, Mapping):
+        return encode(Syntax, value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+    return raw_bytes(value)
+
+
+def _descriptor_list(value):
+    if value is None:
+        return ()
+    if isinstance(value, DescriptorIndex):
+        return value.raw()
+    return value
+
+
+def _descriptor(value):
+    """記述子の並びの要素をバイト列にする"""
+
+    if isinstance(value, tuple):
+        cls, values = value
+        return encode(cls, values)
+    if isinstance(value, Mapping):
+        return encode(Descriptor.get(value['descriptor_tag']), value)
+    return _child(None, value)
+
+
+def _time_or_bcd(item, value):
+    """日時や二進化十進数をビット列の値にする"""
+
+    if isinstance(item, bcd):
+        digits = '{:0{}d}'.format(round(value * 10 ** item.decimal_point),
+                                  item.length // 4)
+        return int(digits, 16)
+    if value is None:
+        return (1 << item.length) - 1
+    if isinstance(item, bcdtime):
+        seconds = int(value.total_seconds())
+        hms = '{:02d}{:02d}{:02d}'.format(seconds // 3600,
+                                          seconds // 60 % 60, seconds % 60)
+        return int(hms, 16) << (item.length - 24)
+    # mjd
+    day = value.date() if isinstance(value, datetime) else value
+    result = (day - date(1858, 11, 17)).days
+    if item.length > 16:
+        hms = '{:02d}{:02d}{:02d}'.format(value.hour, value.minute,
+                                          value.second)
+        result = result << 24 | int(hms, 16)
+    return result
+
+
+def _pack(Syntax, items):
+    """フィールドを順にビット列として詰める"""
+
+    result = bytearray()
+    accumulator = 0
+    bits = 0
+    for item, length, value in items:
+        if length is None:
+            if bits:
+                raise ValueError('{}.{} is not byte aligned'.format(
+                    Syntax.__name__, item.name))
+            result.extend(value)
+            continue
+        if isinstance(item, rpchof):
+            value = crc32(result)
+        value = int(value)
+        if value < 0 or value >> length:
+            raise ValueError('{}.{} does not fit in {} bits: {}'.format(
+                Syntax.__name__, item.name, length, value))
+        accumulator = accumulator << length | value
+        bits += length
+        if bits % 8 == 0:
+            result.extend(accumulator.to_bytes(bits // 8, 'big'))
+            accumulator = 0
+            bits = 0
+    if bits:
+        raise ValueError('{} is not byte aligned'.format(Syntax.__name__))
+    return result
+
+
+class SectionPacketizer(object):
+
+    """セクションを TS パケットに分割する
+
+    PID ごとに1つ作って使い回し、巡回カウンタを続けて振る。
+    セクションは続けて詰め、セクションが始まるパケットには
+    payload_unit_start_indicator と pointer_field を付ける。
+    最後のパケットの余りは 0xFF で埋める。"""
+
+    def __init__(self, pid, continuity_counter=0, transport_priority=0):
+        self.pid = pid
+        self.continuity_counter = continuity_counter
+        self.transport_priority = transport_priority
+
+    def packetize(self, *sections):
+        """セクションのバイト列を TS パケットのリストにする"""
+
+        data = b''.join(bytes(section) for section in sections)
+        starts = []
+        position = 0
+        for section in sections:
+            starts.append(position)
+            position += len(section)
+
+        packets = []
+        position = 0
+        index = 0
+        while position < len(data):
+            if index < len(starts) and \
+                    starts[index] < position + PAYLOAD_SIZE - 1:
+                # このパケットの中でセクションが始まる
+                end = position + PAYLOAD_SIZE - 1
+                payload = bytes([starts[index] - position]) + \
+                    data[position:end]
+                start_indicator = 1
+            else:
+                end = position + PAYLOAD_SIZE
+                if index < len(starts):
+                    # 次のセクションは次のパケットから始める
+                    end = min(end, starts[index])
+                payload = data[position:end]
+                start_indicator = 0
+            position = end
+            while index < len(starts) and starts[index] < position:
+                index += 1
+            packets.append(self._header(start_indicator) +
+                           payload.ljust(PAYLOAD_SIZE, b'\xFF'))
+        return packets
+
+    def _header(self, start_indicator):
+        counter = self.continuity_counter
+        self.continuity_counter = (counter + 1) & 0x0F
+        return bytes([
+            0x47,
+            start_indicator << 6 | self.transport_priority << 5 |
+            self.pid >> 8,
+            self.pid & 0xFF,
+            0x10 | counter,
+        ])
@@ -2,6 +2,11 @@
 
 """イベントラッパー"""
 
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+import os
+
+from ariblib import stats
 from ariblib.aribstr import AribString
 from ariblib.constants import (
     COMPONENT_TYPE,
@@ -23,12 +28,123 @@ from ariblib.descriptors import (
 from ariblib.sections import ActualStreamEventInformationSection
 
 
-def events(ts, section=ActualStreamEventInformationSection):
-    """トランスポートストリームから Event オブジェクトを返すジェネレータ"""
+def events(ts, section=ActualStreamEventInformationSection, lazy=False,
+           workers=None, batch_size=64):
+    """トランスポートストリームから Event オブジェクトを返すジェネレータ
+
+    lazy が真の場合は記述子を参照時にデコードする LazyEvent を返す
+
+    workers を与えると、セクションのバイト列を batch_size 個ずつプロセスプールに
+    送り、記述子の解析と文字列のデコードを読み込みと並行して行う。
+    イベントは読み込んだ順に返す。workers にはプロセス数か
+    concurrent.futures.Executor を与える (lazy とは併用できない)。
+    stats が有効なら、プロセスプールで数えた計測値も足し込む
+    """
 
+    if workers is not None:
+        if lazy:
+            raise ValueError('lazy cannot be used with workers')
+        yield from _pool_events(ts, section, workers, batch_size)
+        return
+
+    Wrapper = LazyEvent if lazy else Event
     for eit in ts.sections(section):
         for event in eit.events:
-            yield Event(eit, event)
+            yield Wrapper(eit, event)
+
+
+def _pool_events(ts, section, workers, batch_size):
+    if isinstance(workers, Executor):
+        executor = workers
+        # 結果を待たずに送るバッチの数
+        max_pending = 2 * (os.cpu_count() or 1)
+    else:
+        executor = ProcessPoolExecutor(workers)
+        max_pending = 2 * workers
+    pending = deque()
+    batch = []
+
+    def submit(batch):
+        # 計測する場合は、プロセスプールで数えた値を返してもらう
+        parent = os.getpid() if stats.enabled else None
+        pending.append(executor.submit(_decode_events, section, batch,
+                                       parent))
+
+    def result():
+        events, values = pending.popleft().result()
+        if values is not None:
+            stats.merge(values)
+        return events
+
+    # セクションは組み立てるだけにし、解析はプロセスプールで行う
+    raw = type(section.__name__, (_RawSection,), {
+        '_pids': section._pids, '_table_ids': section._table_ids})
+    try:
+        for eit in ts.sections(raw):
+            batch.append(bytes(eit._packet[:eit.section_length + 3]))
+            if len(batch) < batch_size:
+                continue
+            submit(batch)
+            batch = []
+            # 先頭のバッチから順に、終わっているものを返す
+            while pending and (len(pending) > max_pending or
+                               pending[0].done()):
+                yield from result()
+        if batch:
+            submit(batch)
+        while pending:
+            yield from result()
+    finally:
+        for future in pending:
+            future.cancel()
+        if executor is not workers:
+            executor.shutdown()
+
+
+def _decode_events(section, batch, parent=None):
+    """プロセスプールで実行する。セクションのバイト列から Event のリストを作る
+
+    番組名や番組詳細 (detail) などの AribString もデコードしておき、結果ごと返す。
+    parent は計測する場合の呼び出し側のプロセス ID で、別のプロセスで実行した
+    場合は、このバッチで数えた計測値を Event のリストと組にして返す"""
+
+    if parent is None or parent == os.getpid():
+        return _decode_batch(section, batch), None
+    # fork したプロセスは呼び出し側の計測値を引き継いでいるので捨てる
+    stats.enable()
+    stats.reset()
+    result = _decode_batch(section, batch)
+    return result, stats.take()
+
+
+def _decode_batch(section, batch):
+    result = []
+    for data in batch:
+        eit = section(data)
+        for event in eit.events:
+            wrapper = Event(eit, event)
+            values = list(vars(wrapper).values())
+            values.extend(getattr(wrapper, 'detail', {}).values())
+            for value in values:
+                if isinstance(value, AribString):
+                    str(value)
+            result.append(wrapper)
+    return result
+
+
+class _RawSection(object):
+
+    """組み立てたセクションを解析せずにバイト列のまま持つ
+
+    プロセスプールに送るセクションを、呼び出し側で解析しない (stats の
+    sections_parsed にも数えない) ために使う"""
+
+    def __init__(self, packet):
+        self._packet = packet
+        self.section_length = (packet[1] & 0x0F) << 8 | packet[2]
+
+    def isfull(self):
+        return self.section_length <= len(self._packet) - 3
 
 
 class Event(object):
@@ -38,6 +154,28 @@ class Event(object):
     from_eit = ['service_id', 'transport_stream_id', 'original_network_id']
     from_event = ['event_id', 'start_time', 'duration', 'free_CA_mode']
 
+    # 記述子ごとのローダーと、そのローダーが設定するプロパティ名
+    loaders = [
+        ('_load_short_event', ['title', 'desc']),
+        ('_load_component', [
+            'video_content', 'video_component', 'video', 'video_text',
+        ]),
+        ('_load_digital_copy_control', ['copy_control_type', 'copy']),
+        ('_load_audio_component', [
+            'audio_content', 'audio_component', 'samplint_rate_type', 'audio',
+            'sampling_rate', 'sampling_rate_string', 'audio_text',
+            'second_audio_content', 'second_audio_component', 'second_audio',
+            'second_sampling_rate', 'second_sampling_rate_string',
+            'second_audio_text',
+        ]),
+        ('_load_event_group', ['group_type', 'group_type_string', 'events']),
+        ('_load_content', [
+            'nibble1', 'nibble2', 'user_nibble', 'genre', 'subgenre',
+            'user_genre',
+        ]),
+        ('_load_extended_event', ['detail', 'longdesc']),
+    ]
+
     def __init__(self, eit, event):
         for field in self.from_eit:
             setattr(self, field, getattr(eit, field))
@@ -45,17 +183,27 @@ class Event(object):
             setattr(self, field, getattr(event, field))
 
         desc = event.descriptors
+        for loader, _ in self.loaders:
+            getattr(self, loader)(desc)
+
+    def _load_short_event(self, desc):
         for sed in desc.get(ShortEventDescriptor, []):
             self.title = sed.event_name_char
             self.desc = sed.text_char
+
+    def _load_component(self, desc):
         for cd in desc.get(ComponentDescriptor, []):
             self.video_content = cd.stream_content
             self.video_component = cd.component_type
             self.video = COMPONENT_TYPE[cd.stream_content][cd.component_type]
             self.video_text = cd.component_text
+
+    def _load_digital_copy_control(self, desc):
         for dccd in desc.get(DigitalCopyControlDescriptor, []):
             self.copy_control_type = dccd.copy_control_type
             self.copy = DIGITAL_RECORDING_CONTROL_TYPE[dccd.copy_control_type]
+
+    def _load_audio_component(self, desc):
         for acd in desc.get(AudioComponentDescriptor, []):
             if acd.main_component_flag:
                 self.audio_content = acd.stream_content
@@ -75,10 +223,14 @@ class Event(object):
                 self.second_sampling_rate_string =\
                     SAMPLING_RATE[acd.sampling_rate]
                 self.second_audio_text = acd.audio_text
+
+    def _load_event_group(self, desc):
         for egd in desc.get(EventGroupDescriptor, []):
             self.group_type = egd.group_type
             self.group_type_string = EVENT_GROUP_TYPE[egd.group_type]
             self.events = dict((e.service_id, e.event_id) for e in egd.events)
+
+    def _load_content(self, desc):
         for ctd in desc.get(ContentDescriptor, []):
             self.nibble1 = []
             self.nibble2 = []
@@ -98,21 +250,83 @@ class Event(object):
                                 [nibble.content_nibble_level_2])
                 self.user_nibble.append(nibble.user_nibble)
                 self.user_genre.append(USER_TYPE.get(nibble.user_nibble, ''))
+
+    def _load_extended_event(self, desc):
         detail = [('', [])]
         for eed in desc.get(ExtendedEventDescriptor, []):
             for item in eed.items:
-                key = item.item_description_char
+                key = str(item.item_description_char)
                 # タイトルが空か一つ前と同じ場合は本文を一つ前のものにつなげる
-                if str(key) == '' or str(detail[-1][0]) == str(key):
-                    detail[-1][1].extend(item.item_char)
+                if key == '' or detail[-1][0] == key:
+                    detail[-1][1].append(item.item_char)
                 else:
-                    detail.append((key, item.item_char))
-        detail = [(str(key), AribString(value)) for key, value in detail[1:]]
+                    detail.append((key, [item.item_char]))
+        detail = [(key, AribString.join(value)) for key, value in detail[1:]]
         if detail:
             self.detail = dict(detail)
             self.longdesc = '\n'.join(
                 "{}\n{}\n".format(key, value) for key, value in detail)
 
+
+class LazyEvent(Event):
+
+    """参照されたときに初めて記述子をデコードするイベントラッパークラス
+
+    event_id や start_time だけが必要な場合に、番組名や番組詳細などの
+    ARIB 文字列のデコードを省略できる。
+    一度デコードしたプロパティはインスタンスにキャッシュされる。
+    """
+
+    def __init__(self, eit, event):
+        self._eit = eit
+        self._event = event
+        self._loaded = set()
+
+    def __getattr__(self, name):
+        # __getattr__ はインスタンスに値が無いときだけ呼ばれる
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if name in self.from_eit:
+            value = getattr(self._eit, name)
+        elif name in self.from_event:
+            value = getattr(self._event, name)
+        else:
+            loader = _lazy_loaders.get(name)
+            if loader is None or loader in self._loaded:
+                raise AttributeError(
+                    "'{}' object has no attribute '{}'".format(
+                        self.__class__.__name__, name))
+            self._loaded.add(loader)
+            getattr(self, loader)(self._event.descriptors)
+            return getattr(self, name)
+        setattr(self, name, value)
+        return value
+
+    def load(self):
+        """全てのプロパティを一括でデコードして自身を返す"""
+
+        for field in self.from_eit + self.from_event:
+            getattr(self, field)
+        desc = self._event.descriptors
+        for loader, _ in self.loaders:
+            if loader not in self._loaded:
+                self._loaded.add(loader)
+                getattr(self, loader)(desc)
+        return self
+
+    def properties(self):
+        """デコード済みのプロパティを辞書として返す
+
+        Event.__dict__ の代わりに使う"""
+
+        return dict((key, value) for key, value in self.__dict__.items()
+                    if not key.startswith('_'))
+
+
+# プロパティ名からローダー名を引く辞書
+_lazy_loaders = dict((name, loader) for loader, names in Event.loaders
+                     for name in names)
+
 if __name__ == '__main__':
     from subprocess import Popen, PIPE
     from ariblib import tsopen
@@ -0,0 +1,297 @@
+"""CDT で送られる局ロゴの取り出し
+
+CDT の (original_network_id, logo_id, logo_version, logo_type) で重複を除き、
+初めて見たロゴだけを PNG にして保存する。保存したロゴは保存先の
+index.json に記録し、次に読み込んだ時にも既知のロゴとして扱う。
+
+SDT のロゴ伝送記述子から各サービスのロゴを集め、それらが全て揃ったか、
+CDT が一巡した (同じロゴが再び送られた) かどうかを LogoCollector.done で
+返すので、その時点で読み込みを止められる。全ての logo_type を送るとは
+限らないため、送られていない種類のロゴは一巡した時点で諦める。
+
+    store = LogoStore('logos')
+    collector = LogoCollector(store)
+    with tsopen(path) as ts:
+        for packet in ts:
+            collector.feed(packet)
+            if collector.done:
+                break
+    store.save()
+"""
+
+import json
+import os
+import struct
+import zlib
+
+from ariblib.descriptors import LogoTransmissionDescriptor
+from ariblib.encoder import crc32
+from ariblib.packet import SectionParser, pid
+from ariblib.sections import CommonDataSection, ServiceDescriptionSection
+
+# logo_type ごとの大きさ (ARIB-TR-B14-1-5.4.1.2)
+LOGO_SIZES = {
+    0x00: (48, 24),  # SD4:3 小
+    0x01: (36, 24),  # SD16:9 小
+    0x02: (48, 27),  # HD 小
+    0x03: (72, 36),  # SD4:3 大
+    0x04: (54, 36),  # SD16:9 大
+    0x05: (64, 36),  # HD 大
+}
+
+# CDT の data_type のうちロゴデータを表すもの
+LOGO_DATA_TYPE = 0x01
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+INDEX_NAME = 'index.json'
+
+
+def fixed_colors():
+    """共通固定色 (ARIB-STD-B24-1-2) の128色を (R, G, B, A) で返す
+
+    0-7 は最大輝度の8色、8 は透明、9-15 は半輝度の7色、16-64 は
+    残りの4段階の組み合わせ、65-127 は 0-7 と 9-63 の半透明"""
+
+    primary = [(r * 255, g * 255, b * 255)
+               for r, g, b in ((0, 0, 0), (1, 0, 0), (0, 1, 0), (1, 1, 0),
+                               (0, 0, 1), (1, 0, 1), (0, 1, 1), (1, 1, 1))]
+    half = [(r * 170 // 255, g * 170 // 255, b * 170 // 255)
+            for r, g, b in primary[1:]]
+    used = set(primary) | set(half)
+    levels = (0, 85, 170, 255)
+    others = [(r, g, b) for r in levels for g in levels for b in levels
+              if (r, g, b) not in used]
+    opaque = [color + (255,) for color in primary]
+    opaque.append((0, 0, 0, 0))
+    opaque.extend(color + (255,) for color in half + others)
+    translucent = [color[:3] + (128,) for color in opaque[:8] + opaque[9:64]]
+    return opaque + translucent
+
+
+def _chunk(name, data):
+    return (struct.pack('>L', len(data)) + name + data +
+            struct.pack('>L', zlib.crc32(name + data) & 0xFFFFFFFF))
+
+
+def to_png(data):
+    """ロゴデータを PNG にする
+
+    ロゴデータは PLTE チャンクを省いた PNG なので、共通固定色の
+    PLTE と tRNS を IHDR の後に入れる。PLTE がある場合はそのまま返す"""
+
+    data = bytes(data)
+    if not data.startswith(PNG_SIGNATURE):
+        return data
+    chunks = []
+    position = len(PNG_SIGNATURE)
+    while position + 8 <= len(data):
+        length, = struct.unpack('>L', data[position:position + 4])
+        name = data[position + 4:position + 8]
+        end = position + 12 + length
+        chunks.append((name, data[position:end]))
+        position = end
+    names = [name for name, _ in chunks]
+    if b'PLTE' in names or b'IHDR' not in names:
+        return data
+    colors = fixed_colors()
+    palette = _chunk(b'PLTE', b''.join(bytes(color[:3]) for color in colors))
+    alpha = _chunk(b'tRNS', bytes(color[3] for color in colors))
+    result = [PNG_SIGNATURE]
+    for name, chunk in chunks:
+        result.append(chunk)
+        if name == b'IHDR':
+            result.extend((palette, alpha))
+    return b''.join(result)
+
+
+class LogoStore(object):
+
+    """保存先のディレクトリと、保存したロゴの索引
+
+    索引は (original_network_id, logo_id, logo_type) ごとに最新の
+    logo_version とファイル名を持ち、サービスからロゴへの対応も持つ"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, INDEX_NAME)
+        self.logos = {}
+        self.services = {}
+        self.changed = False
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                index = json.load(f)
+            for item in index.get('logos', ()):
+                key = (item['original_network_id'], item['logo_id'],
+                       item['logo_type'])
+                self.logos[key] = (item['logo_version'], item['file'])
+            for item in index.get('services', ()):
+                self.services[(item['original_network_id'],
+                               item['service_id'])] = item['logo_id']
+
+    def known(self, original_network_id, logo_id, logo_version, logo_type):
+        """そのロゴを既に保存しているかどうか"""
+
+        found = self.logos.get((original_network_id, logo_id, logo_type))
+        return found is not None and found[0] == logo_version
+
+    def version(self, original_network_id, logo_id, logo_type):
+        """保存しているロゴの logo_version (無ければ None)"""
+
+        found = self.logos.get((original_network_id, logo_id, logo_type))
+        return None if found is None else found[0]
+
+    def add(self, cdt):
+        """CDT のロゴを保存し、保存したファイルのパスを返す
+
+        既知のロゴやロゴでない CDT、CRC の合わないものは保存せずに None を返す"""
+
+        if cdt.data_type != LOGO_DATA_TYPE:
+            return None
+        if self.known(cdt.original_network_id, cdt.logo_id, cdt.logo_version,
+                      cdt.logo_type):
+            return None
+        # 新しいロゴの場合だけ CRC を確かめ、PNG にする
+        data = cdt._packet[:cdt.section_length + 3]
+        if crc32(data) != 0:
+            return None
+        name = '{:04x}_{:03x}_{}_{:03x}.png'.format(
+            cdt.original_network_id, cdt.logo_id, cdt.logo_type,
+            cdt.logo_version)
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(to_png(cdt.data_byte))
+        key = (cdt.original_network_id, cdt.logo_id, cdt.logo_type)
+        self.logos[key] = (cdt.logo_version, name)
+        self.changed = True
+        return path
+
+    def add_service(self, original_network_id, service_id, logo_id):
+        key = (original_network_id, service_id)
+        if self.services.get(key) != logo_id:
+            self.services[key] = logo_id
+            self.changed = True
+
+    def save(self):
+        """索引を書き出す (一時ファイルに書いてから置き換える)"""
+
+        if not self.changed:
+            return
+        index = {
+            'logos': [
+                {'original_network_id': key[0], 'logo_id': key[1],
+                 'logo_type': key[2], 'logo_version': version, 'file': name}
+                for key, (version, name) in sorted(self.logos.items())
+            ],
+            'services': [
+                {'original_network_id': key[0], 'service_id': key[1],
+                 'logo_id': logo_id}
+                for key, logo_id in sorted(self.services.items())
+            ],
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        temp = self.path + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(temp, self.path)
+        self.changed = False
+
+
+class LogoCollector(object):
+
+    """パケットを一つずつ受け取って CDT のロゴを LogoStore に保存する
+
+    SDT のロゴ伝送記述子にあるロゴ (logo_types の全ての種類) が
+    保存済みになるか、CDT が一巡すると done が真になる。
+    CDT のロゴは繰り返し送られるので、このとき読んだロゴを再び読めば
+    一巡したものとし、それまでに送られなかったロゴは待たない。
+    複数のファイルやストリームに続けて使う場合は、次のストリームを
+    与える前に reset() を呼ぶ。"""
+
+    def __init__(self, store, logo_types=tuple(LOGO_SIZES)):
+        self.store = store
+        self.logo_types = tuple(logo_types)
+        # (original_network_id, logo_id) から、必要な logo_version (不明なら None)
+        self.wanted = {}
+        self.reset()
+
+    def reset(self):
+        """ストリームごとの状態 (SDT を読んだか、CDT が一巡したか) を戻す
+
+        それまでに読んだ SDT のロゴは引き続き待つ"""
+
+        self.parser = SectionParser(CommonDataSection,
+                                    ServiceDescriptionSection)
+        self.seen_sdt = False
+        # このストリームで読んだ CDT のロゴの (original_network_id, logo_id,
+        # logo_type, logo_version)
+        self.seen_logos = set()
+        self.cycled = False
+        self.done = False
+
+    def feed(self, packet):
+        """パケットを一つ与え、新しく保存したロゴのパスのリストを返す"""
+
+        if pid(packet) not in self.parser.table_map:
+            return []
+        result = []
+        for section in self.parser.feed(packet):
+            if isinstance(section, CommonDataSection):
+                path = self._on_cdt(section)
+                if path is not None:
+                    result.append(path)
+            else:
+                self._on_sdt(section)
+            self.done = self._complete()
+        return result
+
+    def _on_cdt(self, cdt):
+        if cdt.data_type != LOGO_DATA_TYPE:
+            return None
+        key = (cdt.original_network_id, cdt.logo_id, cdt.logo_type,
+               cdt.logo_version)
+        if key in self.seen_logos:
+            self.cycled = True
+            return None
+        path = self.store.add(cdt)
+        # CRC の合わなかったロゴは次に送られた時に読み直す
+        if self.store.known(cdt.original_network_id, cdt.logo_id,
+                            cdt.logo_version, cdt.logo_type):
+            self.seen_logos.add(key)
+        return path
+
+    def _on_sdt(self, sdt):
+        self.seen_sdt = True
+        network_id = sdt.original_network_id
+        for service in sdt.services:
+            descriptors = service.descriptors.get(LogoTransmissionDescriptor,
+                                                  [])
+            for descriptor in descriptors:
+                transmission_type = descriptor.logo_transmission_type
+                if transmission_type not in (0x01, 0x02):
+                    continue
+                key = (network_id, descriptor.logo_id)
+                if transmission_type == 0x01:
+                    self.wanted[key] = descriptor.logo_version
+                else:
+                    self.wanted.setdefault(key, None)
+                self.store.add_service(network_id, service.service_id,
+                                       descriptor.logo_id)
+
+    def _complete(self):
+        """SDT を読んだ上で、全てのサービスのロゴが揃ったか CDT が一巡したか"""
+
+        return self.seen_sdt and (self.cycled or self.collected())
+
+    def collected(self):
+        """SDT にある全てのサービスのロゴが logo_types の全ての種類で揃ったか"""
+
+        store = self.store
+        for (network_id, logo_id), version in self.wanted.items():
+            for logo_type in self.logo_types:
+                known = store.version(network_id, logo_id, logo_type)
+                if known is None or (version is not None and
+                                     known != version):
+                    return False
+        return True
@@ -184,15 +184,17 @@ class otm(mnemonic):
 
 class aribstr(mnemonic):
 
-    """8単位符号で符号化された文字列"""
+    """8単位符号で符号化された文字列
+
+    AribString として返す。デコードは str() などで必要になった時に行い、
+    結果はバイト列をキーにキャッシュされる"""
 
     @cache
     def __get__(self, instance, owner):
         start = self.start(instance)
         block = start // 8
         last = block + self.real_length(instance) // 8
-        binary = bytearray(instance._packet[block:last])
-        return AribString(binary)
+        return AribString(instance._packet[block:last])
 
 
 class char(mnemonic):
@@ -247,6 +249,7 @@ class fixed_size_loop(mnemonic):
         while start < end:
             start_pos = start * 8
             obj = self.cls(instance._packet, pos=start_pos)
+            obj._descriptor_tags = instance._descriptor_tags
             result.append(obj)
             start += len(obj) // 8
         return result
@@ -268,6 +271,7 @@ class fixed_count_loop(mnemonic):
         for _ in range(self.real_count(instance)):
             start_pos = start * 8
             obj = self.cls(instance._packet, pos=start_pos)
+            obj._descriptor_tags = instance._descriptor_tags
             result.append(obj)
             start += len(obj) // 8
         return result
@@ -309,7 +313,9 @@ class case_table(mnemonic):
     def __get__(self, instance, owner):
         if self.condition(instance):
             start_pos = self.start(instance)
-            return self.cls(instance._packet, pos=start_pos, parent=instance)
+            obj = self.cls(instance._packet, pos=start_pos, parent=instance)
+            obj._descriptor_tags = instance._descriptor_tags
+            return obj
         return None
 
     @meta_cache('len')
@@ -0,0 +1,357 @@
+"""NIT, SDT, BIT から作るネットワーク・TS・サービス・ブロードキャスタの一覧
+
+セクションはサブテーブル (table_id と network_id などの組) ごとに
+version_number と受信済みの section_number を覚えておき、同じ版の
+受信済みのセクションは記述子を解析せずに捨てる。版が変わった場合は
+そのサブテーブルから得た情報を作り直す。同じ TS やサービスが複数の
+サブテーブル (自ネットワークと他ネットワークの NIT、自 TS と他 TS の SDT)
+にある場合は、それらの全てから消えた時に一覧から消す。
+
+    database = NetworkDatabase()
+    with tsopen(path) as ts:
+        database.scan(ts)
+    for service in database.services():
+        print(service.channel, service.service_id, service.name)
+"""
+
+from ariblib.descriptors import (
+    BroadcasterNameDescriptor,
+    LogoTransmissionDescriptor,
+    NetworkNameDescriptor,
+    SatelliteDeliverySystemDescriptor,
+    ServiceDescriptor,
+    ServiceListDescriptor,
+    TerrestrialDeliverySystemDescriptor,
+    TSInformationDescriptor,
+)
+from ariblib.sections import (
+    BroadcasterInformationSection,
+    NetworkInformationSection,
+    ServiceDescriptionSection,
+)
+from ariblib.service import tsid2channel
+
+# 既定で揃うのを待つテーブル (自ネットワークの NIT, 自 TS の SDT, BIT)
+REQUIRED_TABLES = (0x40, 0x42, 0xC4)
+
+SECTIONS = (NetworkInformationSection, ServiceDescriptionSection,
+            BroadcasterInformationSection)
+
+
+class SubTable(object):
+
+    """サブテーブルの版と受信済みのセクション"""
+
+    def __init__(self, version_number, last_section_number):
+        self.version_number = version_number
+        self.last_section_number = last_section_number
+        self.section_numbers = set()
+        # このサブテーブルから作ったもののキー
+        self.keys = set()
+
+    @property
+    def complete(self):
+        return len(self.section_numbers) > self.last_section_number
+
+
+class Network(object):
+
+    """ネットワーク (NIT)"""
+
+    def __init__(self, network_id):
+        self.network_id = network_id
+        self.name = ''
+
+
+class TransportStream(object):
+
+    """TS (NIT の TS ループ)
+
+    delivery_system は 'satellite' か 'terrestrial' (分配システム記述子が
+    無ければ None)、frequency は衛星なら GHz、地上なら MHz"""
+
+    def __init__(self, original_network_id, transport_stream_id):
+        self.original_network_id = original_network_id
+        self.transport_stream_id = transport_stream_id
+        self.network_id = None
+        self.name = ''
+        self.remote_control_key_id = None
+        self.delivery_system = None
+        self.frequency = None
+        self.orbital_position = None
+        self.polarisation = None
+        # service_id から service_type
+        self.service_types = {}
+
+    @property
+    def channel(self):
+        """recpt1 が認識する channel 形式
+
+        分配システム記述子の周波数から求め、無ければ transport_stream_id から推測する"""
+
+        frequency = self.frequency
+        if self.delivery_system == 'satellite' and frequency:
+            if frequency < 12.2:
+                # BS 右旋 (奇数チャンネル、38.36MHz 間隔)
+                number = round((frequency - 11.72748) / 0.03836) * 2 + 1
+                return 'BS{:02d}_{}'.format(
+                    number, self.transport_stream_id & 0x07)
+            # 110度 CS 左旋 (偶数チャンネル、40MHz 間隔)
+            return 'CS{:02d}'.format(
+                round((frequency - 12.291) / 0.04) * 2 + 2)
+        if self.delivery_system == 'terrestrial' and frequency:
+            # UHF 13ch が 473+1/7MHz、6MHz 間隔
+            return str(round((frequency - 473 - 1 / 7) / 6) + 13)
+        if self.delivery_system is None:
+            return tsid2channel(self.transport_stream_id)
+        return None
+
+
+class NetworkService(object):
+
+    """サービス (SDT のサービスループ)"""
+
+    def __init__(self, original_network_id, transport_stream_id, service_id):
+        self.original_network_id = original_network_id
+        self.transport_stream_id = transport_stream_id
+        self.service_id = service_id
+        self.service_type = None
+        self.provider = ''
+        self.name = ''
+        self.logo_id = None
+        self.free_CA_mode = None
+        self.eit_schedule = None
+        self.pseit = None
+        self.transport_stream = None
+
+    @property
+    def channel(self):
+        if self.transport_stream is None:
+            return tsid2channel(self.transport_stream_id)
+        return self.transport_stream.channel
+
+
+class Broadcaster(object):
+
+    """ブロードキャスタ (BIT)"""
+
+    def __init__(self, original_network_id, broadcaster_id):
+        self.original_network_id = original_network_id
+        self.broadcaster_id = broadcaster_id
+        self.name = ''
+
+
+class NetworkDatabase(object):
+
+    """NIT, SDT, BIT を受け取って重複のない一覧を作る
+
+    tables は complete が真になるために受信が必要な table_id。
+    other_streams を真にすると、NIT にある同じネットワークの全ての TS の
+    SDT (他 TS の SDT を含む) が揃うまで complete にならない。"""
+
+    Sections = SECTIONS
+
+    def __init__(self, tables=REQUIRED_TABLES, other_streams=False):
+        self.tables = tuple(tables)
+        self.other_streams = other_streams
+        self.subtables = {}
+        self.networks = {}
+        self.transport_streams = {}
+        self.services_map = {}
+        self.broadcasters = {}
+
+    def add(self, section):
+        """セクションを一つ与え、一覧が変わったかどうかを返す"""
+
+        key = self._key(section)
+        if key is None:
+            return False
+
+        subtable = self.subtables.get(key)
+        if subtable is None or \
+                subtable.version_number != section.version_number:
+            if subtable is not None:
+                self._forget(subtable)
+            subtable = SubTable(section.version_number,
+                                section.last_section_number)
+            self.subtables[key] = subtable
+        elif section.section_number in subtable.section_numbers:
+            return False
+        subtable.section_numbers.add(section.section_number)
+
+        if isinstance(section, NetworkInformationSection):
+            self._add_nit(section, subtable)
+        elif isinstance(section, ServiceDescriptionSection):
+            self._add_sdt(section, subtable)
+        else:
+            self._add_bit(section, subtable)
+        return True
+
+    def scan(self, ts):
+        """TS からセクションを読み、その TS で受信を始めたサブテーブルと
+        tables の全てが揃った時点で止める
+
+        複数の TS (トランスポンダごとの録画など) を続けて与えられる。
+        complete になったかどうかを返す"""
+
+        keys = set()
+        for section in ts.sections(*self.Sections):
+            self.add(section)
+            key = self._key(section)
+            if key is not None:
+                keys.add(key)
+            if self._received(keys) and self._other_streams_received():
+                break
+        return self.complete
+
+    @property
+    def complete(self):
+        """必要なテーブルと、受信を始めたサブテーブルが全て揃ったかどうか"""
+
+        return self._received(self.subtables) and \
+            self._other_streams_received()
+
+    def _key(self, section):
+        """セクションのサブテーブルのキー。使わないセクションなら None"""
+
+        if not section.current_next_indicator:
+            return None
+        if isinstance(section, NetworkInformationSection):
+            return (section.table_id, section.network_id)
+        if isinstance(section, ServiceDescriptionSection):
+            return (section.table_id, section.original_network_id,
+                    section.transport_stream_id)
+        if isinstance(section, BroadcasterInformationSection):
+            return (section.table_id, section.original_network_id)
+        return None
+
+    def _received(self, keys):
+        """keys のサブテーブルが全て揃い、tables を全て含むかどうか"""
+
+        if not set(key[0] for key in keys).issuperset(self.tables):
+            return False
+        return all(self.subtables[key].complete for key in keys)
+
+    def _other_streams_received(self):
+        """other_streams が真なら、NIT にある TS の SDT を全て受信したかどうか"""
+
+        if self.other_streams:
+            for key, stream in self.transport_streams.items():
+                if stream.network_id != stream.original_network_id:
+                    continue
+                if (0x42,) + key not in self.subtables and \
+                        (0x46,) + key not in self.subtables:
+                    return False
+        return True
+
+    def services(self):
+        """サービスを (original_network_id, transport_stream_id, service_id)
+        の順に返す"""
+
+        for key in sorted(self.services_map):
+            yield self.services_map[key]
+
+    def _forget(self, subtable):
+        """版が変わったサブテーブルから作ったもののうち、
+        他のサブテーブルにないものを消す"""
+
+        held = set()
+        for other in self.subtables.values():
+            if other is not subtable:
+                held.update(other.keys)
+        removed_stream = False
+        for item in subtable.keys - held:
+            kind, key = item
+            getattr(self, kind).pop(key, None)
+            removed_stream = removed_stream or kind == 'transport_streams'
+        if removed_stream:
+            for service in self.services_map.values():
+                self._link(service)
+
+    def _add_nit(self, nit, subtable):
+        network = self.networks.get(nit.network_id)
+        if network is None:
+            network = Network(nit.network_id)
+            self.networks[nit.network_id] = network
+        subtable.keys.add(('networks', nit.network_id))
+        for descriptor in nit.network_descriptors.get(NetworkNameDescriptor,
+                                                      []):
+            network.name = str(descriptor.char)
+
+        for item in nit.transport_streams:
+            key = (item.original_network_id, item.transport_stream_id)
+            stream = self.transport_streams.get(key)
+            if stream is None:
+                stream = TransportStream(*key)
+                self.transport_streams[key] = stream
+            subtable.keys.add(('transport_streams', key))
+            stream.network_id = nit.network_id
+            descriptors = item.descriptors
+            for descriptor in descriptors.get(TSInformationDescriptor, []):
+                stream.name = str(descriptor.ts_name_char)
+                stream.remote_control_key_id = \
+                    descriptor.remote_control_key_id
+            for descriptor in descriptors.get(
+                    SatelliteDeliverySystemDescriptor, []):
+                stream.delivery_system = 'satellite'
+                stream.frequency = descriptor.frequency
+                stream.orbital_position = descriptor.orbital_position
+                stream.polarisation = descriptor.polarisation
+            for descriptor in descriptors.get(
+                    TerrestrialDeliverySystemDescriptor, []):
+                stream.delivery_system = 'terrestrial'
+                if descriptor.freqs:
+                    stream.frequency = descriptor.freqs[0].frequency / 7
+            for descriptor in descriptors.get(ServiceListDescriptor, []):
+                for service in descriptor.services:
+                    stream.service_types[service.service_id] = \
+                        service.service_type
+            for service in self.services_map.values():
+                if (service.original_network_id,
+                        service.transport_stream_id) == key:
+                    self._link(service)
+
+    def _add_sdt(self, sdt, subtable):
+        network_id = sdt.original_network_id
+        stream_id = sdt.transport_stream_id
+        for item in sdt.services:
+            key = (network_id, stream_id, item.service_id)
+            service = self.services_map.get(key)
+            if service is None:
+                service = NetworkService(*key)
+                self.services_map[key] = service
+            subtable.keys.add(('services_map', key))
+            service.free_CA_mode = item.free_CA_mode
+            service.eit_schedule = item.EIT_schedule_flag
+            service.pseit = item.EIT_present_following_flag
+            descriptors = item.descriptors
+            for descriptor in descriptors.get(ServiceDescriptor, []):
+                service.service_type = descriptor.service_type
+                service.provider = str(descriptor.service_provider_name)
+                service.name = str(descriptor.service_name)
+            for descriptor in descriptors.get(LogoTransmissionDescriptor,
+                                              []):
+                if descriptor.logo_transmission_type in (0x01, 0x02):
+                    service.logo_id = descriptor.logo_id
+            self._link(service)
+
+    def _add_bit(self, bit, subtable):
+        network_id = bit.original_network_id
+        for item in bit.broadcasters:
+            key = (network_id, item.broadcaster_id)
+            broadcaster = self.broadcasters.get(key)
+            if broadcaster is None:
+                broadcaster = Broadcaster(*key)
+                self.broadcasters[key] = broadcaster
+            subtable.keys.add(('broadcasters', key))
+            for descriptor in item.descriptors.get(BroadcasterNameDescriptor,
+                                                   []):
+                broadcaster.name = str(descriptor.char)
+
+    def _link(self, service):
+        stream = self.transport_streams.get(
+            (service.original_network_id, service.transport_stream_id))
+        service.transport_stream = stream
+        if stream is not None and service.service_type is None:
+            service.service_type = stream.service_types.get(
+                service.service_id)
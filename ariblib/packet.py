@@ -1,8 +1,11 @@
 from collections import defaultdict
 from datetime import timedelta
 from io import BufferedReader, FileIO
-from itertools import chain
+import os
+import stat
+import time
 
+from ariblib import stats
 from ariblib.mnemonics import (
     bcdtime,
     bslbf,
@@ -14,6 +17,7 @@ from ariblib.mnemonics import (
     times,
     uimsbf,
 )
+from ariblib.descriptors import descriptor_tags
 from ariblib.syntax import Syntax
 from ariblib.sections import Section
 
@@ -38,22 +42,42 @@ class TransportStreamFile(BufferedReader):
 
     def __iter__(self):
         packet_size = self.PACKET_SIZE
-        chunk_size = self.chunk_size
-        buffer_size = packet_size * chunk_size
-        packets = iter(lambda: self.read(buffer_size), b'')
-        for packet in packets:
-            for start, stop in zip(
-                range(0, buffer_size - packet_size + 1, packet_size),
-                range(packet_size, buffer_size + 1, packet_size)
-            ):
-                next = packet[start:stop]
-                if not next:
-                    raise StopIteration
-                yield next
+        for chunk in self.chunks():
+            for start in range(0, len(chunk), packet_size):
+                yield chunk[start:start + packet_size]
+
+    def chunks(self):
+        """パケット長の倍数に揃えた、最大 chunk_size パケットのバイト列を返す"""
+
+        packet_size = self.PACKET_SIZE
+        buffer_size = packet_size * self.chunk_size
+        rest = b''
+        for chunk in iter(lambda: self._read_chunk(buffer_size), b''):
+            if rest:
+                chunk = rest + chunk
+            # パケット長に満たない末尾は次の読み込みとつなげる
+            end = len(chunk) - len(chunk) % packet_size
+            if stats.enabled:
+                stats.count('packets', n=end // packet_size)
+            if end:
+                yield chunk if end == len(chunk) else chunk[:end]
+            rest = chunk[end:]
 
     def __next__(self):
         return self.read(self.PACKET_SIZE)
 
+    def _read_chunk(self, size, read=None):
+        """size バイトを読み込む。計測が有効なら読み込みの時間と量を数える"""
+
+        if read is None:
+            read = self.read
+        if not stats.enabled:
+            return read(size)
+        with stats.timer('read'):
+            chunk = read(size)
+        stats.count('bytes', n=len(chunk))
+        return chunk
+
     def on(self, Section):
         """セクションごとにコールバック関数を設定する
         いまのところ、一つのセクションについてコールバック関数は1つのみ定義できる。
@@ -69,57 +93,27 @@ class TransportStreamFile(BufferedReader):
         for section in self.sections(*self._callbacks.keys()):
             self._callbacks[type(section)](section)
 
-    def sections(self, *Sections):
-        """パケットストリームから指定のセクションを返す"""
+    def sections(self, *Sections, descriptors=None):
+        """パケットストリームから指定のセクションを返す
 
-        buf = defaultdict(bytearray)
-
-        target_pids =\
-            set(chain.from_iterable(Section._pids for Section in Sections))
-        table_map = defaultdict(set)
-        target_ids = dict()
-        for Section in Sections:
-            for PID in Section._pids:
-                for table_id in Section._table_ids:
-                    target_ids[(PID, table_id)] = Section
-                    table_map[PID].add(table_id)
+        descriptors に記述子クラス (またはタグ) の並びを与えると、
+        セクションの記述子のうちそれ以外のものは解析しない"""
 
+        parser = SectionParser(*[Section for Section in Sections
+                                 if not is_pes(Section)],
+                               descriptors=descriptors)
+        pes_parser = PESParser(*[Section for Section in Sections
+                                 if is_pes(Section)])
+        table_map = parser.table_map
+        pes_classes = pes_parser.classes
         for packet in self:
             PID = pid(packet)
-            if PID not in target_pids:
-                continue
-
-            buffer = buf[PID]
-            table_ids = table_map[PID]
-            prev, current = payload(packet)
-            if payload_unit_start_indicator(packet):
-                if buffer:
-                    buffer.extend(prev)
-                while buffer and buffer[0] != 0xFF:
-                    if buffer[0] in table_ids:
-                        section = target_ids[(PID, buffer[0])](buffer[:])
-                        yield section
-                    try:
-                        if buffer[0:3] == b'\x00\x00\x01':
-                            break
-                        else:
-                            next_start =\
-                                ((buffer[1] & 0x0F) << 8 | buffer[2]) + 3
-                            buffer[:] = buffer[next_start:]
-                    except (IndexError, AttributeError):
-                        break
-                buffer[:] = current
-            elif not buffer:
-                continue
-            else:
-                buffer.extend(current)
-
-        # 残ったバッファを片付ける
-        for PID, buffer in buf.items():
-            if buffer and buffer[0] in table_ids:
-                section = target_ids[(PID, buffer[0])](buffer[:])
-                if section.isfull():
-                    yield section
+            if PID in table_map:
+                yield from parser.feed(packet)
+            elif PID in pes_classes:
+                yield from pes_parser.feed(packet)
+        yield from parser.flush()
+        yield from pes_parser.flush()
 
     tables = sections
 
@@ -165,17 +159,312 @@ class TransportStreamFile(BufferedReader):
                         return tsmap.elementary_PID
 
     def pcrs(self):
-        """adaptation filed にある PCR から求めた timedelta オブジェクトを返す
-
-        FIXME: PCR フラグでなく OPCR フラグが立っているときに、この関数は OPCR を返す
-        """
+        """adaptation filed にある PCR から求めた timedelta オブジェクトを返す"""
 
         for packet in self:
-            if has_adaptation(packet) and packet[4] and packet[5]:
-                pcr = ((packet[6] << 25) | (packet[7] << 17) |
-                       (packet[8] << 9) | (packet[9] << 1) |
-                       ((packet[10] & 0x80) >> 7))
-                yield timedelta(seconds=pcr / 90000)
+            value = pcr(packet)
+            if value is not None:
+                yield value
+
+
+class LiveTransportStreamFile(TransportStreamFile):
+
+    """追記され続けている TS ファイルや標準入力
+
+    読み込めた分のパケットをすぐに返す。通常のファイルの末尾に達した場合は
+    poll_interval 秒ごとに追記を待ち、idle_timeout 秒追記がなければ終了する。
+    パイプの場合は書き込み側が閉じるまで読み込む。
+    """
+
+    def __init__(self, path, chunk_size=100, poll_interval=0.1,
+                 idle_timeout=10):
+        TransportStreamFile.__init__(self, path, chunk_size)
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.follow = stat.S_ISREG(os.fstat(self.fileno()).st_mode)
+
+    def chunks(self):
+        packet_size = self.PACKET_SIZE
+        buffer_size = packet_size * self.chunk_size
+        rest = b''
+        idle = 0
+        while True:
+            chunk = self._read_chunk(buffer_size, self.read1)
+            if not chunk:
+                if not self.follow or idle >= self.idle_timeout:
+                    return
+                time.sleep(self.poll_interval)
+                idle += self.poll_interval
+                continue
+            idle = 0
+            if rest:
+                chunk = rest + chunk
+            end = len(chunk) - len(chunk) % packet_size
+            if stats.enabled:
+                stats.count('packets', n=end // packet_size)
+            if end:
+                yield chunk if end == len(chunk) else chunk[:end]
+            rest = chunk[end:]
+
+
+class SectionParser(object):
+
+    """パケットを一つずつ受け取ってセクションを組み立てる
+
+    TransportStreamFile.sections() の処理をパケット単位で行えるようにしたもの。
+    対象のセクションは途中で追加・削除できる。
+    descriptors を与えると、組み立てたセクションで解析する記述子をそれに限る。
+    """
+
+    def __init__(self, *Sections, descriptors=None):
+        self.buffers = defaultdict(bytearray)
+        self.descriptor_tags = descriptor_tags(descriptors)
+        # PID ごとの対象の table_id
+        self.table_map = dict()
+        self.target_ids = dict()
+        for Section in Sections:
+            self.add(Section)
+
+    def add(self, Section, pids=None):
+        """対象のセクションを追加する
+
+        pids を省略した場合はセクションクラスの _pids を使う"""
+
+        if pids is None:
+            pids = Section._pids
+        for PID in pids:
+            table_ids = self.table_map.setdefault(PID, set())
+            for table_id in Section._table_ids:
+                self.target_ids[(PID, table_id)] = Section
+                table_ids.add(table_id)
+
+    def discard(self, PID):
+        """指定の PID をセクションの組み立て対象から外す"""
+
+        self.table_map.pop(PID, None)
+        self.buffers.pop(PID, None)
+
+    def feed(self, packet):
+        """パケットを一つ与え、組み上がったセクションのリストを返す"""
+
+        if not stats.enabled:
+            return self._feed(packet)
+        with stats.timer('reassembly'):
+            result = self._feed(packet)
+        for section in result:
+            stats.count('sections_assembled', section._packet[0])
+        return result
+
+    def _feed(self, packet):
+        PID = pid(packet)
+        table_ids = self.table_map.get(PID)
+        if table_ids is None:
+            return []
+
+        result = []
+        buffer = self.buffers[PID]
+        prev, current = payload(packet)
+        if payload_unit_start_indicator(packet):
+            if buffer:
+                buffer.extend(prev)
+            while buffer and buffer[0] != 0xFF:
+                if buffer[0] in table_ids:
+                    result.append(self._section(PID, buffer[:]))
+                try:
+                    if buffer[0:3] == b'\x00\x00\x01':
+                        break
+                    else:
+                        next_start =\
+                            ((buffer[1] & 0x0F) << 8 | buffer[2]) + 3
+                        buffer[:] = buffer[next_start:]
+                except (IndexError, AttributeError):
+                    break
+            buffer[:] = current
+        elif buffer:
+            buffer.extend(current)
+        if buffer:
+            self._complete(PID, buffer, table_ids, result)
+        return result
+
+    def _complete(self, PID, buffer, table_ids, result):
+        """バッファの先頭から揃ったセクションを取り出す
+
+        次のセクションの開始 (payload_unit_start_indicator) を待たずに返すので、
+        TOT などを受信した時点の PCR と組にできる"""
+
+        while len(buffer) >= 3 and buffer[0] != 0xFF:
+            if buffer[0:3] == b'\x00\x00\x01':
+                return
+            end = ((buffer[1] & 0x0F) << 8 | buffer[2]) + 3
+            if len(buffer) < end:
+                return
+            if buffer[0] in table_ids:
+                result.append(self._section(PID, buffer[:end]))
+            del buffer[:end]
+        if buffer and buffer[0] == 0xFF:
+            buffer.clear()
+
+    def _section(self, PID, data):
+        section = self.target_ids[(PID, data[0])](data)
+        if self.descriptor_tags is not None:
+            section._descriptor_tags = self.descriptor_tags
+        return section
+
+    def flush(self):
+        """バッファに残ったセクションのうち、揃っているものを返す"""
+
+        result = []
+        for PID, buffer in self.buffers.items():
+            table_ids = self.table_map.get(PID, ())
+            if buffer and buffer[0] in table_ids:
+                section = self._section(PID, buffer[:])
+                if section.isfull():
+                    result.append(section)
+            buffer.clear()
+        return result
+
+
+class PESParser(object):
+
+    """パケットを一つずつ受け取って PES パケットを組み立てる
+
+    PSI のセクションとは別に、payload_unit_start_indicator で PES の先頭を、
+    PES_packet_length で終わりを判定する。PES_packet_length 分が揃った時点で
+    PES を返すので、次の PES の先頭を待たない。
+    PES_packet_length が 0 の場合 (動画など) は次の PES の先頭を受信した時点で返す。
+    continuity_counter が不連続の場合は組み立て中の PES を捨て、dropped に数える。
+    """
+
+    def __init__(self, *PESs):
+        self.buffers = dict()
+        self.counters = dict()
+        # PID ごとの PES クラス
+        self.classes = dict()
+        self.dropped = 0
+        for PES in PESs:
+            self.add(PES)
+
+    def add(self, PES, pids=None):
+        """対象の PES クラスを追加する
+
+        pids を省略した場合はクラスの _pids を使う"""
+
+        if pids is None:
+            pids = PES._pids
+        for PID in pids:
+            self.classes[PID] = PES
+
+    def discard(self, PID):
+        """指定の PID を PES の組み立て対象から外す"""
+
+        self.classes.pop(PID, None)
+        self.buffers.pop(PID, None)
+        self.counters.pop(PID, None)
+
+    def feed(self, packet):
+        """パケットを一つ与え、組み上がった PES のリストを返す"""
+
+        if not stats.enabled:
+            return self._feed(packet)
+        with stats.timer('pes_reassembly'):
+            result = self._feed(packet)
+        for pes in result:
+            stats.count('pes_assembled', pes._packet[3])
+        return result
+
+    def _feed(self, packet):
+        PID = pid(packet)
+        PES = self.classes.get(PID)
+        if PES is None or not packet[3] & 0x10:
+            return []
+
+        counter = packet[3] & 0x0F
+        last = self.counters.get(PID)
+        if counter == last:
+            # 重複パケット
+            return []
+        self.counters[PID] = counter
+        continuous = last is None or counter == (last + 1) & 0x0F
+
+        start = 4
+        if packet[3] & 0x20:
+            start += 1 + packet[4]
+
+        result = []
+        buffer = self.buffers.get(PID)
+        if packet[1] & 0x40:
+            if buffer is not None:
+                # 長さ不定の PES は次の PES の先頭で完了とする
+                if continuous and len(buffer) > 8 and not (
+                        buffer[4] or buffer[5]):
+                    result.append(PES(buffer))
+                else:
+                    self.dropped += 1
+            buffer = bytearray(packet[start:])
+            if buffer[0:3] != b'\x00\x00\x01':
+                self.buffers.pop(PID, None)
+                self.dropped += 1
+                return result
+            self.buffers[PID] = buffer
+        elif buffer is None:
+            return result
+        elif not continuous:
+            del self.buffers[PID]
+            self.dropped += 1
+            return result
+        else:
+            buffer.extend(packet[start:])
+
+        if len(buffer) >= 6:
+            length = (buffer[4] << 8) | buffer[5]
+            if length and len(buffer) >= length + 6:
+                # パケット末尾のスタッフィングを除く
+                del buffer[length + 6:]
+                del self.buffers[PID]
+                result.append(PES(buffer))
+        return result
+
+    def flush(self):
+        """バッファに残った長さ不定の PES を返す"""
+
+        result = []
+        for PID, buffer in self.buffers.items():
+            if len(buffer) > 8 and not (buffer[4] or buffer[5]):
+                result.append(self.classes[PID](buffer))
+        self.buffers.clear()
+        return result
+
+
+def is_pes(Section):
+    """セクションクラスが PES を表すかどうかを返す"""
+
+    return issubclass(Section, PacketizedElementaryStream)
+
+
+def pes_pts(pes):
+    """PES パケットの PTS を timedelta として返す。PTS がない場合は None を返す
+
+    PES ヘッダのバイト列から直接求めるので、PES をコピーしない"""
+
+    if not pes[7] & 0x80:
+        return None
+    return timedelta(seconds=_timestamp(pes, 9) / 90000)
+
+
+def pes_dts(pes):
+    """PES パケットの DTS を timedelta として返す。DTS がない場合は None を返す"""
+
+    if pes[7] & 0xC0 != 0xC0:
+        return None
+    return timedelta(seconds=_timestamp(pes, 14) / 90000)
+
+
+def _timestamp(pes, index):
+    """PES ヘッダの index バイト目からの 33bit のタイムスタンプを返す"""
+
+    return (((pes[index] & 0x0E) << 29) | (pes[index + 1] << 22) |
+            ((pes[index + 2] & 0xFE) << 14) | (pes[index + 3] << 7) |
+            (pes[index + 4] >> 1))
 
 
 def tsopen(path, chunk=10000):
@@ -222,6 +511,19 @@ def continuity_counter(packet):
     return packet[3] & 0x0F
 
 
+def pcr(packet):
+    """adaptation field に PCR があればそれを timedelta として返す
+
+    PCR がない場合は None を返す"""
+
+    if not packet[3] & 0x20 or packet[4] < 7 or not packet[5] & 0x10:
+        return None
+    base = ((packet[6] << 25) | (packet[7] << 17) |
+            (packet[8] << 9) | (packet[9] << 1) |
+            ((packet[10] & 0x80) >> 7))
+    return timedelta(seconds=base / 90000)
+
+
 def adaptation_field(packet):
     """パケットから adaptaton field 部分を返す"""
 
@@ -302,46 +604,221 @@ class AdaptationField(Syntax):
         private_data_byte = bslbf(transport_private_data_length)
 
 
-class SynchronizedPacketizedElementaryStream(Section):
+# PES ヘッダの任意フィールドを持たない stream_id
+# program_stream_map, padding_stream, private_stream_2, ECM, EMM,
+# DSMCC_stream, ITU-T Rec. H.222.1 type E, program_stream_directory
+NO_HEADER_STREAM_IDS = (0xBC, 0xBE, 0xBF, 0xF0, 0xF1, 0xF2, 0xF8, 0xFF)
+
+
+def _optional_fields_length(self):
+    """PES ヘッダの任意フィールドのバイト数を返す"""
 
-    """ISO/IEC 13818-1 2.4.3.7
+    length = {0b10: 5, 0b11: 10}.get(self.PTS_DTS_flags, 0)
+    length += (6 * self.ESCR_flag + 3 * self.ES_rate_flag +
+               self.DSM_trick_mode_flag + self.additional_copy_info_flag +
+               2 * self.PES_CRC_flag)
+    if self.PES_extension_flag:
+        length += 1 + 16 * self.PES_private_data_flag
+        if self.pack_header_field_flag:
+            length += 1 + self.pack_field_length
+        length += (2 * self.program_packet_sequence_counter_flag +
+                   2 * self.P_STD_buffer_flag)
+        if self.PES_extension_flag_2:
+            length += 1 + self.PES_extension_field_length
+    return length
 
-    FIXME: 字幕 PES パケット専用の実装になっている
-    字幕部分の仕様は ARIB STD-B24-1-3-9
+
+class PacketizedElementaryStream(Section):
+
+    """PES パケット (ISO/IEC 13818-1 2.4.3.6)
+
+    PTS_DTS_flags などのフラグに従って任意フィールドを読む。
+    pts, dts, header_length, payload はシンタックスを介さずに
+    バイト列から直接求める。
     """
 
+    _pids = []
+
     packet_start_code_prefix = bslbf(24)
     stream_id = uimsbf(8)
     PES_packet_length = uimsbf(16)
-    should_be_10 = bslbf(2)
-    PES_scrambling_control = bslbf(2)
-    PES_priority = bslbf(1)
-    data_alignment_indicator = bslbf(1)
-    copyright = bslbf(1)
-    original_or_copy = bslbf(1)
-    PTS_DTS_flags = bslbf(2)
-    ESCR_flag = bslbf(1)
-    ES_rate_flag = bslbf(1)
-    DSM_trick_mode_flag = bslbf(1)
-    additional_copy_into_flag = bslbf(1)
-    PES_CRC_flag = bslbf(1)
-    PES_extension_flag = bslbf(1)
-    PES_header_data_length = uimsbf(8)
-    should_be_0010 = bslbf(4)
-    PTS_1 = uimsbf(3)
-    marker_bit_1 = bslbf(1)
-    PTS_2 = uimsbf(15)
-    marler_bit_2 = bslbf(1)
-    PTS_3 = uimsbf(15)
-    marker_bit_3 = bslbf(1)
-    PES_private_data_flag = bslbf(1)
-    pack_header_field_flag = bslbf(1)
-    program_packet_sequence_counter_flag = bslbf(1)
-    P_STD_buffer_flag = bslbf(1)
-    reserved4 = bslbf(3)
-    PES_extension_flag_2 = bslbf(1)
-    PES_private_data = bslbf(128)
-    stuffing_byte = bslbf(lambda self: self.PES_header_data_length - 22)
+
+    @case(lambda self: self.stream_id not in NO_HEADER_STREAM_IDS)
+    class with_header(Syntax):
+        should_be_10 = bslbf(2)
+        PES_scrambling_control = bslbf(2)
+        PES_priority = bslbf(1)
+        data_alignment_indicator = bslbf(1)
+        copyright = bslbf(1)
+        original_or_copy = bslbf(1)
+        PTS_DTS_flags = bslbf(2)
+        ESCR_flag = bslbf(1)
+        ES_rate_flag = bslbf(1)
+        DSM_trick_mode_flag = bslbf(1)
+        additional_copy_info_flag = bslbf(1)
+        PES_CRC_flag = bslbf(1)
+        PES_extension_flag = bslbf(1)
+        PES_header_data_length = uimsbf(8)
+
+        @case(lambda self: self.PTS_DTS_flags == 0b10)
+        class with_PTS(Syntax):
+            should_be_0010 = bslbf(4)
+            PTS_1 = uimsbf(3)
+            marker_bit_1 = bslbf(1)
+            PTS_2 = uimsbf(15)
+            marker_bit_2 = bslbf(1)
+            PTS_3 = uimsbf(15)
+            marker_bit_3 = bslbf(1)
+
+        @case(lambda self: self.PTS_DTS_flags == 0b11)
+        class with_PTS_DTS(Syntax):
+            should_be_0011 = bslbf(4)
+            PTS_1 = uimsbf(3)
+            marker_bit_1 = bslbf(1)
+            PTS_2 = uimsbf(15)
+            marker_bit_2 = bslbf(1)
+            PTS_3 = uimsbf(15)
+            marker_bit_3 = bslbf(1)
+            should_be_0001 = bslbf(4)
+            DTS_1 = uimsbf(3)
+            marker_bit_4 = bslbf(1)
+            DTS_2 = uimsbf(15)
+            marker_bit_5 = bslbf(1)
+            DTS_3 = uimsbf(15)
+            marker_bit_6 = bslbf(1)
+
+        @case(ESCR_flag)
+        class with_ESCR(Syntax):
+            reserved_ESCR = bslbf(2)
+            ESCR_base_1 = uimsbf(3)
+            marker_bit_7 = bslbf(1)
+            ESCR_base_2 = uimsbf(15)
+            marker_bit_8 = bslbf(1)
+            ESCR_base_3 = uimsbf(15)
+            marker_bit_9 = bslbf(1)
+            ESCR_extension = uimsbf(9)
+            marker_bit_10 = bslbf(1)
+
+        @case(ES_rate_flag)
+        class with_ES_rate(Syntax):
+            marker_bit_11 = bslbf(1)
+            ES_rate = uimsbf(22)
+            marker_bit_12 = bslbf(1)
+
+        @case(DSM_trick_mode_flag)
+        class with_trick_mode(Syntax):
+            trick_mode_control = uimsbf(3)
+
+            @case(lambda self: self.trick_mode_control in (0b000, 0b011))
+            class fast_forward_or_reverse(Syntax):
+                field_id = bslbf(2)
+                intra_slice_refresh = bslbf(1)
+                frequency_truncation = bslbf(2)
+
+            @case(lambda self: self.trick_mode_control in (0b001, 0b100))
+            class slow_motion_or_reverse(Syntax):
+                rep_cntrl = uimsbf(5)
+
+            @case(lambda self: self.trick_mode_control == 0b010)
+            class freeze_frame(Syntax):
+                field_id = bslbf(2)
+                reserved_freeze_frame = bslbf(3)
+
+            @case(lambda self: self.trick_mode_control > 0b100)
+            class reserved_trick_mode(Syntax):
+                reserved_trick_mode_data = bslbf(5)
+
+        @case(additional_copy_info_flag)
+        class with_additional_copy_info(Syntax):
+            marker_bit_13 = bslbf(1)
+            additional_copy_info = bslbf(7)
+
+        @case(PES_CRC_flag)
+        class with_CRC(Syntax):
+            previous_PES_packet_CRC = bslbf(16)
+
+        @case(PES_extension_flag)
+        class with_extension(Syntax):
+            PES_private_data_flag = bslbf(1)
+            pack_header_field_flag = bslbf(1)
+            program_packet_sequence_counter_flag = bslbf(1)
+            P_STD_buffer_flag = bslbf(1)
+            reserved_extension = bslbf(3)
+            PES_extension_flag_2 = bslbf(1)
+
+            @case(PES_private_data_flag)
+            class with_private_data(Syntax):
+                PES_private_data = raw(128)
+
+            @case(pack_header_field_flag)
+            class with_pack_header(Syntax):
+                pack_field_length = uimsbf(8)
+                pack_header = raw(pack_field_length)
+
+            @case(program_packet_sequence_counter_flag)
+            class with_sequence_counter(Syntax):
+                marker_bit_14 = bslbf(1)
+                program_packet_sequence_counter = uimsbf(7)
+                marker_bit_15 = bslbf(1)
+                MPEG1_MPEG2_identifier = bslbf(1)
+                original_stuff_length = uimsbf(6)
+
+            @case(P_STD_buffer_flag)
+            class with_P_STD_buffer(Syntax):
+                should_be_01 = bslbf(2)
+                P_STD_buffer_scale = bslbf(1)
+                P_STD_buffer_size = uimsbf(13)
+
+            @case(PES_extension_flag_2)
+            class with_extension_2(Syntax):
+                marker_bit_16 = bslbf(1)
+                PES_extension_field_length = uimsbf(7)
+                PES_extension_field = raw(PES_extension_field_length)
+
+        stuffing_byte = raw(lambda self: (
+            self.PES_header_data_length - _optional_fields_length(self)))
+
+    PES_packet_data_byte = raw(lambda self: (
+        len(self._packet) - self.header_length))
+
+    @property
+    def header_length(self):
+        """PES ヘッダのバイト数"""
+
+        if self._packet[3] in NO_HEADER_STREAM_IDS:
+            return 6
+        return 9 + self._packet[8]
+
+    @property
+    def payload(self):
+        """PES ヘッダを除いたデータの memoryview"""
+
+        return memoryview(self._packet)[self.header_length:]
+
+    @property
+    def pts(self):
+        if self._packet[3] in NO_HEADER_STREAM_IDS:
+            return None
+        return pes_pts(self._packet)
+
+    @property
+    def dts(self):
+        if self._packet[3] in NO_HEADER_STREAM_IDS:
+            return None
+        return pes_dts(self._packet)
+
+    def isfull(self):
+        """PES_packet_length で指定された分以上の
+        パケットを持っているかどうかを返す"""
+
+        return (not self.PES_packet_length or
+                self.PES_packet_length + 6 <= len(self))
+
+
+class CaptionDataGroup(Syntax):
+
+    """同期型 PES のデータグループ (ARIB-STD-B24-3-5, ARIB-STD-B24-1-3-9)"""
+
     data_identifier = uimsbf(8)
     private_stream_id = uimsbf(8)
     reserved_future_use = bslbf(4)
@@ -407,9 +884,7 @@ class SynchronizedPacketizedElementaryStream(Section):
 
         @case(lambda self: self.data_unit_parameter == 0x30)
         class DRCSString(Syntax):
-            """ARIB-STD-B24-1-2-D 表D-1 DRCS_data_structure
-
-            FIXME: width が16固定"""
+            """ARIB-STD-B24-1-2-D 表D-1 DRCS_data_structure"""
 
             data_unit_size = uimsbf(24)
             number_of_code = uimsbf(8)
@@ -423,26 +898,62 @@ class SynchronizedPacketizedElementaryStream(Section):
                 class fonts(Syntax):
                     font_id = uimsbf(4)
                     mode = bslbf(4)
-                    depth = uimsbf(8)
-                    width = uimsbf(8)
-                    height = uimsbf(8)
 
-                    @times(height)
-                    class patterns(Syntax):
-                        pattern_data = raw(16)
+                    @case(lambda self: self.mode in (0b0000, 0b0001))
+                    class with_pattern(Syntax):
+                        """パターンは1画素あたり階調数を表せるビット数で、
+                        行の区切りなく詰められている"""
 
-    @property
-    def pts(self):
-        pts = (self.PTS_1 << 30) | (self.PTS_2 << 15) | self.PTS_3
-        pts_hz = 90000
-        second = pts / pts_hz
-        return timedelta(seconds=second)
+                        depth = uimsbf(8)
+                        width = uimsbf(8)
+                        height = uimsbf(8)
+                        pattern_data = raw(lambda self: (
+                            (self.depth + 1).bit_length() *
+                            self.width * self.height + 7) // 8)
+
+                    @case(lambda self: self.mode not in (0b0000, 0b0001))
+                    class with_geometric(Syntax):
+                        region_x = uimsbf(8)
+                        region_y = uimsbf(8)
+                        geometric_data_length = uimsbf(16)
+                        geometric_data = raw(geometric_data_length)
 
-    def isfull(self):
-        """section_length などで指定された分以上の
-        パケットを持っているかどうかを返す"""
 
-        return self.PES_packet_length <= len(self) + 3
+class SynchronizedPacketizedElementaryStream(PacketizedElementaryStream):
+
+    """字幕の同期型 PES (ARIB-STD-B24-3-5)
+
+    PES ヘッダは PacketizedElementaryStream として読み、
+    続くデータグループは CaptionDataGroup として data_group から参照する。
+    データグループの項目はこのオブジェクトの属性としても参照できる。
+    """
+
+    @property
+    def data_group(self):
+        """PES ヘッダに続く字幕のデータグループ"""
+
+        data_group = self.__dict__.get('_data_group')
+        if data_group is None:
+            data_group = CaptionDataGroup(
+                self._packet, pos=self.header_length * 8, parent=self)
+            self._data_group = data_group
+        return data_group
+
+    def get_names(self):
+        return (PacketizedElementaryStream.get_names(self) +
+                self.data_group.get_names())
+
+    def __getattr__(self, name):
+        try:
+            return PacketizedElementaryStream.__getattr__(self, name)
+        except AttributeError:
+            if name.startswith('_'):
+                raise
+        value = getattr(self.data_group, name)
+        if value is None and not hasattr(CaptionDataGroup, name):
+            raise AttributeError("'{}' object has no attribute '{}'".format(
+                self.__class__.__name__, name))
+        return value
 
 
 def raw_dump(packet):
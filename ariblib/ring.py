@@ -0,0 +1,439 @@
+"""共有メモリのリングバッファで TS パケットを複数のプロセスに配る
+
+一つのプロセスが RingBufferWriter でパケットを書き込み、他のプロセスは
+SharedMemoryTransportStreamFile で同じパケットを読む。字幕・番組情報・
+統計などの解析を別々のプロセスに分けても入力は1回しか読まない。
+
+読み込み側は既定で共有メモリからまとめて (chunk_size パケットずつ) コピーした
+パケットを返すので、返したパケットを取っておいてもよい。copy=False を
+指定するとコピーせずに共有メモリの memoryview を返すが、そのパケットは
+次のまとまりを求めた時点 ('drop' ではいつでも) 書き込み側に上書きされうる。
+パケットを取っておく場合 (セクションの組み立てのバッファなど) は呼び出し側で
+コピーすること。
+
+共有メモリの先頭には 64 ビットの語で次のものを置き、その後にパケットを並べる。
+
+    0  MAGIC
+    1  capacity (パケット数)
+    2  consumers (読み込み側の枠の数)
+    3  書き込んだパケットの総数
+    4  書き込みが終わったかどうか
+    5  overrun ('drop' なら 1)
+    6- 読み込み側の枠ごとに (使用中かどうか, 読んだパケットの総数,
+       読み飛ばしたパケットの総数)
+
+読み込み側は枠の番号 (slot) を指定して接続し、読んだ位置は枠ごとに記録する。
+書き込み側は読み込み側の遅れに対して overrun で次のどちらかを選ぶ。
+
+    'block'  全ての読み込み側が読み終わるまで書き込みを待つ。stall_timeout
+             秒以上進まない読み込み側は切り離し、その読み込み側は次に読む時に
+             最新の位置から読み直す (読み飛ばした数を記録する)
+    'drop'   書き込みは待たない。capacity を超えて遅れた読み込み側は、
+             最新の位置から capacity の半分だけ戻った位置まで読み飛ばす。
+             書き込みは capacity の 1/4 ずつ行い、読み込み側はコピーした後に
+             その間に上書きされていないかを確かめる (上書きされていれば
+             読み飛ばしたものとする)
+
+    # 書き込み側
+    with RingBufferWriter('tuner0', consumers=3) as writer:
+        writer.wait(3)
+        with LiveTransportStreamFile(sys.stdin.fileno()) as ts:
+            writer.write_from(ts)
+
+    # 読み込み側 (slot は 0 から consumers - 1 まで)
+    with SharedMemoryTransportStreamFile('tuner0', slot=0) as ts:
+        for caption in captions(ts):
+            ...
+
+Python 3.8 以降の multiprocessing.shared_memory を使う。
+"""
+
+from io import BufferedReader, RawIOBase
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+import time
+
+from ariblib import stats
+from ariblib.packet import TransportStreamFile
+
+PACKET_SIZE = TransportStreamFile.PACKET_SIZE
+
+MAGIC = 0x474E495242495241  # b'ARIBRING'
+
+# 共有メモリの先頭の語の位置
+CAPACITY = 1
+CONSUMERS = 2
+WRITTEN = 3
+CLOSED = 4
+OVERRUN = 5
+HEADER_WORDS = 6
+
+# 読み込み側の枠ごとの語 (使用中かどうか, 読んだ数, 読み飛ばした数)
+SLOT_WORDS = 3
+
+OVERRUN_POLICIES = ('block', 'drop')
+
+
+def _header_size(consumers):
+    return (HEADER_WORDS + consumers * SLOT_WORDS) * 8
+
+
+def _drop_step(capacity):
+    """'drop' で一度に書き込むパケット数の上限"""
+
+    return max(1, capacity // 4)
+
+
+class _SharedMemory(SharedMemory):
+
+    """読み込み側の共有メモリ
+
+    返したパケット (memoryview) が残っている間は閉じられないので、
+    その場合は参照が無くなった時点で解放されるのに任せる"""
+
+    def close(self):
+        try:
+            SharedMemory.close(self)
+        except BufferError:
+            pass
+
+
+def _attach(name):
+    """既存の共有メモリを開く
+
+    開いただけのプロセスの終了時に resource_tracker が共有メモリを
+    消さないようにする"""
+
+    try:
+        return _SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    # Python 3.12 以前は開くだけでも resource_tracker に登録される。
+    # fork で書き込み側の resource_tracker を引き継いでいる場合は
+    # 書き込み側の登録なので外さない
+    tracker = resource_tracker._resource_tracker
+    inherited = getattr(tracker, '_fd', None) is not None
+    memory = _SharedMemory(name=name)
+    if not inherited:
+        resource_tracker.unregister(memory._name, 'shared_memory')
+    return memory
+
+
+class RingBufferWriter(object):
+
+    """TS パケットを共有メモリのリングバッファに書き込む
+
+    name を省略した場合は共有メモリの名前を自動で決める (name 属性で得られる)。
+    capacity はリングバッファに入るパケット数、consumers は読み込み側の枠の数"""
+
+    def __init__(self, name=None, capacity=1 << 16, consumers=4,
+                 overrun='block', stall_timeout=None, poll_interval=0.001):
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError('overrun must be one of {}'.format(
+                ', '.join(OVERRUN_POLICIES)))
+        self.capacity = capacity
+        self.consumers = consumers
+        self.overrun = overrun
+        self.stall_timeout = stall_timeout
+        self.poll_interval = poll_interval
+        header_size = _header_size(consumers)
+        self.memory = SharedMemory(
+            name=name, create=True,
+            size=header_size + capacity * PACKET_SIZE)
+        buf = self.memory.buf
+        self.words = buf[:header_size].cast('Q')
+        self.data = buf[header_size:header_size + capacity * PACKET_SIZE]
+        for index in range(len(self.words)):
+            self.words[index] = 0
+        self.words[CAPACITY] = capacity
+        self.words[CONSUMERS] = consumers
+        self.words[OVERRUN] = OVERRUN_POLICIES.index(overrun)
+        self.words[0] = MAGIC
+        self.written = 0
+        # 枠ごとの (最後に見た読んだ数, その時刻)
+        self._progress = [(0, 0)] * consumers
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def attached(self):
+        """接続している読み込み側の数"""
+
+        words = self.words
+        return sum(words[HEADER_WORDS + slot * SLOT_WORDS]
+                   for slot in range(self.consumers))
+
+    def wait(self, consumers, timeout=None):
+        """consumers 個の読み込み側が接続するまで待ち、揃ったかどうかを返す"""
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.attached() < consumers:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_interval)
+        return True
+
+    def write(self, data):
+        """パケット長の倍数のバイト列を書き込む"""
+
+        view = memoryview(data).cast('B')
+        if len(view) % PACKET_SIZE:
+            raise ValueError('data must be a multiple of {} bytes'.format(
+                PACKET_SIZE))
+        capacity = self.capacity
+        # 'drop' では一度に上書きする範囲を限り、読み込み側がコピーした
+        # パケットが上書きされていないかを確かめられるようにする
+        if self.overrun == 'drop':
+            step = _drop_step(capacity)
+        else:
+            step = capacity
+        position = 0
+        total = len(view) // PACKET_SIZE
+        while position < total:
+            room = self._room()
+            if not room:
+                time.sleep(self.poll_interval)
+                continue
+            start = self.written % capacity
+            count = min(room, step, total - position, capacity - start)
+            self.data[start * PACKET_SIZE:(start + count) * PACKET_SIZE] = \
+                view[position * PACKET_SIZE:(position + count) * PACKET_SIZE]
+            position += count
+            self.written += count
+            # パケットを書いてから総数を更新する
+            self.words[WRITTEN] = self.written
+
+    def write_from(self, ts):
+        """TransportStreamFile の全てのパケットを書き込む"""
+
+        for chunk in ts.chunks():
+            self.write(chunk)
+
+    def _room(self):
+        """上書きせずに書き込めるパケット数"""
+
+        capacity = self.capacity
+        if self.overrun == 'drop':
+            return capacity
+        words = self.words
+        room = capacity
+        now = None
+        for slot in range(self.consumers):
+            base = HEADER_WORDS + slot * SLOT_WORDS
+            if not words[base]:
+                continue
+            read = words[base + 1]
+            slot_room = capacity - (self.written - read)
+            if slot_room <= 0 and self.stall_timeout is not None:
+                now = now or time.monotonic()
+                last, since = self._progress[slot]
+                if last != read or not since:
+                    self._progress[slot] = (read, now)
+                elif now - since >= self.stall_timeout:
+                    # 進まない読み込み側を切り離す
+                    words[base] = 0
+                    self._progress[slot] = (0, 0)
+                    continue
+            room = min(room, slot_room)
+        return max(room, 0)
+
+    def close(self, unlink=True):
+        """書き込みの終わりを知らせ、共有メモリを閉じる
+
+        読み込み側は残りのパケットを読み終えると終わる。unlink が真なら
+        共有メモリの名前も消す (接続済みの読み込み側はそのまま読める)"""
+
+        if self.memory is None:
+            return
+        self.words[CLOSED] = 1
+        self.words.release()
+        self.data.release()
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+        self.memory = None
+
+
+class RingBufferReader(RawIOBase):
+
+    """共有メモリのリングバッファの読み込み側の枠一つ
+
+    batches() は既定で共有メモリの memoryview を返す。次の batch を
+    求めた時点で前の batch を読み終えたものとして書き込み側に位置を知らせるので、
+    その memoryview はそれ以降 (overrun が 'drop' ならいつでも) 上書きされうる。
+    copy を真にすると bytes にコピーして返し、コピーした時点で位置を知らせる"""
+
+    def __init__(self, name, slot=0, poll_interval=0.001):
+        RawIOBase.__init__(self)
+        self.memory = _attach(name)
+        buf = self.memory.buf
+        words = buf[:HEADER_WORDS * 8].cast('Q')
+        if words[0] != MAGIC:
+            words.release()
+            self.memory.close()
+            raise ValueError('{} is not a packet ring buffer'.format(name))
+        self.capacity = words[CAPACITY]
+        consumers = words[CONSUMERS]
+        self.drop = OVERRUN_POLICIES[words[OVERRUN]] == 'drop'
+        words.release()
+        if not 0 <= slot < consumers:
+            self.memory.close()
+            raise ValueError('slot must be less than {}'.format(consumers))
+        header_size = _header_size(consumers)
+        self.words = buf[:header_size].cast('Q')
+        self.data = buf[header_size:header_size + self.capacity * PACKET_SIZE]
+        self.slot = HEADER_WORDS + slot * SLOT_WORDS
+        self.poll_interval = poll_interval
+        self.position = self.words[WRITTEN]
+        self.words[self.slot + 1] = self.position
+        self.words[self.slot + 2] = 0
+        self.words[self.slot] = 1
+
+    @property
+    def dropped(self):
+        """遅れて読み飛ばしたパケット数"""
+
+        return self.words[self.slot + 2]
+
+    def readable(self):
+        return True
+
+    def _available(self):
+        """次に読めるパケットの (リング上の位置, 数) を返す。終わりなら None"""
+
+        words = self.words
+        slot = self.slot
+        capacity = self.capacity
+        while True:
+            if not words[slot]:
+                # 書き込み側に切り離されたので最新の位置から読み直す
+                written = words[WRITTEN]
+                self._skip(written)
+                words[slot] = 1
+            closed = words[CLOSED]
+            written = words[WRITTEN]
+            lag = written - self.position
+            if lag > capacity:
+                self._skip(written - capacity // 2)
+                lag = written - self.position
+            if lag:
+                start = self.position % capacity
+                return start, min(lag, capacity - start)
+            if closed:
+                return None
+            time.sleep(self.poll_interval)
+
+    def _skip(self, position):
+        words = self.words
+        words[self.slot + 2] += position - self.position
+        self._advance(position - self.position)
+
+    def _advance(self, count):
+        self.position += count
+        self.words[self.slot + 1] = self.position
+
+    def _overwritten(self):
+        """読もうとしている位置のパケットが上書きされた (されている途中の)
+        可能性があるかどうか
+
+        'drop' の書き込み側は書き込んだ総数から _drop_step 先までを
+        書き込んでいる途中のことがある"""
+
+        if not self.drop:
+            return False
+        written = self.words[WRITTEN]
+        return written + _drop_step(self.capacity) > \
+            self.position + self.capacity
+
+    def _copy(self, start, count):
+        """リング上の start から count パケットをコピーする
+
+        コピーの間に上書きされた場合は読み飛ばして None を返す"""
+
+        data = bytes(self.data[start * PACKET_SIZE:
+                               (start + count) * PACKET_SIZE])
+        if self._overwritten():
+            self._skip(max(self.position,
+                           self.words[WRITTEN] - self.capacity // 2))
+            return None
+        self._advance(count)
+        return data
+
+    def batches(self, max_packets=None, copy=False):
+        """最大 max_packets パケットずつ、共有メモリの memoryview
+        (copy が真なら bytes) を返す"""
+
+        while True:
+            found = self._available()
+            if found is None:
+                return
+            start, count = found
+            if max_packets is not None:
+                count = min(count, max_packets)
+            if copy:
+                data = self._copy(start, count)
+                if data is not None:
+                    yield data
+                continue
+            yield self.data[start * PACKET_SIZE:(start + count) * PACKET_SIZE]
+            self._advance(count)
+
+    def readinto(self, buffer):
+        """パケット単位でコピーして読み込む (read() 用)"""
+
+        count = len(buffer) // PACKET_SIZE
+        if not count:
+            raise ValueError('buffer must be at least {} bytes'.format(
+                PACKET_SIZE))
+        while True:
+            found = self._available()
+            if found is None:
+                return 0
+            start, available = found
+            data = self._copy(start, min(count, available))
+            if data is not None:
+                buffer[:len(data)] = data
+                return len(data)
+
+    def close(self):
+        """枠を空けて共有メモリを閉じる"""
+
+        if self.memory is not None:
+            self.words[self.slot] = 0
+            self.words.release()
+            self.data.release()
+            self.memory.close()
+            self.memory = None
+        RawIOBase.close(self)
+
+
+class SharedMemoryTransportStreamFile(TransportStreamFile):
+
+    """共有メモリのリングバッファから読む TS
+
+    TransportStreamFile と同じように sections() などが使える。
+    パケットは chunk_size パケットずつまとめてコピーした bytes で、
+    copy が偽なら共有メモリの memoryview (次のまとまりを求めるまでしか
+    使えない) をそのまま返す"""
+
+    def __init__(self, name, slot=0, chunk_size=10000, poll_interval=0.001,
+                 copy=True):
+        self.ring = RingBufferReader(name, slot, poll_interval)
+        BufferedReader.__init__(self, self.ring)
+        self.chunk_size = chunk_size
+        self.copy = copy
+        self._callbacks = dict()
+
+    def chunks(self):
+        packet_size = PACKET_SIZE
+        for batch in self.ring.batches(self.chunk_size, self.copy):
+            if stats.enabled:
+                stats.count('packets', n=len(batch) // packet_size)
+            yield batch
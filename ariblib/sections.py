@@ -1,5 +1,6 @@
 """各種 PSI セクションの定義"""
 
+from ariblib import stats
 from ariblib.descriptors import (
     descriptors,
     ExtendedEventDescriptor,
@@ -30,6 +31,8 @@ class Section(Syntax):
     def __init__(self, packet, pos=0, parent=None):
         Syntax.__init__(self, packet, pos, parent)
         self.callbacks = dict()
+        if stats.enabled:
+            stats.count('sections_parsed', self.__class__.__name__)
 
     def __getattr__(self, name):
         result = Syntax.__getattr__(self, name)
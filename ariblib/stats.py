@@ -0,0 +1,155 @@
+"""処理状況の計測
+
+読み込んだパケット数やバイト数、組み立てたセクション数 (table_id ごと)、
+解析したセクション数、記述子の解析数 (タグごと)、文字列のデコード数を数え、
+読み込み・セクションの組み立て・文字列のデコードなどの段階ごとの時間を測る。
+
+既定では無効で、無効の間は各所で enabled を確かめるだけになる。
+enable() を呼ぶか、環境変数 ARIBLIB_STATS を 1 にすると有効になる。
+
+    from ariblib import stats
+    stats.enable()
+    ...
+    print(stats.snapshot())
+    print(stats.prometheus())
+"""
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import os
+from time import perf_counter
+
+enabled = os.environ.get('ARIBLIB_STATS', '') not in ('', '0')
+
+# 計測値の名前と、ラベルを付ける場合のラベル名
+LABELS = {
+    'packets': None,
+    'bytes': None,
+    'sections_assembled': 'table_id',
+    'sections_parsed': 'type',
+    'pes_assembled': 'stream_id',
+    'descriptors': 'tag',
+    'aribstr_lookups': None,
+    'aribstr_decodes': None,
+}
+
+counters = defaultdict(Counter)
+timers = defaultdict(float)
+calls = Counter()
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    counters.clear()
+    timers.clear()
+    calls.clear()
+
+
+def take():
+    """その時点の計測値を pickle できる形で返し、0 に戻す
+
+    プロセスプールで実行した処理の計測値を呼び出し側に渡すのに使う"""
+
+    values = ({name: dict(value) for name, value in counters.items()},
+              dict(timers), dict(calls))
+    reset()
+    return values
+
+
+def merge(values):
+    """take() で得た計測値を足し込む"""
+
+    taken_counters, taken_timers, taken_calls = values
+    for name, value in taken_counters.items():
+        counters[name].update(value)
+    for stage, seconds in taken_timers.items():
+        timers[stage] += seconds
+    calls.update(taken_calls)
+
+
+def count(name, label=None, n=1):
+    """name の計測値を n 増やす"""
+
+    counters[name][label] += n
+
+
+@contextmanager
+def timer(stage):
+    """with ブロックの実行時間を stage の時間として足し込む"""
+
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timers[stage] += perf_counter() - start
+        calls[stage] += 1
+
+
+def snapshot():
+    """その時点の計測値を辞書で返す"""
+
+    from ariblib.aribstr import cache_info
+
+    result = {'enabled': enabled, 'counters': {}, 'timers': {}}
+    for name, values in counters.items():
+        if LABELS.get(name) is None:
+            result['counters'][name] = sum(values.values())
+        else:
+            result['counters'][name] = {
+                _format_label(label): value for label, value in values.items()
+            }
+    for stage, seconds in timers.items():
+        result['timers'][stage] = {'seconds': seconds, 'calls': calls[stage]}
+    result['aribstr_cache'] = cache_info()._asdict()
+    return result
+
+
+def prometheus(prefix='ariblib'):
+    """計測値を Prometheus のテキスト形式で返す"""
+
+    lines = []
+    for name in sorted(counters):
+        metric = '{}_{}_total'.format(prefix, name)
+        lines.append('# TYPE {} counter'.format(metric))
+        label_name = LABELS.get(name)
+        for label, value in sorted(counters[name].items(),
+                                   key=lambda item: str(item[0])):
+            if label_name is None:
+                lines.append('{} {}'.format(metric, value))
+            else:
+                lines.append('{}{{{}="{}"}} {}'.format(
+                    metric, label_name, _format_label(label), value))
+    if timers:
+        for suffix, values in (('seconds', timers), ('calls', calls)):
+            metric = '{}_stage_{}_total'.format(prefix, suffix)
+            lines.append('# TYPE {} counter'.format(metric))
+            for stage in sorted(values):
+                lines.append('{}{{stage="{}"}} {}'.format(
+                    metric, stage, values[stage]))
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path, prefix='ariblib'):
+    """node_exporter の textfile collector 向けにファイルへ書き出す
+
+    読み込み途中のファイルを読まれないように、一時ファイルに書いてから置き換える"""
+
+    temp = path + '.tmp'
+    with open(temp, 'w') as f:
+        f.write(prometheus(prefix))
+    os.replace(temp, path)
+
+
+def _format_label(label):
+    if isinstance(label, int):
+        return '0x{:02X}'.format(label)
+    return str(label)
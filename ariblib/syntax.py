@@ -16,28 +16,52 @@ class SyntaxDict(dict):
     def __init__(self):
         self.mnemonics = []
         self.conditions = []
+        # 先頭から続く固定長のビット列表記の合計ビット数と、
+        # 最初の可変長のビット列表記の位置
+        self.fixed = 0
+        self.first_variable = None
 
     def __setitem__(self, key, value):
-        if isinstance(value, case_table):
-            self.conditions.append(value)
-
         if isinstance(value, mnemonic):
+            if isinstance(value, case_table):
+                self.conditions.append(value)
             value.name = key
             value.start = self.get_start()
+            if self.first_variable is None:
+                if is_fixed(value):
+                    self.fixed += value.length
+                else:
+                    self.first_variable = len(self.mnemonics)
             self.mnemonics.append(value)
 
         dict.__setitem__(self, key, value)
 
     def get_start(self):
-        mnemonics = self.mnemonics[:]
+        """開始位置を求める関数を返す
+
+        固定長の部分は宣言時に足し合わせておき、インスタンスごとには
+        可変長の部分の長さだけを求める"""
+
+        fixed = self.fixed
+        if self.first_variable is None:
+            return lambda instance: fixed + instance._pos
+
+        variables = self.mnemonics[self.first_variable:]
 
         def start(instance):
-            return sum(m.real_length(instance) for m in mnemonics) +\
-                instance._pos
+            return sum(m.real_length(instance) for m in variables) +\
+                fixed + instance._pos
 
         return start
 
 
+def is_fixed(value):
+    """長さがインスタンスによらないビット列表記かどうか"""
+
+    return (isinstance(value.length, int) and
+            type(value).real_length is mnemonic.real_length)
+
+
 class SyntaxType(type):
 
     """シンタックスのメタクラス
@@ -52,15 +76,42 @@ class SyntaxType(type):
 
     def __new__(cls, name, args, classdict):
         instance = type.__new__(cls, name, args, classdict)
-        instance._mnemonics = classdict.mnemonics
-        instance._conditions = classdict.conditions
+        if classdict.mnemonics or not hasattr(instance, '_mnemonics'):
+            instance._mnemonics = classdict.mnemonics
+            instance._conditions = classdict.conditions
+        # ビット列表記を宣言していない子クラスは親クラスのものを引き継ぐ
+        instance._mnemonic_names = frozenset(
+            mnemonic.name for mnemonic in instance._mnemonics)
         return instance
 
+    def resolution(cls):
+        """名前から、その名前を持ちうる if シンタックスのタプルを引く辞書
+
+        __getattr__ で全ての条件を評価しなくて済むように、クラスごとに
+        初めて必要になった時に作っておく。辞書にない名前はどの if シンタックス
+        からも見つからない"""
+
+        resolution = cls.__dict__.get('_resolution')
+        if resolution is None:
+            candidates = {}
+            for case in cls._conditions:
+                sub = case.cls
+                names = set(dir(sub)) | set(sub.resolution())
+                for name in names:
+                    candidates.setdefault(name, []).append(case)
+            resolution = {name: tuple(cases)
+                          for name, cases in candidates.items()}
+            cls._resolution = resolution
+        return resolution
+
 
 class Syntax(metaclass=SyntaxType):
 
     """シンタックスの親クラス"""
 
+    # 解析対象の記述子のタグの集合 (None は全て)。ループの子にも引き継がれる
+    _descriptor_tags = None
+
     def __init__(self, packet, pos=0, parent=None):
         self._packet = packet
         self._pos = pos
@@ -75,22 +126,28 @@ class Syntax(metaclass=SyntaxType):
 
     def __getattr__(self, name):
         """指定されたプロパティが直下から見つからない場合に、
-        条件に合うifシンタックスを順番に探していく"""
+        その名前を持ちうるifシンタックスのうち条件に合うものを順番に探していく
 
-        for mnemonic in self._conditions:
+        条件に合った最初のifシンタックスの値を (None であっても) 返す。
+        そのifシンタックス直下のビット列表記の値はインスタンスに保存し、
+        次からは直接参照させる"""
+
+        for mnemonic in type(self).resolution().get(name, ()):
             try:
-                if mnemonic.condition(self):
-                    sub = getattr(self, mnemonic.name)
-                    return getattr(sub, name)
+                if not mnemonic.condition(self):
+                    continue
+                result = getattr(getattr(self, mnemonic.name), name)
             except AttributeError:
-                pass
+                continue
+            # 入れ子のifシンタックスや親から求めた値は保存しない
+            if name in mnemonic.cls._mnemonic_names:
+                setattr(self, name, result)
+            return result
 
         # 親が与えられている場合は親のプロパティも参照する
-        if (
-            self._parent and
-            any(mnemonic.name == name for mnemonic in self._parent._mnemonics)
-        ):
-            return getattr(self._parent, name)
+        parent = self._parent
+        if parent is not None and name in parent._mnemonic_names:
+            return getattr(parent, name)
 
     def get_names(self):
         """このシンタックスインスタンスでアクセスできる
@@ -101,7 +158,7 @@ class Syntax(metaclass=SyntaxType):
             name = mnemonic.name
             if isinstance(mnemonic, case_table):
                 if mnemonic.condition(self):
-                    result.extend(mnemonic.cls(self).get_names())
+                    result.extend(getattr(self, name).get_names())
             else:
                 result.append(name)
         return result
@@ -111,7 +168,7 @@ class Syntax(metaclass=SyntaxType):
         from ariblib.sections import Section
         from ariblib.descriptors import Descriptor
         from types import GeneratorType
-        from collections import defaultdict
+        from collections.abc import Mapping
         print('{}{}'.format(' ' * indent, '-' * (80 - indent)))
         if isinstance(self, Section) or isinstance(self, Descriptor):
             print('{}<<{}>>'.format(' ' * indent, self.__class__.__name__))
@@ -119,7 +176,7 @@ class Syntax(metaclass=SyntaxType):
             value = getattr(self, name)
             if isinstance(value, Syntax):
                 value.dump(indent + 2)
-            elif isinstance(value, defaultdict):
+            elif isinstance(value, Mapping):
                 for value in value.values():
                     for child in value:
                         child.dump(indent + 2)
@@ -0,0 +1,173 @@
+"""ライブストリームの番組の切り替わりの検出
+
+PID 0x12 のパケットのうち、自ストリームの EIT[p/f] (table_id 0x4E) の
+セクションだけを組み立て、サービスと section_number (0 が現在、1 が次) ごとに
+event_id と version_number を覚えておく。どちらかが変わったセクションが
+揃った時点で ProgramChange を返す。
+
+ヘッダを見てそれ以外のセクション (EIT[schedule] など) は読み飛ばし、
+前と同じ event_id と version_number のセクションは CRC の確認も解析もしない。
+
+    watcher = ProgramWatcher()
+    with LiveTransportStreamFile(path) as ts:
+        for packet in ts:
+            for change in watcher.feed(packet):
+                print(change.service_id, change.event_id)
+"""
+
+from ariblib.encoder import crc32
+from ariblib.sections import ActualStreamPresentFollowingEventInformationSection
+
+EIT_PID = 0x12
+PRESENT_FOLLOWING_TABLE_ID = 0x4E
+
+# イベントの無い EIT[p/f] のセクションの長さ (ヘッダと CRC_32)
+EMPTY_SECTION_SIZE = 18
+
+
+class ProgramChange(object):
+
+    """番組の切り替わり
+
+    previous は前の (event_id, version_number)。そのサービスの
+    section_number で初めて受信した場合は None。
+    event_id は番組が無い (EIT[p/f] のイベントループが空の) 場合は None。
+    packets はそのセクションが揃ったパケットの番号 (feed() に与えた順、0 から)、
+    latency はセクションが始まったパケットから揃ったパケットまでのパケット数"""
+
+    def __init__(self, section, event_id, previous, packets, latency):
+        self.section = section
+        self.service_id = section.service_id
+        self.section_number = section.section_number
+        self.version_number = section.version_number
+        self.event_id = event_id
+        self.previous = previous
+        self.packets = packets
+        self.latency = latency
+
+    @property
+    def present(self):
+        """現在の番組 (section_number が 0) かどうか"""
+
+        return self.section_number == 0
+
+    @property
+    def event(self):
+        """切り替わった後のイベント (無ければ None)"""
+
+        return next(iter(self.section.events), None)
+
+
+class ProgramWatcher(object):
+
+    """パケットを一つずつ受け取って番組の切り替わりを返す
+
+    service_ids を与えるとそのサービスだけ、section_numbers を与えると
+    その section_number だけを対象にする (既定は現在と次の番組)"""
+
+    def __init__(self, service_ids=None, section_numbers=(0, 1)):
+        self.service_ids = None if service_ids is None else set(service_ids)
+        self.section_numbers = set(section_numbers)
+        # (service_id, section_number) から (event_id, version_number)
+        self.programs = {}
+        self.count = 0
+        self.buffer = bytearray()
+        self.start = None
+        self.counter = None
+
+    def feed(self, packet):
+        """パケットを一つ与え、ProgramChange のリストを返す"""
+
+        index = self.count
+        self.count = index + 1
+        if packet[2] != EIT_PID or packet[1] & 0x9F or \
+                not packet[3] & 0x10:
+            return []
+
+        counter = packet[3] & 0x0F
+        start = 4
+        if packet[3] & 0x20:
+            start += 1 + packet[4]
+        result = []
+        buffer = self.buffer
+        if self.start is not None:
+            if counter != (self.counter + 1) & 0x0F:
+                # パケットが抜けたので組み立て中のセクションを捨てる
+                self.start = None
+            elif packet[1] & 0x40:
+                buffer.extend(packet[start + 1:start + 1 + packet[start]])
+                if not self._complete(index, result):
+                    self.start = None
+            else:
+                buffer.extend(packet[start:])
+                self._complete(index, result)
+        self.counter = counter
+
+        if packet[1] & 0x40 and start < len(packet):
+            self._scan(packet, start + 1 + packet[start], index, result)
+        return result
+
+    def _scan(self, packet, position, index, result):
+        """セクションの開始を含むパケットから対象のセクションを探す"""
+
+        size = len(packet)
+        while position + 3 <= size and packet[position] != 0xFF:
+            length = ((packet[position + 1] & 0x0F) << 8 |
+                      packet[position + 2]) + 3
+            if packet[position] == PRESENT_FOLLOWING_TABLE_ID and \
+                    self._wanted(packet, position):
+                self.buffer[:] = packet[position:]
+                self.start = index
+                if not self._complete(index, result):
+                    return
+            position += length
+
+    def _wanted(self, packet, position):
+        """ヘッダがパケットに入っている範囲で対象かどうかを判定する"""
+
+        if position + 7 > len(packet):
+            return True
+        if self.service_ids is not None:
+            service_id = packet[position + 3] << 8 | packet[position + 4]
+            if service_id not in self.service_ids:
+                return False
+        return packet[position + 6] in self.section_numbers
+
+    def _complete(self, index, result):
+        """組み立て中のセクションが揃っていれば処理し、揃ったかどうかを返す"""
+
+        buffer = self.buffer
+        if len(buffer) < 3:
+            return False
+        end = ((buffer[1] & 0x0F) << 8 | buffer[2]) + 3
+        if len(buffer) < end:
+            return False
+        start = self.start
+        self.start = None
+        data = bytes(buffer[:end])
+        buffer.clear()
+        if end < EMPTY_SECTION_SIZE or not data[5] & 0x01:
+            return True
+        service_id = data[3] << 8 | data[4]
+        section_number = data[6]
+        if (self.service_ids is not None and
+                service_id not in self.service_ids) or \
+                section_number not in self.section_numbers:
+            return True
+        version_number = data[5] >> 1 & 0x1F
+        if end > EMPTY_SECTION_SIZE:
+            event_id = data[14] << 8 | data[15]
+        else:
+            event_id = None
+
+        key = (service_id, section_number)
+        previous = self.programs.get(key)
+        if previous == (event_id, version_number):
+            return True
+        if crc32(data):
+            return True
+        self.programs[key] = (event_id, version_number)
+        section = ActualStreamPresentFollowingEventInformationSection(data)
+        result.append(ProgramChange(section, event_id, previous, index,
+                                    index - start))
+        return True
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""モジュールの import にかかる時間を測る
+
+python -c 'import ariblib.sections' などを何度も別プロセスで起動し、
+何も import しない場合との差 (最小値どうしの差) をミリ秒で出力する。
+
+    $ python benchmarks/import_time.py
+    $ python benchmarks/import_time.py -n 50 ariblib.caption
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+DEFAULT_MODULES = ['ariblib.sections', 'ariblib', 'ariblib.packet',
+                   'ariblib.caption', 'ariblib.event']
+
+
+def measure(statements, repeat):
+    """各 statement を交互に repeat 回ずつ別プロセスで実行し、
+    かかった時間の最小値をミリ秒で返す"""
+
+    times = {statement: [] for statement in statements}
+    for _ in range(repeat):
+        for statement in statements:
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', statement], check=True)
+            times[statement].append(time.perf_counter() - start)
+    return {statement: min(values) * 1000
+            for statement, values in times.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='import 時間の計測')
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    parser.add_argument('-n', '--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    # 一度 import してバイトコードを作っておく
+    for module in args.modules:
+        subprocess.run([sys.executable, '-c', 'import ' + module], check=True)
+
+    statements = ['pass'] + ['import ' + module for module in args.modules]
+    times = measure(statements, args.repeat)
+    baseline = times['pass']
+    result = {
+        'python': sys.version.split()[0],
+        'repeat': args.repeat,
+        'baseline_ms': round(baseline, 2),
+        'modules': {
+            module: round(times['import ' + module] - baseline, 2)
+            for module in args.modules
+        },
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""ariblib の主な処理のベンチマーク
+
+synthetic.py で合成した TS (または --input で与えた TS) に対して、
+各処理を別プロセスで実行し、処理時間と処理速度、最大メモリ使用量を JSON で出力する。
+
+    $ python benchmarks/run.py --duration 60 --bitrate 4000000
+    $ python benchmarks/run.py --input some.ts --stages iter,sections
+
+計測する処理:
+    iter      TransportStreamFile.__iter__ でパケットを読むだけ
+    sections  ts.sections() で PAT/PMT/NIT/SDT/EIT/TOT を組み立てて解析する
+    events    ariblib.event.events() で番組情報を読む
+    aribstr   8単位符号の文字列のデコード (キャッシュなし)
+    captions  ariblib.caption.captions() で字幕を取り出す
+    split     split --all-services でサービスごとに必要なストリームを取り出す
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# 作業ツリーの ariblib を計測する
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import synthetic  # noqa: E402
+
+STAGES = ['iter', 'sections', 'events', 'aribstr', 'captions', 'split']
+
+
+def stage_iter(path):
+    from ariblib import tsopen
+    count = 0
+    with tsopen(path) as ts:
+        for _ in ts:
+            count += 1
+    return {'packets': count}
+
+
+def stage_sections(path):
+    from ariblib import tsopen
+    from ariblib.sections import (
+        ActualStreamServiceDescriptionSection,
+        EventInformationSection,
+        NetworkInformationSection,
+        ProgramAssociationSection,
+        TimeOffsetSection,
+    )
+    count = 0
+    with tsopen(path) as ts:
+        for section in ts.sections(
+                ProgramAssociationSection, NetworkInformationSection,
+                ActualStreamServiceDescriptionSection,
+                EventInformationSection, TimeOffsetSection):
+            # 各セクションの先頭のフィールドまでは必ず解析させる
+            section.table_id
+            count += 1
+    return {'packets': os.path.getsize(path) // 188, 'sections': count}
+
+
+def stage_events(path):
+    from ariblib import tsopen
+    from ariblib.event import events
+    from ariblib.sections import EventInformationSection
+    count = 0
+    with tsopen(path) as ts:
+        for event in events(ts, EventInformationSection):
+            str(event.title)
+            count += 1
+    return {'packets': os.path.getsize(path) // 188, 'events': count}
+
+
+def stage_aribstr(path, repeat=2000):
+    from ariblib.aribstr import decode
+    strings = synthetic.sample_strings()
+    for _ in range(repeat):
+        for data in strings:
+            decode(data)
+    return {'strings': len(strings) * repeat}
+
+
+def stage_captions(path):
+    from ariblib import tsopen
+    from ariblib.caption import captions
+    count = 0
+    with tsopen(path) as ts:
+        for caption in captions(ts):
+            str(caption.body)
+            count += 1
+    return {'packets': os.path.getsize(path) // 188, 'captions': count}
+
+
+def stage_split(path):
+    from ariblib.command.split import split
+    with tempfile.TemporaryDirectory() as tmp:
+        split(argparse.Namespace(inpath=path,
+                                 outpath=os.path.join(tmp, 'out.ts'),
+                                 all_services=True, services=None))
+    return {'packets': os.path.getsize(path) // 188}
+
+
+def run_stage(name, path):
+    """1つの処理を計測する (子プロセス側)"""
+
+    function = globals()['stage_' + name]
+    start = time.perf_counter()
+    counts = function(path)
+    seconds = time.perf_counter() - start
+    result = {'seconds': round(seconds, 4)}
+    for key, value in counts.items():
+        result[key] = value
+        result[key + '_per_second'] = round(value / seconds, 1)
+    # Linux では KiB 単位
+    result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ariblib のベンチマーク')
+    parser.add_argument('--input', help='計測に使う TS (省略時は合成する)')
+    parser.add_argument('--duration', type=float, default=60,
+                        help='合成する TS の長さ (秒)')
+    parser.add_argument('--bitrate', type=int, default=4000000,
+                        help='合成する TS のビットレート (bps)')
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help='計測する処理 (カンマ区切り)')
+    parser.add_argument('--stage', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        print(json.dumps(run_stage(args.stage, args.input)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.input
+        if path is None:
+            path = os.path.join(tmp, 'synthetic.ts')
+            synthetic.build(path, args.duration, bitrate=args.bitrate)
+        # DRCS の画像などを利用者のホームディレクトリに書き出さないようにする
+        env = dict(os.environ, HOME=tmp)
+        result = {
+            'python': sys.version.split()[0],
+            'input': {
+                'path': args.input or 'synthetic',
+                'bytes': os.path.getsize(path),
+                'packets': os.path.getsize(path) // 188,
+            },
+            'stages': {},
+        }
+        if args.input is None:
+            result['input'].update(duration=args.duration,
+                                   bitrate=args.bitrate)
+        for name in args.stages.split(','):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--stage', name,
+                 '--input', path],
+                env=env, check=True, stdout=subprocess.PIPE).stdout
+            result['stages'][name] = json.loads(output.decode())
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""ベンチマーク用の合成トランスポートストリームを作る
+
+実際の放送波の代わりに、規格に沿った PAT/PMT/NIT/SDT/EIT/TOT の送出と、
+字幕 PES (本文と DRCS) を含む TS を手元で作成する。
+映像・音声のパケットは中身のない埋め草で、指定したビットレートになるまで詰める。
+
+    $ python benchmarks/synthetic.py out.ts --duration 60 --bitrate 4000000
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import struct
+
+TRANSPORT_STREAM_ID = 0x7FE0
+ORIGINAL_NETWORK_ID = 0x7FE0
+NETWORK_PID = 0x10
+PCR_PID = 0x01FF
+CAPTION_COMPONENT_TAG = 0x87
+
+TITLES = ['ニュース７', '連続テレビ小説', 'クローズアップ現代＋', 'きょうの料理',
+          '天気予報', 'ドキュメント７２時間', '深夜アニメ「合成波」', '映画']
+TEXTS = ['全国と世界の最新ニュースをお伝えします。',
+         '今日のテーマは圧縮率とスループットです。第３回。',
+         '出演：山田太郎、鈴木花子　ほか']
+CAPTIONS = ['こんにちは。', '今日はいい天気ですね。', 'ＴＳのベンチマークです。',
+            '（拍手）', '字幕の試験放送を行っています。']
+
+
+def _crc32_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 24
+        for _ in range(8):
+            crc = (crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+_CRC32_TABLE = _crc32_table()
+
+
+def crc32(data):
+    """MPEG-2 の CRC32"""
+
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _CRC32_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+
+def crc16(data):
+    """字幕データグループの CRC16 (CCITT)"""
+
+    crc = 0
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = (crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1
+        crc &= 0xFFFF
+    return crc
+
+
+def arib_encode(text):
+    """8単位符号への簡易エンコード
+
+    初期状態 (G0 が漢字、G1 が英数) のまま、英数字は LS1 で、
+    それ以外は JIS X 0208 の漢字集合で符号化する"""
+
+    result = bytearray()
+    alnum = False
+    for char in text:
+        if char.isascii() and char.isalnum():
+            if not alnum:
+                result.append(0x0E)
+                alnum = True
+            result.append(ord(char))
+        else:
+            if alnum:
+                result.append(0x0F)
+                alnum = False
+            result.extend(byte & 0x7F for byte in char.encode('euc_jp'))
+    return bytes(result)
+
+
+def mjd_time(time):
+    """日時を MJD と BCD の40ビットにする"""
+
+    mjd = (time.date() - datetime(1858, 11, 17).date()).days
+    return struct.pack('>H', mjd) + bcd(time.hour, time.minute, time.second)
+
+
+def bcd(*values):
+    return bytes((value // 10) << 4 | value % 10 for value in values)
+
+
+def descriptor(tag, body):
+    return bytes([tag, len(body)]) + body
+
+
+def long_section(table_id, table_id_extension, body, version=0,
+                 section_number=0, last_section_number=0):
+    """section_syntax_indicator が 1 のセクションを CRC 付きで作る"""
+
+    length = 5 + len(body) + 4
+    data = struct.pack('>BHHBBB', table_id, 0xB000 | length,
+                       table_id_extension, 0xC1 | (version & 0x1F) << 1,
+                       section_number, last_section_number) + body
+    return data + struct.pack('>L', crc32(data))
+
+
+class Packetizer(object):
+
+    """PID ごとの巡回カウンタを管理しながら TS パケットを作る"""
+
+    def __init__(self):
+        self.counters = {}
+
+    def _counter(self, pid):
+        counter = self.counters.get(pid, 0)
+        self.counters[pid] = (counter + 1) & 0x0F
+        return counter
+
+    def _packets(self, pid, data, stuffing):
+        packets = []
+        start = True
+        while data:
+            chunk, data = data[:184], data[184:]
+            header = struct.pack('>BH', 0x47, (0x4000 if start else 0) | pid)
+            if len(chunk) < 184 and stuffing == 'adaptation':
+                size = 183 - len(chunk)
+                field = bytes([size]) + (
+                    b'\x00' + b'\xFF' * (size - 1) if size else b'')
+                packets.append(header + bytes([0x30 | self._counter(pid)]) +
+                               field + chunk)
+            else:
+                packets.append(header + bytes([0x10 | self._counter(pid)]) +
+                               chunk.ljust(184, b'\xFF'))
+            start = False
+        return packets
+
+    def section(self, pid, section):
+        """pointer_field を付けてセクションを送出する"""
+
+        return self._packets(pid, b'\x00' + section, 'padding')
+
+    def pes(self, pid, pes):
+        return self._packets(pid, pes, 'adaptation')
+
+    def pcr(self, pid, base):
+        field = struct.pack('>BBLH', 7, 0x10, (base >> 1) & 0xFFFFFFFF,
+                            (base & 1) << 15 | 0x7E00)
+        field = bytes([183]) + field[1:] + b'\xFF' * (183 - 7)
+        return struct.pack('>BHB', 0x47, pid, 0x20 | self._counter(pid)) + field
+
+    def filler(self, pid):
+        """映像・音声の代わりの中身のないパケット"""
+
+        return (struct.pack('>BHB', 0x47, pid, 0x10 | self._counter(pid)) +
+                b'\x00' * 184)
+
+
+class Service(object):
+
+    """合成するサービス (番組) ひとつぶん"""
+
+    def __init__(self, index, start, events):
+        self.service_id = 0x0400 + index * 8
+        self.pmt_pid = 0x01F0 + index * 8
+        self.video_pid = 0x0100 + index * 0x100
+        self.audio_pid = self.video_pid + 0x10
+        self.caption_pid = self.video_pid + 0x30
+        self.name = 'ベンチ{}'.format(index + 1)
+        self.events = [
+            (0x1000 + i, start + timedelta(minutes=30 * i), timedelta(minutes=30))
+            for i in range(events)
+        ]
+
+
+class Synthesizer(object):
+
+    """合成 TS を 100 ミリ秒ずつ作っていく
+
+    PAT/PMT と PCR は毎回、NIT/SDT/EIT[p/f] は1秒ごと、EIT[schedule] は
+    1秒ごとに1セクションずつ巡回し、TOT は tot_interval 秒ごと、
+    字幕は caption_interval 秒ごとに送出する"""
+
+    tick = timedelta(milliseconds=100)
+
+    def __init__(self, bitrate=4000000, services=2, events=48,
+                 start=datetime(2020, 1, 1, 19, 0, 0), tot_interval=5,
+                 caption_interval=2):
+        self.bitrate = bitrate
+        self.start = start
+        self.tot_interval = tot_interval
+        self.caption_interval = caption_interval
+        self.services = [Service(i, start, events) for i in range(services)]
+        self.packetizer = Packetizer()
+        self.schedule = [section for service in self.services
+                         for section in self._schedule_sections(service)]
+
+    def generate(self, duration):
+        """duration 秒ぶんのパケットを 100 ミリ秒ごとのリストで返すジェネレータ"""
+
+        per_tick = self.bitrate / 8 / 188 / 10
+        owed = 0.0
+        for tick in range(int(duration * 10)):
+            now = self.start + self.tick * tick
+            packets = self._tick(tick, now)
+            owed += per_tick - len(packets)
+            fillers = self._fillers(int(owed))
+            owed -= len(fillers)
+            yield packets + fillers
+
+    def write(self, out, duration):
+        count = 0
+        for packets in self.generate(duration):
+            out.write(b''.join(packets))
+            count += len(packets)
+        return count
+
+    def _tick(self, tick, now):
+        p = self.packetizer
+        base = 90000 * (100 + tick // 10) + 9000 * (tick % 10)
+        packets = [p.pcr(PCR_PID, base)]
+        packets += p.section(0x00, self._pat())
+        for service in self.services:
+            packets += p.section(service.pmt_pid, self._pmt(service))
+        if tick % 10 == 0:
+            second = tick // 10
+            packets += p.section(NETWORK_PID, self._nit())
+            packets += p.section(0x11, self._sdt())
+            for service in self.services:
+                for section in self._pf_sections(service, now):
+                    packets += p.section(0x12, section)
+            if self.schedule:
+                packets += p.section(
+                    0x12, self.schedule[second % len(self.schedule)])
+            if second % self.tot_interval == 0:
+                packets += p.section(0x14, self._tot(now))
+            if second % self.caption_interval == 0:
+                for service in self.services:
+                    packets += p.pes(service.caption_pid,
+                                     self._caption(second, base + 45000))
+        return packets
+
+    def _fillers(self, count):
+        pids = [pid for service in self.services
+                for pid in (service.video_pid, service.video_pid,
+                            service.video_pid, service.audio_pid)]
+        return [self.packetizer.filler(pids[i % len(pids)])
+                for i in range(count)]
+
+    def _pat(self):
+        body = struct.pack('>HH', 0, 0xE000 | NETWORK_PID)
+        for service in self.services:
+            body += struct.pack('>HH', service.service_id,
+                                0xE000 | service.pmt_pid)
+        return long_section(0x00, TRANSPORT_STREAM_ID, body)
+
+    def _pmt(self, service):
+        caption = descriptor(0x52, bytes([CAPTION_COMPONENT_TAG]))
+        streams = (
+            struct.pack('>BHH', 0x02, 0xE000 | service.video_pid, 0xF000) +
+            struct.pack('>BHH', 0x0F, 0xE000 | service.audio_pid, 0xF000) +
+            struct.pack('>BHH', 0x06, 0xE000 | service.caption_pid,
+                        0xF000 | len(caption)) + caption
+        )
+        body = struct.pack('>HH', 0xE000 | PCR_PID, 0xF000) + streams
+        return long_section(0x02, service.service_id, body)
+
+    def _nit(self):
+        name = descriptor(0x40, arib_encode('合成ネットワーク'))
+        services = descriptor(0x41, b''.join(
+            struct.pack('>HB', service.service_id, 0x01)
+            for service in self.services))
+        transport = struct.pack('>HHH', TRANSPORT_STREAM_ID,
+                                ORIGINAL_NETWORK_ID,
+                                0xF000 | len(services)) + services
+        body = (struct.pack('>H', 0xF000 | len(name)) + name +
+                struct.pack('>H', 0xF000 | len(transport)) + transport)
+        return long_section(0x40, ORIGINAL_NETWORK_ID, body)
+
+    def _sdt(self):
+        body = struct.pack('>HB', ORIGINAL_NETWORK_ID, 0xFF)
+        for service in self.services:
+            provider = arib_encode('合成')
+            name = arib_encode(service.name)
+            desc = descriptor(0x48, bytes([0x01, len(provider)]) + provider +
+                              bytes([len(name)]) + name)
+            body += struct.pack('>HBH', service.service_id, 0xFF,
+                                0x8000 | len(desc)) + desc
+        return long_section(0x42, TRANSPORT_STREAM_ID, body)
+
+    def _tot(self, now):
+        offset = descriptor(0x58, b'JPN' + bytes([0x02]) + bcd(0, 0) +
+                            mjd_time(now) + bcd(0, 0))
+        data = mjd_time(now) + struct.pack('>H', 0xF000 | len(offset)) + offset
+        data = struct.pack('>BH', 0x73, 0x7000 | len(data) + 4) + data
+        return data + struct.pack('>L', crc32(data))
+
+    def _event(self, service, event_id, start, duration, index):
+        title = arib_encode(TITLES[index % len(TITLES)]) + b'\x7A\x56'
+        text = arib_encode(TEXTS[index % len(TEXTS)])
+        short = descriptor(0x4D, b'jpn' + bytes([len(title)]) + title +
+                           bytes([len(text)]) + text)
+        component = descriptor(0x50, bytes([0xF1, 0xB3, 0x00]) + b'jpn' +
+                               arib_encode('HD'))
+        content = descriptor(0x54, bytes([0x70 + index % 3, 0xFF]))
+        item_name = arib_encode('出演者')
+        item = arib_encode(TEXTS[2])
+        items = bytes([len(item_name)]) + item_name + bytes([len(item)]) + item
+        extended = descriptor(0x4E, bytes([0x00]) + b'jpn' +
+                              bytes([len(items)]) + items + b'\x00')
+        descriptors = short + component + content + extended
+        minutes = duration.seconds // 60
+        return (struct.pack('>H', event_id) + mjd_time(start) +
+                bcd(minutes // 60, minutes % 60, 0) +
+                struct.pack('>H', 0x8000 | len(descriptors)) + descriptors)
+
+    def _eit(self, table_id, service, section_number, last_section_number,
+             segment_last_section_number, events):
+        body = struct.pack('>HHBB', TRANSPORT_STREAM_ID, ORIGINAL_NETWORK_ID,
+                           segment_last_section_number, table_id)
+        body += b''.join(self._event(service, *event) for event in events)
+        return long_section(table_id, service.service_id, body,
+                            section_number=section_number,
+                            last_section_number=last_section_number)
+
+    def _pf_sections(self, service, now):
+        current = [i for i, (_, start, duration) in enumerate(service.events)
+                   if start <= now < start + duration]
+        index = current[0] if current else len(service.events)
+        sections = []
+        for number in (0, 1):
+            events = [event + (index + number,)
+                      for event in service.events[index + number:][:1]]
+            sections.append(self._eit(0x4E, service, number, 1, 1, events))
+        return sections
+
+    def _schedule_sections(self, service):
+        """EIT[schedule] を3時間ごとのセグメントに分け、4イベントずつ
+        セクションにする (テーブル 0x50 の4日分まで)"""
+
+        midnight = datetime.combine(self.start.date(), datetime.min.time())
+        segments = {}
+        for i, event in enumerate(service.events):
+            segment = int((event[1] - midnight).total_seconds() // 10800)
+            if segment < 32:
+                segments.setdefault(segment, []).append(event + (i,))
+        chunks = []
+        for segment, events in sorted(segments.items()):
+            numbers = [segment * 8 + k for k in range(min(
+                8, (len(events) + 3) // 4))]
+            for k, number in enumerate(numbers):
+                chunks.append((number, numbers[-1], events[k * 4:k * 4 + 4]))
+        last = chunks[-1][0] if chunks else 0
+        return [self._eit(0x50, service, number, last, segment_last, events)
+                for number, segment_last, events in chunks]
+
+    def _caption(self, second, pts):
+        # 字幕の本文は漢字集合を GR に呼び出した状態で送られるものとする
+        text = CAPTIONS[second % len(CAPTIONS)].encode('euc_jp')
+        units = b''
+        if second % (self.caption_interval * 5) == 0:
+            # DRCS を送った直後の字幕ではその外字 (DRCS-1 の 0x21) を使う
+            units += self._data_unit(0x30, self._drcs(second))
+            text += b'\x21'
+        units += self._data_unit(0x20, text)
+        statement = bytes([0x00]) + struct.pack('>L', len(units))[1:] + units
+        group = (bytes([0x01 << 2, 0x00, 0x00]) +
+                 struct.pack('>H', len(statement)) + statement)
+        group += struct.pack('>H', crc16(group))
+        data = bytes([0x80, 0xFF, 0xF0]) + group
+        header = (bytes([0x21 | (pts >> 29) & 0x0E]) +
+                  struct.pack('>HH', (pts >> 14) & 0xFFFE | 1,
+                              (pts << 1) & 0xFFFE | 1))
+        body = bytes([0x84, 0x80, len(header)]) + header + data
+        return b'\x00\x00\x01\xBD' + struct.pack('>H', len(body)) + body
+
+    @staticmethod
+    def _data_unit(parameter, data):
+        return bytes([0x1F, parameter]) + struct.pack('>L', len(data))[1:] + data
+
+    @staticmethod
+    def _drcs(second):
+        """16x16 の2階調と 24x24 の4階調のフォントを1つずつ持つ DRCS"""
+
+        seed = second & 0xFF
+        mono = bytes((seed + i * 37) & 0xFF for i in range(16 * 16 // 8))
+        gray = bytes((seed * 7 + i * 11) & 0xFF for i in range(24 * 24 * 2 // 8))
+        fonts = (bytes([0x00, 0, 16, 16]) + mono +
+                 bytes([0x10, 2, 24, 24]) + gray)
+        return bytes([1]) + struct.pack('>HB', 0x4121, 2) + fonts
+
+
+def sample_strings():
+    """EIT や字幕に使う8単位符号の文字列"""
+
+    return [arib_encode(text) + b'\x7A\x56' for text in TITLES] + [
+        arib_encode(text) for text in TEXTS + CAPTIONS]
+
+
+def build(path, duration=60, **options):
+    """合成 TS をファイルに書き出して、パケット数を返す"""
+
+    with open(path, 'wb') as out:
+        return Synthesizer(**options).write(out, duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='合成 TS の作成')
+    parser.add_argument('outpath')
+    parser.add_argument('--duration', type=float, default=60,
+                        help='長さ (秒)')
+    parser.add_argument('--bitrate', type=int, default=4000000,
+                        help='ビットレート (bps)')
+    parser.add_argument('--services', type=int, default=2)
+    parser.add_argument('--events', type=int, default=48,
+                        help='サービスごとのイベント数')
+    args = parser.parse_args()
+    count = build(args.outpath, args.duration, bitrate=args.bitrate,
+                  services=args.services, events=args.events)
+    print(count)
+
+
+if __name__ == '__main__':
+    main()
@@ -17,7 +17,7 @@ setup(name='ariblib',
       ],
       license='MIT',
       description='python implementation of arib-std-b10 and arib-std-b24',
-      packages=find_packages(),
+      packages=find_packages(exclude=['tests']),
       package_data={'ariblib': ['drcs.tsv']},
 )
 
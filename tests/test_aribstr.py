@@ -0,0 +1,188 @@
+import unittest
+
+from ariblib import aribstr
+from ariblib.aribstr import (AribString, cache_info, cached_decode,
+                             clear_cache, decode, set_cache_size)
+from ariblib.mnemonics import aribstr as aribstr_mnemonic, uimsbf
+from ariblib.syntax import Syntax
+
+# (8単位符号, 本文) 。本文は以前の一文字ずつ iso-2022-jp に変換する
+# デコーダの結果と同じ
+DECODED = [
+    # G0 漢字
+    ('3441 3B7A', '漢字'),
+    # GR の G2 平仮名と、平仮名集合の 0x77 以降の記号
+    ('A2A4 F7FC FD', 'あいゝ」、'),
+    # LS1 で英数、LS0 で漢字に戻す
+    ('0E414231 0F 3441', 'AB1漢'),
+    # SS2, SS3 は次の一文字だけ
+    ('1922 1D22 3441', 'あア漢'),
+    # ESC ( J で G0 に英数を指示する
+    ('1B284A 7879', 'xy'),
+    # ESC $ ) B で G1 に漢字を指示して LS1
+    ('1B242942 0E 3441', '漢'),
+    # LS1R, LS2R
+    ('1B7E C1C2', 'AB'),
+    ('1B7E C1 1B7D A2', 'Aあ'),
+    # LS2, LS3
+    ('1B6E 22 1B6F 22', 'あア'),
+    # 空白、改行と、それ以外の制御符号
+    ('3441 20 A0 09 3B7A 0D0A 89 8A 07 0C 2422', '漢   字\n\nあ'),
+    # マクロ、DRCS、モザイクの集合の文字は出力しない
+    ('1B2820 70 2122 1B2842 3441', '漢'),
+    ('1B2920 41 0E 21 0F 3441', '漢'),
+    ('1B2A32 A1 1B2A30 A2', 'あ'),
+]
+
+# 追加記号集合: [HV], [字], 記号表にない符号
+GAIJI = bytes.fromhex('1B243B 7A50 7A56 3441')
+
+
+def hex_bytes(text):
+    return bytes.fromhex(text)
+
+
+class DecodeTest(unittest.TestCase):
+
+    def test_decode(self):
+        for data, text in DECODED:
+            with self.subTest(data=data):
+                data = hex_bytes(data)
+                self.assertEqual(decode(data), (text, ''))
+                self.assertEqual(decode(data, with_gaiji=False), (text, ''))
+                self.assertEqual(decode(data, split_symbol=True), (text, ''))
+
+    def test_gaiji(self):
+        self.assertEqual(decode(GAIJI), ('[HV][字]??', ''))
+        self.assertEqual(decode(GAIJI, with_gaiji=False), ('', ''))
+
+    def test_split_symbol(self):
+        self.assertEqual(decode(GAIJI, split_symbol=True), ('??', '[HV][字]'))
+
+    def test_jis_x0201_katakana(self):
+        # 以前のデコーダは iso-2022-jp で変換できず 'UnicodeDecodeError' を返した
+        data = hex_bytes('1B2B49 1B6F 3132 0F 2422')
+        self.assertEqual(decode(data), ('ｱｲあ', ''))
+
+    def test_kanji_gaiji(self):
+        # 漢字集合の 90 区以降は追加記号として扱う
+        self.assertEqual(decode(hex_bytes('7A50 3441')), ('[HV]漢', ''))
+
+    def test_truncated(self):
+        self.assertEqual(decode(hex_bytes('3441 34')), ('漢', ''))
+        self.assertEqual(decode(hex_bytes('3441 1B')), ('漢', ''))
+
+    def test_invalid_escape_sequence(self):
+        with self.assertRaises(aribstr.EscapeSequenceError):
+            decode(hex_bytes('1B40'))
+        with self.assertRaises(aribstr.DegignationError):
+            decode(hex_bytes('1B2821'))
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        set_cache_size(aribstr.CACHE_SIZE)
+
+    def tearDown(self):
+        set_cache_size(aribstr.CACHE_SIZE)
+
+    def test_cached_decode(self):
+        data = hex_bytes('3441 3B7A')
+        self.assertEqual(cached_decode(data), decode(data))
+        self.assertEqual(cached_decode(bytearray(data)), decode(data))
+        self.assertEqual(cached_decode(memoryview(data)), decode(data))
+        info = cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (2, 1, 1))
+
+    def test_flags_are_part_of_the_key(self):
+        self.assertEqual(cached_decode(GAIJI), ('[HV][字]??', ''))
+        self.assertEqual(cached_decode(GAIJI, False), ('', ''))
+        self.assertEqual(cached_decode(GAIJI, split_symbol=True),
+                         ('??', '[HV][字]'))
+        self.assertEqual(cache_info().misses, 3)
+
+    def test_set_cache_size(self):
+        cached_decode(b'\x34\x41')
+        set_cache_size(2)
+        self.assertEqual(cache_info().currsize, 0)
+        self.assertEqual(cache_info().maxsize, 2)
+        for data in (b'\x34\x41', b'\x3B\x7A', b'\x24\x22', b'\x34\x41'):
+            cached_decode(data)
+        info = cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (0, 4, 2))
+
+    def test_clear_cache(self):
+        cached_decode(b'\x34\x41')
+        cached_decode(b'\x34\x41')
+        clear_cache()
+        info = cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (0, 0, 0))
+
+
+class AribStringTest(unittest.TestCase):
+
+    def test_str(self):
+        string = AribString(hex_bytes('3441 3B7A 20 20'))
+        self.assertEqual(str(string), '漢字')
+        self.assertEqual(string.convert_utf(), '漢字  ')
+        self.assertEqual(str(AribString()), '')
+        self.assertFalse(AribString())
+        self.assertTrue(string)
+
+    def test_convert_utf_split(self):
+        string = AribString(GAIJI)
+        self.assertEqual(string.convert_utf_split(), ('??', '[HV][字]'))
+        self.assertEqual(string.convert_utf(with_gaiji=False), '')
+        self.assertEqual(str(string), '[HV][字]??')
+
+    def test_add(self):
+        first = AribString(hex_bytes('0E41'))
+        second = AribString(hex_bytes('4243'))
+        joined = first + second
+        # 連結してからデコードするので、LS1 は後ろの文字列にも効く
+        self.assertEqual(str(joined), 'ABC')
+        self.assertEqual(joined.arib_array, hex_bytes('0E414243'))
+        # 連結元は変わらない
+        self.assertEqual(str(first), 'A')
+        self.assertEqual(str(second), '唾')
+        self.assertIsNot(joined, first)
+
+    def test_join(self):
+        joined = AribString.join([hex_bytes('3441'), bytearray(b'\x3B'),
+                                  AribString(hex_bytes('7A 0E41'))])
+        self.assertEqual(str(joined), '漢字A')
+        self.assertEqual(str(AribString.join([])), '')
+
+    def test_split_multibyte_character(self):
+        # 番組詳細のように2バイト文字の途中で分かれていても正しく連結する
+        joined = AribString.join([b'\x34', b'\x41\x3B', b'\x7A'])
+        self.assertEqual(str(joined), '漢字')
+
+    def test_value(self):
+        first = AribString(hex_bytes('3441'))
+        second = AribString.join([b'\x34', b'\x41'])
+        self.assertEqual(first, second)
+        self.assertEqual(hash(first), hash(second))
+        self.assertEqual(len({first, second}), 1)
+        self.assertNotEqual(first, AribString(hex_bytes('3B7A')))
+        self.assertEqual(AribString(first), first)
+
+
+class Name(Syntax):
+    name_length = uimsbf(8)
+    name = aribstr_mnemonic(name_length)
+
+
+class AribStrMnemonicTest(unittest.TestCase):
+
+    def test_aribstr(self):
+        data = bytes([len(GAIJI)]) + GAIJI
+        name = Name(data).name
+        self.assertIsInstance(name, AribString)
+        self.assertEqual(str(name), '[HV][字]??')
+        self.assertEqual(name.convert_utf_split(), ('??', '[HV][字]'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta
+import unittest
+from unittest import mock
+
+from ariblib.caption import CaptionStream, CProfileString
+from ariblib.encoder import encode
+from ariblib.sections import TimeOffsetSection
+
+from tests.tsutil import (Stream, caption_pes, caption_program, drcs_unit,
+                          text_unit)
+
+PCR_PID = 0x0111
+CAPTION_PID = 0x0130
+
+START = datetime(2020, 1, 1, 19)
+PCR_BASE = 90000 * 10
+
+
+def ticks(seconds):
+    """PCR_BASE から seconds 秒後の 90kHz の値"""
+
+    return PCR_BASE + int(seconds * 90000)
+
+
+class CaptionStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = Stream()
+        caption_program(self.stream, pcr_pid=PCR_PID,
+                        caption_pid=CAPTION_PID)
+        # DRCS の対応はクラスで共有しているので元に戻す
+        patcher = mock.patch.dict(CProfileString.drcs)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def caption(self, seconds, text):
+        self.stream.pes(CAPTION_PID,
+                        caption_pes(ticks(seconds), [text_unit(text)]))
+
+    def pcr(self, seconds):
+        self.stream.pcr(PCR_PID, ticks(seconds))
+
+    def tot(self, seconds):
+        self.stream.section(0x14, encode(
+            TimeOffsetSection, JST_time=START + timedelta(seconds=seconds)))
+
+    def feed(self, caption_stream):
+        """パケットごとに返した Caption の (日本時間, 字幕文) のリスト"""
+
+        return [[(caption.datetime, str(caption.body)) for caption in
+                 caption_stream.feed(packet)]
+                for packet in self.stream.packets]
+
+    def test_caption_pid(self):
+        caption_stream = CaptionStream()
+        self.feed(caption_stream)
+        self.assertEqual(caption_stream.caption_pid, CAPTION_PID)
+        self.assertEqual(caption_stream.pcr_pid, PCR_PID)
+        # PAT と PMT はそれ以上組み立てない
+        self.assertEqual(list(caption_stream.parser.table_map), [0x14])
+
+    def test_pending(self):
+        # PCR より前と、TOT より前の字幕は時刻が決まるまで待つ
+        self.caption(0.5, b'\xa4\xa2')
+        self.pcr(0)
+        self.caption(1, b'\xa4\xa4')
+        self.tot(0)
+        self.pcr(1)
+        self.caption(2, b'\xa4\xa6')
+        caption_stream = CaptionStream()
+        result = self.feed(caption_stream)
+        self.assertEqual(len(caption_stream.pending), 0)
+        # TOT は秒未満を切り捨てているので、直前の PCR を 0.5 秒後とみなす
+        self.assertEqual([item for item in result if item], [
+            [(START + timedelta(seconds=1), 'あ'),
+             (START + timedelta(seconds=1.5), 'い')],
+            [(START + timedelta(seconds=2.5), 'う')],
+        ])
+        # TOT を受け取ったパケットで、待っていた字幕を返す
+        tot_index = len(self.stream.packets) - 3
+        self.assertEqual(len(result[tot_index]), 2)
+
+    def test_max_pending(self):
+        for index in range(5):
+            self.caption(index, bytes([0xa4, 0xa2 + index * 2]))
+        self.pcr(0)
+        self.tot(0)
+        caption_stream = CaptionStream(max_pending=3)
+        result = [item for items in self.feed(caption_stream)
+                  for item in items]
+        self.assertEqual([text for _, text in result], ['う', 'え', 'お'])
+
+    def test_base_time(self):
+        # base_time を与えた場合は最初の PCR をその時刻とする
+        self.caption(0.5, b'\xa4\xa2')
+        self.pcr(0)
+        self.caption(1, b'\xa4\xa4')
+        caption_stream = CaptionStream(base_time=START)
+        result = [item for items in self.feed(caption_stream)
+                  for item in items]
+        self.assertEqual(result, [(START + timedelta(seconds=0.5), 'あ'),
+                                  (START + timedelta(seconds=1), 'い')])
+
+    def test_drcs(self):
+        pattern = bytes([0b10010110])
+        self.pcr(0)
+        self.stream.pes(CAPTION_PID, caption_pes(ticks(1), [
+            drcs_unit([(0x4121, 0, 4, 2, pattern)]),
+            text_unit(b'\xa4\xa2\x21'),
+        ]))
+        with mock.patch('ariblib.caption.store') as store, \
+                mock.patch('ariblib.caption.get_mapping', return_value={}):
+            store.add.return_value = 'hash'
+            caption_stream = CaptionStream(base_time=START)
+            result = [item for items in self.feed(caption_stream)
+                      for item in items]
+        store.add.assert_called_once_with(4, 2, pattern, 0)
+        self.assertEqual(result, [(START + timedelta(seconds=1),
+                                   'あ{{drcs:0x21:hash}}')])
+
+    def test_without_drcs(self):
+        self.pcr(0)
+        self.stream.pes(CAPTION_PID, caption_pes(ticks(1), [
+            drcs_unit([(0x4121, 0, 4, 2, b'\x00')])]))
+        with mock.patch('ariblib.caption.store') as store:
+            self.feed(CaptionStream(base_time=START, drcs=False))
+        store.add.assert_not_called()
+
+    def test_captions(self):
+        self.pcr(0)
+        self.caption(1, b'\xa4\xa2')
+        self.caption(2, b'\xa4\xa4')
+        result = CaptionStream(base_time=START).captions(self.stream.packets)
+        self.assertEqual([(caption.pts, str(caption.body))
+                          for caption in result],
+                         [(timedelta(seconds=11), 'あ'),
+                          (timedelta(seconds=12), 'い')])
+
+
+if __name__ == '__main__':
+    unittest.main()
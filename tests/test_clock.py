@@ -0,0 +1,197 @@
+from datetime import datetime, timedelta
+import unittest
+
+from ariblib.clock import CLOCK_FREQUENCY, PCR_WRAP, Clock, ticks
+
+JST = datetime(2020, 1, 1, 19)
+
+
+def pcr(seconds):
+    """秒で表した PCR (33ビットで一周させる) を timedelta にする"""
+
+    value = round(seconds * CLOCK_FREQUENCY) % PCR_WRAP
+    return timedelta(seconds=value / CLOCK_FREQUENCY)
+
+
+def seconds(value):
+    return timedelta(seconds=value)
+
+
+class ClockTest(unittest.TestCase):
+
+    def feed(self, clock, start, end, offset=0, step=0.1, tot=True):
+        """PCR が start 秒から end 秒まで進む間、毎秒 TOT を与える
+
+        TOT の時刻は JST + (PCR の秒 - offset) の秒未満を切り捨てたもの"""
+
+        count = round((end - start) / step)
+        for index in range(count + 1):
+            value = start + index * step
+            clock.add_pcr(pcr(value))
+            if tot and abs(value - round(value)) < step / 2:
+                clock.add_time(JST + seconds(round(value) - offset))
+        return clock.position
+
+    def test_ticks(self):
+        self.assertEqual(ticks(timedelta(seconds=1)), CLOCK_FREQUENCY)
+        self.assertEqual(ticks(pcr(12.5)), 1125000)
+
+    def test_wraparound(self):
+        clock = Clock()
+        top = PCR_WRAP / CLOCK_FREQUENCY
+        self.assertEqual(clock.add_pcr(pcr(top - 1)), 0)
+        self.assertEqual(clock.add_pcr(pcr(top - 0.5)), 45000)
+        # 一周して小さくなっても位置は続く
+        self.assertEqual(clock.add_pcr(pcr(top + 0.5)), 135000)
+        self.assertEqual(len(clock.starts), 1)
+        # 一周の前後の PTS
+        self.assertEqual(clock.locate(pcr(top + 0.75)), 157500)
+        self.assertEqual(clock.locate(pcr(top - 0.25)), 67500)
+
+    def test_locate(self):
+        clock = Clock()
+        self.assertIsNone(clock.locate(pcr(1)))
+        clock.add_pcr(pcr(100))
+        clock.add_pcr(pcr(101))
+        self.assertEqual(clock.locate(pcr(101)), 90000)
+        self.assertEqual(clock.locate(pcr(102.5)), 225000)
+        # PCR より前の PTS
+        self.assertEqual(clock.locate(pcr(99)), -90000)
+
+    def test_discontinuity(self):
+        clock = Clock(max_gap=10)
+        clock.add_pcr(pcr(100))
+        clock.add_pcr(pcr(105))
+        self.assertEqual(clock.position, 5 * CLOCK_FREQUENCY)
+        # max_gap を超えて進んだ
+        clock.add_pcr(pcr(200))
+        self.assertEqual(clock.position, 15 * CLOCK_FREQUENCY)
+        self.assertEqual(list(clock.starts),
+                         [0, 10 * CLOCK_FREQUENCY])
+        clock.add_pcr(pcr(201))
+        self.assertEqual(clock.position, 16 * CLOCK_FREQUENCY)
+        # 戻った
+        clock.add_pcr(pcr(50))
+        self.assertEqual(clock.position, 26 * CLOCK_FREQUENCY)
+        self.assertEqual(list(clock.starts),
+                         [0, 10 * CLOCK_FREQUENCY, 21 * CLOCK_FREQUENCY])
+        self.assertEqual(list(clock.first_knots), [0, 0, 0])
+
+    def test_not_anchored(self):
+        clock = Clock()
+        self.assertFalse(clock.anchored)
+        self.assertIsNone(clock.datetime(0))
+        clock.add_time(JST)
+        self.assertFalse(clock.anchored)
+        clock.add_pcr(pcr(0))
+        self.assertIsNone(clock.datetime(0))
+        self.assertIsNone(clock.datetime(None))
+        clock.add_time(JST, precision=0)
+        self.assertTrue(clock.anchored)
+        self.assertEqual(clock.datetime(90000), JST + seconds(1))
+
+    def test_truncated_tot(self):
+        # TOT は秒未満を切り捨てているので、PCR の 0.3 秒後に
+        # 秒が変わる場合は窓の中の組から 0.3 秒のずれを求める
+        clock = Clock(window=30)
+        for index in range(300):
+            value = index / 10
+            clock.add_pcr(pcr(value))
+            clock.add_time(JST + seconds(int(value + 0.7)))
+        self.assertAlmostEqual(
+            (clock.datetime(0) - JST).total_seconds(), 0.7, delta=0.1)
+
+    def test_knots(self):
+        # 300 秒ごとの窓から節点を作る。300 秒の時点で日本時間が 5 秒進む
+        clock = Clock(window=300)
+        for index in range(1200):
+            value = index * 0.5
+            clock.add_pcr(pcr(value))
+            jst = value if value < 300 else value + 5
+            clock.add_time(JST + seconds(jst), precision=0)
+        self.assertEqual(list(clock.positions), [ticks(seconds(149.75))])
+        self.assertEqual(clock._knot(clock._window)[0],
+                         ticks(seconds(449.75)))
+
+        def at(value):
+            return (clock.datetime(ticks(seconds(value))) -
+                    JST).total_seconds()
+
+        # 節点の上
+        self.assertAlmostEqual(at(149.75), 149.75)
+        # 最初の節点より前はその値
+        self.assertAlmostEqual(at(0), 0)
+        # 節点と組み立て中の窓の間は線形に補間する
+        self.assertAlmostEqual(at(299.75), 299.75 + 2.5)
+        self.assertAlmostEqual(at(224.75), 224.75 + 1.25)
+        self.assertAlmostEqual(at(449.75), 449.75 + 5)
+        # 最後の節点より後はその値
+        self.assertAlmostEqual(at(1000), 1005)
+
+        # 窓を閉じても同じ
+        clock.add_pcr(pcr(900))
+        self.assertEqual(len(clock.positions), 2)
+        self.assertAlmostEqual(at(299.75), 299.75 + 2.5)
+
+    def test_segments(self):
+        # 不連続の前後で TOT が別の時刻を示す
+        clock = Clock(window=10, max_gap=10)
+        self.feed(clock, 0, 30)
+        self.feed(clock, 1000, 1030, offset=1000 - 3600)
+        start = clock.starts[1]
+        before = clock.position
+        self.assertGreater(start, 30 * CLOCK_FREQUENCY)
+        self.assertLess(start, 40 * CLOCK_FREQUENCY)
+
+        def at(position):
+            return (clock.datetime(position) - JST).total_seconds()
+
+        self.assertAlmostEqual(at(0), 0, delta=1)
+        self.assertAlmostEqual(at(30 * CLOCK_FREQUENCY), 30, delta=1)
+        self.assertAlmostEqual(at(before), 3630, delta=1)
+        self.assertAlmostEqual(at(before - 30 * CLOCK_FREQUENCY), 3600,
+                               delta=1)
+
+    def test_pts_near_discontinuity(self):
+        # 不連続の直前に受信した PTS は PCR より先にあっても前の区間の時刻
+        clock = Clock(window=10, max_gap=10)
+        self.feed(clock, 0, 30)
+        late = clock.locate(pcr(31))
+        self.feed(clock, 1000, 1030, offset=1000 - 3600)
+        self.assertAlmostEqual(
+            (clock.datetime(late) - JST).total_seconds(), 31, delta=1)
+        # 不連続の直後に受信した、PCR より前の PTS は新しい区間の時刻
+        clock = Clock(window=10, max_gap=10)
+        self.feed(clock, 0, 30)
+        clock.add_pcr(pcr(1000))
+        early = clock.locate(pcr(999.5))
+        self.feed(clock, 1000, 1030, offset=1000 - 3600)
+        self.assertAlmostEqual(
+            (clock.datetime(early) - JST).total_seconds(), 3599.5, delta=1)
+
+    def test_segment_without_tot(self):
+        # TOT の無い区間は不連続の前後で日本時間が続く
+        clock = Clock(window=10, max_gap=10)
+        self.feed(clock, 0, 30)
+        end = clock.position
+        self.feed(clock, 1000, 1030, tot=False)
+        self.assertEqual(len(clock.starts), 2)
+        after = clock.position
+        self.assertAlmostEqual(
+            (clock.datetime(after) - clock.datetime(end)).total_seconds(),
+            30, delta=0.01)
+
+    def test_segment_before_tot(self):
+        # 最初の区間に TOT が無ければ次の区間の値から戻して使う
+        clock = Clock(window=10, max_gap=10)
+        self.feed(clock, 0, 30, tot=False)
+        end = clock.position
+        self.feed(clock, 1000, 1030, offset=1000 - 30)
+        self.assertAlmostEqual(
+            (clock.datetime(0) - JST).total_seconds(), 0, delta=1)
+        self.assertAlmostEqual(
+            (clock.datetime(end) - JST).total_seconds(), 30, delta=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,322 @@
+from datetime import datetime, timedelta
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from ariblib.command.cut import (Recording, TransitionNotFound, copy_range,
+                                 find_event, locate)
+from ariblib.encoder import build, encode
+from ariblib.sections import (
+    ActualStreamPresentFollowingEventInformationSection,
+    ProgramAssociationSection,
+    ProgramMapSection,
+    TimeOffsetSection,
+)
+
+from tests.tsutil import Stream
+
+SERVICE_ID = 0x0400
+PMT_PID = 0x01F0
+VIDEO_PID = 0x0111
+AUDIO_PID = 0x0112
+
+START = datetime(2020, 1, 1, 19)
+PCR_BASE = 90000 * 100
+
+# EIT 上の event_id と (開始, 長さ) (秒)
+EVENTS = {
+    0x0100: (0, 60),
+    0x0101: (60, 60),
+    0x0102: (120, 60),
+    0x0103: (180, 60),
+    0x0104: (240, 60),
+}
+
+# 1秒ごとの映像のパケット数 (PCR とランダムアクセス点を持つパケットを除く)
+FILLER = 8
+
+SECONDS = 200
+
+
+def event_values(event_id):
+    start, duration = EVENTS[event_id]
+    return {
+        'event_id': event_id,
+        'start_time': START + timedelta(seconds=start),
+        'duration': timedelta(seconds=duration),
+        'running_status': 4,
+    }
+
+
+def event(event_id):
+    """EIT の値どおりのイベント"""
+
+    section = build(ActualStreamPresentFollowingEventInformationSection,
+                    service_id=SERVICE_ID, events=[event_values(event_id)])
+    return section.events[0]
+
+
+def eit_pf(section_number, event_id):
+    events = [] if event_id is None else [event_values(event_id)]
+    return encode(ActualStreamPresentFollowingEventInformationSection,
+                  service_id=SERVICE_ID, section_number=section_number,
+                  last_section_number=1, transport_stream_id=0x7FE0,
+                  original_network_id=4, last_table_id=0x4E, events=events)
+
+
+def on_schedule(second):
+    """EIT の時刻どおりの (現在, 次) の event_id"""
+
+    for event_id in sorted(EVENTS):
+        start, duration = EVENTS[event_id]
+        if start <= second < start + duration:
+            return event_id, event_id + 1
+    return None, None
+
+
+def recording(schedule, pcr=True):
+    """schedule(秒) が (現在, 次) の event_id を返す録画を作る
+
+    秒ごとの PCR (ランダムアクセス点) のパケットの位置も返す。
+    pcr が偽なら PCR の代わりに映像のパケットを置く"""
+
+    stream = Stream()
+    positions = []
+    pat = encode(ProgramAssociationSection, transport_stream_id=0x7FE0,
+                 pids=[{'program_number': SERVICE_ID,
+                        'program_map_PID': PMT_PID}])
+    pmt = encode(ProgramMapSection, program_number=SERVICE_ID,
+                 PCR_PID=VIDEO_PID, maps=[
+                     {'stream_type': 0x02, 'elementary_PID': VIDEO_PID},
+                     {'stream_type': 0x0F, 'elementary_PID': AUDIO_PID}])
+    for second in range(SECONDS):
+        if second % 10 == 0:
+            stream.section(0x00, pat)
+            stream.section(PMT_PID, pmt)
+        positions.append(stream.position)
+        if pcr:
+            stream.pcr(VIDEO_PID, PCR_BASE + second * 90000,
+                       random_access=True)
+        else:
+            stream.es(VIDEO_PID, 0xFF)
+        stream.section(0x14, encode(
+            TimeOffsetSection, JST_time=START + timedelta(seconds=second)))
+        present, following = schedule(second)
+        stream.section(0x12, eit_pf(0, present))
+        stream.section(0x12, eit_pf(1, following))
+        for index in range(FILLER):
+            stream.es(VIDEO_PID, index)
+            stream.es(AUDIO_PID, index)
+    return stream, positions
+
+
+class CutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'in.ts')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def open(self, schedule):
+        stream, self.positions = recording(schedule)
+        stream.write(self.path)
+        result = Recording(self.path)
+        self.addCleanup(result.close)
+        return result
+
+    def locate(self, schedule, event_id):
+        return locate(self.open(schedule), event(event_id))
+
+    def test_on_schedule(self):
+        self.assertEqual(self.locate(on_schedule, 0x0101),
+                         (self.positions[60], self.positions[120]))
+
+    def test_delayed(self):
+        # 前の番組が 10 秒延長し、0x0101 も 10 秒遅れて終わる
+        def schedule(second):
+            if 60 <= second < 70:
+                return 0x0100, 0x0101
+            if 70 <= second < 130:
+                return 0x0101, 0x0102
+            return on_schedule(second)
+        start, end = self.locate(schedule, 0x0101)
+        # 終了は切り替わったセクションの後のランダムアクセス点
+        self.assertEqual((start, end),
+                         (self.positions[70], self.positions[131]))
+
+    def test_extended(self):
+        def schedule(second):
+            if 120 <= second < 130:
+                return 0x0101, 0x0102
+            return on_schedule(second)
+        self.assertEqual(self.locate(schedule, 0x0101),
+                         (self.positions[60], self.positions[131]))
+
+    def test_already_ended(self):
+        # EIT の開始時刻には既に終わって次の番組になっている
+        def schedule(second):
+            if 40 <= second < 55:
+                return 0x0101, 0x0102
+            if 55 <= second < 180:
+                return 0x0102, 0x0103
+            return on_schedule(second)
+        self.assertEqual(self.locate(schedule, 0x0101),
+                         (self.positions[40], self.positions[56]))
+
+    def test_gap(self):
+        # 前の番組が早く終わり、番組の無い時間をはさんで始まる
+        def schedule(second):
+            if 55 <= second < 65:
+                return None, 0x0101
+            return on_schedule(second)
+        self.assertEqual(self.locate(schedule, 0x0101),
+                         (self.positions[65], self.positions[121]))
+
+    def test_gap_after_target(self):
+        # 対象の番組が早く終わった後の空きは対象に含めない
+        def schedule(second):
+            if 40 <= second < 50:
+                return 0x0101, 0x0102
+            if 50 <= second < 60:
+                return None, 0x0102
+            if 60 <= second < 180:
+                return 0x0102, 0x0103
+            return on_schedule(second)
+        self.assertEqual(self.locate(schedule, 0x0101),
+                         (self.positions[40], self.positions[51]))
+
+    def test_cancelled(self):
+        # 0x0101 が放送されずに 0x0102 が次の番組になる
+        def schedule(second):
+            if second < 70:
+                return 0x0100, 0x0102
+            if second < 180:
+                return 0x0102, 0x0103
+            return on_schedule(second)
+        with self.assertRaises(TransitionNotFound):
+            self.locate(schedule, 0x0101)
+
+    def test_not_in_recording(self):
+        with self.assertRaises(TransitionNotFound):
+            self.locate(on_schedule, 0x0104)
+
+    def test_until_end_of_recording(self):
+        def schedule(second):
+            if second >= 180:
+                return 0x0102, 0x0103
+            return on_schedule(second)
+        start, end = self.locate(schedule, 0x0102)
+        self.assertEqual(start, self.positions[120])
+        self.assertEqual(end, os.path.getsize(self.path))
+
+    def test_seek_transition(self):
+        recording = self.open(on_schedule)
+        position = recording.seek_transition(
+            0, recording.size,
+            lambda present, following: present.event_id >= 0x0102)
+        self.assertTrue(self.positions[120] < position < self.positions[121])
+        self.assertEqual(recording.present(position)[0].event_id, 0x0102)
+        with self.assertRaises(TransitionNotFound):
+            recording.seek_transition(
+                0, recording.size,
+                lambda present, following: present is None)
+
+    def test_find_event(self):
+        recording = self.open(on_schedule)
+        self.assertEqual(find_event(recording).event_id, 0x0101)
+        self.assertEqual(find_event(recording, 0x0100).event_id, 0x0100)
+        self.assertEqual(find_event(recording, 0x0103).event_id, 0x0103)
+        self.assertIsNone(find_event(recording, 0x0200))
+
+
+class CopyRangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.inpath = os.path.join(self.tmp, 'in.ts')
+        self.outpath = os.path.join(self.tmp, 'out.ts')
+        self.data = bytes(range(256)) * 1000
+        with open(self.inpath, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def read(self):
+        with open(self.outpath, 'rb') as f:
+            return f.read()
+
+    def test_copy_range(self):
+        copy_range(self.inpath, self.outpath, 188 * 10, 188 * 500)
+        self.assertEqual(self.read(), self.data[188 * 10:188 * 500])
+
+    def test_past_end(self):
+        copy_range(self.inpath, self.outpath, 1000, len(self.data) + 1000)
+        self.assertEqual(self.read(), self.data[1000:])
+
+    def test_small_copy_size(self):
+        with mock.patch('ariblib.command.cut.COPY_SIZE', 1000):
+            copy_range(self.inpath, self.outpath, 10, 12345)
+        self.assertEqual(self.read(), self.data[10:12345])
+
+    def test_without_sendfile(self):
+        with mock.patch('os.sendfile', side_effect=OSError):
+            copy_range(self.inpath, self.outpath, 188, 188 * 300)
+        self.assertEqual(self.read(), self.data[188:188 * 300])
+
+
+class CutCommandTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.inpath = os.path.join(self.tmp, 'in.ts')
+        self.outpath = os.path.join(self.tmp, 'out.ts')
+
+    def run_cut(self, *args):
+        """python -m ariblib cut を実行し、(終了コード, 標準エラー出力) を返す"""
+
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run(
+            [sys.executable, '-m', 'ariblib', 'cut', self.inpath,
+             self.outpath] + list(args),
+            cwd=root, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, timeout=60)
+        return result.returncode, result.stderr
+
+    def test_cut(self):
+        stream, positions = recording(on_schedule)
+        stream.write(self.inpath)
+        returncode, stderr = self.run_cut('--event-id', '0x0101')
+        self.assertEqual(returncode, 0, stderr)
+        self.assertEqual(os.path.getsize(self.outpath),
+                         positions[120] - positions[60])
+
+    def test_no_pcr(self):
+        stream, _ = recording(on_schedule, pcr=False)
+        stream.write(self.inpath)
+        self.assertEqual(self.run_cut('--by-eit'),
+                         (1, 'PCR is not found\n'))
+        self.assertFalse(os.path.exists(self.outpath))
+
+    def test_unknown_service(self):
+        stream, _ = recording(on_schedule)
+        stream.write(self.inpath)
+        self.assertEqual(self.run_cut('--by-eit', '--service-id', '0x0408'),
+                         (1, 'service_id 1032 is not found\n'))
+
+    def test_event_not_found(self):
+        stream, _ = recording(on_schedule)
+        stream.write(self.inpath)
+        self.assertEqual(self.run_cut('--event-id', '0x0200'),
+                         (1, 'event is not found\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
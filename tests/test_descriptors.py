@@ -0,0 +1,117 @@
+import unittest
+
+from ariblib.descriptors import (ComponentDescriptor, ContentDescriptor,
+                                 Descriptor, DescriptorIndex,
+                                 ShortEventDescriptor, descriptor_tags)
+from ariblib.encoder import SectionPacketizer, encode
+from ariblib.packet import SectionParser
+from ariblib.sections import EventInformationSection
+
+# タグの無い (クラスの定義されていない) 記述子
+UNKNOWN = bytes([0x80, 2, 0x12, 0x34])
+
+
+def short_event(title):
+    return (ShortEventDescriptor, {
+        'ISO_639_language_code': 'jpn', 'event_name_char': title,
+        'text_char': b''})
+
+
+def content(level_1):
+    return (ContentDescriptor, {'nibbles': [{
+        'content_nibble_level_1': level_1, 'content_nibble_level_2': 0,
+        'user_nibble': 0xFF}]})
+
+
+def eit():
+    """短形式イベント記述子が2つあるイベントの EIT"""
+
+    return encode(EventInformationSection, service_id=0x0400, events=[{
+        'event_id': 0x0100,
+        'descriptors': [short_event(b'\x0E\x41'), content(0x7), UNKNOWN,
+                        short_event(b'\x0E\x42')],
+    }])
+
+
+class DescriptorIndexTest(unittest.TestCase):
+
+    def index(self, section=None):
+        if section is None:
+            section = EventInformationSection(eit())
+        index = section.events[0].descriptors
+        self.assertIsInstance(index, DescriptorIndex)
+        return index
+
+    def test_lazy(self):
+        index = self.index()
+        # 索引を作るだけで、どの記述子も解析していない
+        self.assertEqual(index._parsed, {})
+        self.assertEqual(list(index),
+                         [ShortEventDescriptor, ContentDescriptor,
+                          Descriptor])
+        self.assertEqual(index._parsed, {})
+
+        genre, = index[ContentDescriptor]
+        self.assertEqual(list(index._parsed), [ContentDescriptor])
+        self.assertEqual(genre.nibbles[0].content_nibble_level_1, 0x7)
+        # 記述子はパケットを複製せず、その記述子の位置から解析する
+        self.assertIs(genre._packet, index._packet)
+        start = genre._pos // 8
+        self.assertEqual(bytes(index._packet[start:start + 4]),
+                         bytes([0x54, 2, 0x70, 0xFF]))
+        self.assertIs(index[ContentDescriptor][0], genre)
+
+    def test_repeated(self):
+        index = self.index()
+        first, second = index[ShortEventDescriptor]
+        self.assertEqual((str(first.event_name_char),
+                          str(second.event_name_char)), ('A', 'B'))
+        self.assertLess(first._pos, second._pos)
+        self.assertEqual(len(index), 3)
+
+    def test_missing(self):
+        index = self.index()
+        self.assertNotIn(ComponentDescriptor, index)
+        self.assertEqual(index[ComponentDescriptor], [])
+        self.assertIsNone(index.get(ComponentDescriptor))
+        self.assertEqual(index.get(ComponentDescriptor, ()), ())
+        # 参照しても含まれるクラスは増えない
+        self.assertEqual(len(index), 3)
+
+    def test_unknown(self):
+        index = self.index()
+        unknown, = index[Descriptor]
+        self.assertEqual(unknown.descriptor_tag, 0x80)
+        self.assertEqual(unknown.descriptor_length, 2)
+
+    def test_raw(self):
+        index = self.index()
+        raw = index.raw()
+        self.assertEqual(len(raw), 4)
+        self.assertEqual(raw[2], UNKNOWN)
+        self.assertEqual(raw[1], bytes([0x54, 2, 0x70, 0xFF]))
+        self.assertEqual([data[0] for data in raw], [0x4D, 0x54, 0x80, 0x4D])
+        self.assertEqual(b''.join(raw),
+                         bytes(eit()[26:26 + sum(map(len, raw))]))
+
+    def test_descriptor_tags(self):
+        self.assertIsNone(descriptor_tags(None))
+        self.assertEqual(descriptor_tags([ShortEventDescriptor, 0x54]),
+                         frozenset([0x4D, 0x54]))
+
+    def test_whitelist(self):
+        # 解析対象のタグ以外は索引に含めない (ループの子にも引き継ぐ)
+        parser = SectionParser(EventInformationSection,
+                               descriptors=[ShortEventDescriptor])
+        section, = [section for packet in
+                    SectionPacketizer(0x12).packetize(eit())
+                    for section in parser.feed(packet)]
+        index = self.index(section)
+        self.assertEqual(list(index), [ShortEventDescriptor])
+        self.assertEqual(len(index[ShortEventDescriptor]), 2)
+        self.assertEqual(index[ContentDescriptor], [])
+        self.assertEqual([data[0] for data in index.raw()], [0x4D, 0x4D])
+
+
+if __name__ == '__main__':
+    unittest.main()
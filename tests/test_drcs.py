@@ -0,0 +1,108 @@
+from contextlib import redirect_stderr
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from ariblib import drcs
+from ariblib.drcs import DRCSGlyph, DRCSStore, unpack
+
+# 4x2 画素の2階調のパターン
+PATTERN = bytes([0b10010110])
+
+
+class UnpackTest(unittest.TestCase):
+
+    def test_depth0(self):
+        self.assertEqual(unpack(PATTERN, 4, 2),
+                         bytes([1, 0, 0, 1, 0, 1, 1, 0]))
+
+    def test_depth2(self):
+        # 4階調は1画素2ビットで、バイト境界をまたがない
+        self.assertEqual(unpack(bytes([0b00011011, 0b11100100]), 4, 2, 2),
+                         bytes([0, 1, 2, 3, 3, 2, 1, 0]))
+
+    def test_depth3(self):
+        # 5階調は1画素3ビットで、画素がバイト境界をまたぐ
+        data = int('000001010011100' '0', 2).to_bytes(2, 'big')
+        self.assertEqual(unpack(data, 5, 1, 3), bytes([0, 1, 2, 3, 4]))
+
+    def test_short_data(self):
+        # 足りない分は背景とする
+        self.assertEqual(unpack(b'\xFF', 4, 3), b'\x01' * 8 + b'\x00' * 4)
+
+    def test_glyph(self):
+        glyph = DRCSGlyph(4, 2, PATTERN)
+        self.assertEqual(glyph.levels, 2)
+        self.assertEqual(list(glyph.rows()),
+                         [bytes([1, 0, 0, 1]), bytes([0, 1, 1, 0])])
+
+
+class DRCSStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        # PIL の有無によらずテキストで保存する
+        patcher = mock.patch.object(drcs, '_renderer', drcs.DRCSText)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def save_dir(self, path):
+        patcher = mock.patch.object(drcs, 'save_dir', path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_save(self):
+        self.save_dir(os.path.join(self.tempdir, 'drcs'))
+        store = DRCSStore()
+        hash = store.add(4, 2, PATTERN)
+        self.assertEqual(store.add(4, 2, PATTERN), hash)
+        store.flush()
+        path = os.path.join(self.tempdir, 'drcs', hash + '.txt')
+        with open(path) as f:
+            self.assertEqual(f.read(), '■　　■\n　■■　')
+        self.assertEqual(store.queue.unfinished_tasks, 0)
+
+        # 保存済みのものは作らない
+        store = DRCSStore()
+        self.assertEqual(store.add(4, 2, PATTERN), hash)
+        self.assertIsNone(store.thread)
+
+    def test_save_error(self):
+        # 保存先を作れなくてもスレッドは止まらず、flush は戻る
+        blocker = os.path.join(self.tempdir, 'file')
+        open(blocker, 'w').close()
+        self.save_dir(os.path.join(blocker, 'drcs'))
+        store = DRCSStore()
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            first = store.add(4, 2, PATTERN)
+            second = store.add(4, 2, bytes([0b01101001]))
+            store.flush()
+        self.assertTrue(store.thread.is_alive())
+        self.assertEqual(store.queue.unfinished_tasks, 0)
+        lines = stderr.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn(first, lines[0])
+        self.assertIn(second, lines[1])
+
+        # 保存先が使えるようになれば続けて保存する
+        self.save_dir(self.tempdir)
+        third = store.add(4, 2, bytes([0b11110000]))
+        store.flush()
+        self.assertTrue(
+            os.path.exists(os.path.join(self.tempdir, third + '.txt')))
+
+    def test_flush_dead_thread(self):
+        # スレッドが止まっていれば待たない
+        store = DRCSStore()
+        store.thread = mock.Mock(is_alive=lambda: False)
+        store.queue.put((4, 2, PATTERN, 0))
+        store.flush()
+
+
+if __name__ == '__main__':
+    unittest.main()
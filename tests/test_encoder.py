@@ -0,0 +1,229 @@
+from datetime import datetime, timedelta
+import unittest
+
+from ariblib.descriptors import ServiceDescriptor, ShortEventDescriptor
+from ariblib.encoder import (SectionPacketizer, build, crc32, encode,
+                             raw_bytes)
+from ariblib.packet import SectionParser
+from ariblib.sections import (ActualStreamServiceDescriptionSection,
+                              EventInformationSection,
+                              ProgramAssociationSection)
+
+PAT_VALUES = {
+    'transport_stream_id': 0x7FE0,
+    'version_number': 1,
+    'pids': [{'program_number': 0, 'program_map_PID': 0x10},
+             {'program_number': 0x0400, 'program_map_PID': 0x01F0}],
+}
+
+
+class CRC32Test(unittest.TestCase):
+
+    def test_check_value(self):
+        # CRC-32/MPEG-2 の検査値
+        self.assertEqual(crc32(b'123456789'), 0x0376E6E7)
+        self.assertEqual(crc32(b''), 0xFFFFFFFF)
+
+    def test_section(self):
+        data = encode(ProgramAssociationSection, PAT_VALUES)
+        self.assertEqual(crc32(data), 0)
+        self.assertEqual(int.from_bytes(data[-4:], 'big'), crc32(data[:-4]))
+
+
+class EncodeTest(unittest.TestCase):
+
+    def test_pat(self):
+        data = encode(ProgramAssociationSection, PAT_VALUES)
+        self.assertEqual(data[:-4].hex(),
+                         '00b0117fe0c30000' '0000e010' '0400e1f0')
+        pat = ProgramAssociationSection(data)
+        self.assertEqual(pat.section_length, len(data) - 3)
+        self.assertEqual(pat.transport_stream_id, 0x7FE0)
+        self.assertEqual(pat.version_number, 1)
+        self.assertEqual(list(pat.pmt_items), [(0x0400, 0x01F0)])
+        self.assertEqual(pat.CRC_32, crc32(data[:-4]))
+
+    def test_keyword_arguments(self):
+        self.assertEqual(encode(ProgramAssociationSection, PAT_VALUES),
+                         encode(ProgramAssociationSection, **PAT_VALUES))
+
+    def test_build(self):
+        pat = build(ProgramAssociationSection, PAT_VALUES)
+        self.assertIsInstance(pat, ProgramAssociationSection)
+        self.assertEqual(raw_bytes(pat),
+                         encode(ProgramAssociationSection, PAT_VALUES))
+
+    def test_reencode_parsed(self):
+        data = encode(ProgramAssociationSection, PAT_VALUES)
+        pat = ProgramAssociationSection(data + b'\xFF' * 10)
+        self.assertEqual(raw_bytes(pat), data)
+        values = dict(PAT_VALUES, pids=list(pat.pids))
+        self.assertEqual(encode(ProgramAssociationSection, values), data)
+
+    def test_descriptors(self):
+        data = encode(ActualStreamServiceDescriptionSection, {
+            'transport_stream_id': 0x7FE0,
+            'original_network_id': 0x7FE0,
+            'services': [{
+                'service_id': 0x0400,
+                'EIT_present_following_flag': 1,
+                'running_status': 4,
+                'descriptors': [(ServiceDescriptor, {
+                    'service_type': 0x01,
+                    'service_provider_name': b'\x0E\x41\x42',
+                    'service_name': b'\x34\x41',
+                })],
+            }],
+        })
+        sdt = ActualStreamServiceDescriptionSection(data)
+        self.assertEqual(sdt.table_id, 0x42)
+        self.assertEqual(crc32(data), 0)
+        service = sdt.services[0]
+        self.assertEqual(service.service_id, 0x0400)
+        self.assertEqual(service.EIT_present_following_flag, 1)
+        self.assertEqual(service.running_status, 4)
+        descriptor = service.descriptors[ServiceDescriptor][0]
+        self.assertEqual(descriptor.descriptor_length, 8)
+        self.assertEqual(str(descriptor.service_provider_name), 'AB')
+        self.assertEqual(str(descriptor.service_name), '漢')
+
+    def test_time(self):
+        start_time = datetime(2020, 1, 1, 19, 30, 15)
+        data = encode(EventInformationSection, {
+            'service_id': 0x0400,
+            'events': [{
+                'event_id': 0x1234,
+                'start_time': start_time,
+                'duration': timedelta(hours=1, minutes=5),
+                'descriptors': [{
+                    'descriptor_tag': 0x4D,
+                    'ISO_639_language_code': 'jpn',
+                    'event_name_char': b'\x34\x41',
+                    'text_char': b'',
+                }],
+            }, {
+                'event_id': 0x1235,
+                'start_time': None,
+                'duration': None,
+            }],
+        })
+        eit = EventInformationSection(data)
+        self.assertEqual(eit.table_id, 0x4E)
+        first, second = eit.events
+        self.assertEqual(first.start_time, start_time)
+        self.assertEqual(first.duration, timedelta(hours=1, minutes=5))
+        self.assertEqual(
+            str(first.descriptors[ShortEventDescriptor][0].event_name_char),
+            '漢')
+        self.assertEqual(second.event_id, 0x1235)
+        self.assertIsNone(second.start_time)
+        self.assertIsNone(second.duration)
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            encode(ProgramAssociationSection, transport_stream_id=1 << 16)
+        with self.assertRaises(TypeError):
+            encode(ServiceDescriptor, service_name=5)
+
+
+def sections(packets, Section=ProgramAssociationSection):
+    parser = SectionParser()
+    parser.add(Section, [packets[0][1] << 8 & 0x1F00 | packets[0][2]])
+    result = []
+    for packet in packets:
+        result.extend(parser.feed(packet))
+    return [raw_bytes(section) for section in result]
+
+
+def section_of_size(size, number=0):
+    """section_length + 3 が size バイトになる、中身が number で埋まったセクション"""
+
+    length = size - 3
+    return (bytes([0x00, 0xB0 | length >> 8, length & 0xFF]) +
+            bytes([number]) * length)
+
+
+class SectionPacketizerTest(unittest.TestCase):
+
+    def test_single_packet(self):
+        data = encode(ProgramAssociationSection, PAT_VALUES)
+        packets = SectionPacketizer(0x00).packetize(data)
+        self.assertEqual(len(packets), 1)
+        packet = packets[0]
+        self.assertEqual(len(packet), 188)
+        self.assertEqual(packet[:5], b'\x47\x40\x00\x10\x00')
+        self.assertEqual(packet[5:5 + len(data)], data)
+        self.assertEqual(set(packet[5 + len(data):]), {0xFF})
+        self.assertEqual(sections(packets), [data])
+
+    def test_several_packets(self):
+        data = section_of_size(500)
+        packets = SectionPacketizer(0x1FF, continuity_counter=14).packetize(
+            data)
+        self.assertEqual(len(packets), 3)
+        self.assertEqual([packet[1] & 0x40 for packet in packets],
+                         [0x40, 0, 0])
+        self.assertEqual([packet[1] << 8 & 0x1F00 | packet[2]
+                          for packet in packets], [0x1FF] * 3)
+        self.assertEqual([packet[3] for packet in packets],
+                         [0x1E, 0x1F, 0x10])
+        self.assertEqual(packets[0][4], 0)
+        self.assertEqual(packets[0][5:] + packets[1][4:] +
+                         packets[2][4:4 + 500 - 183 - 184], data)
+        self.assertEqual(sections(packets), [data])
+
+    def test_counter_continues(self):
+        packetizer = SectionPacketizer(0x00)
+        data = encode(ProgramAssociationSection, PAT_VALUES)
+        counters = [packetizer.packetize(data)[0][3] & 0x0F
+                    for _ in range(17)]
+        self.assertEqual(counters, list(range(16)) + [0])
+
+    def test_sections_share_packets(self):
+        first = section_of_size(300, 1)
+        second = section_of_size(40, 2)
+        third = section_of_size(20, 3)
+        packets = SectionPacketizer(0x00).packetize(first, second, third)
+        self.assertEqual(len(packets), 2)
+        # 2 つ目のパケットは 1 つ目のセクションの残りの後に続きが始まる
+        self.assertEqual(packets[1][1] & 0x40, 0x40)
+        self.assertEqual(packets[1][4], 300 - 183)
+        self.assertEqual(sections(packets), [first, second, third])
+
+    def test_section_fills_packet(self):
+        # pointer_field の分で 183 バイトのセクションがちょうど収まる
+        first = section_of_size(183, 1)
+        second = section_of_size(20, 2)
+        packets = SectionPacketizer(0x00).packetize(first, second)
+        self.assertEqual(len(packets), 2)
+        self.assertEqual(packets[1][1] & 0x40, 0x40)
+        self.assertEqual(packets[1][4], 0)
+        self.assertEqual(sections(packets), [first, second])
+
+    def test_section_starts_in_last_byte(self):
+        # 次のセクションがパケットの最後のバイトから始まる
+        first = section_of_size(182, 1)
+        second = section_of_size(20, 2)
+        packets = SectionPacketizer(0x00).packetize(first, second)
+        self.assertEqual(len(packets), 2)
+        self.assertEqual(packets[0][-1], 0x00)
+        self.assertEqual(packets[1][1] & 0x40, 0)
+        self.assertEqual(sections(packets), [first, second])
+
+    def test_section_one_byte_over(self):
+        first = section_of_size(184, 1)
+        second = section_of_size(20, 2)
+        packets = SectionPacketizer(0x00).packetize(first, second)
+        self.assertEqual(len(packets), 2)
+        self.assertEqual(packets[1][1] & 0x40, 0x40)
+        self.assertEqual(packets[1][4], 1)
+        self.assertEqual(sections(packets), [first, second])
+
+    def test_round_trip_many(self):
+        datas = [section_of_size(12 + 4 * n, n) for n in range(0, 60, 7)]
+        packets = SectionPacketizer(0x00).packetize(*datas)
+        self.assertEqual(sections(packets), datas)
+
+
+if __name__ == '__main__':
+    unittest.main()
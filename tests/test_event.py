@@ -0,0 +1,230 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+import os
+import shutil
+import tempfile
+import unittest
+
+from ariblib import stats, tsopen
+from ariblib.descriptors import (ContentDescriptor, ExtendedEventDescriptor,
+                                 ShortEventDescriptor)
+from ariblib.encoder import encode
+from ariblib.event import Event, LazyEvent, events
+from ariblib.sections import ActualStreamEventInformationSection
+
+from tests.tsutil import Stream
+
+START = datetime(2020, 1, 1, 19)
+
+# セクション数とセクションごとのイベント数
+SECTIONS = 20
+EVENTS = 2
+
+
+def eit(number):
+    """number 番目のセクション。番組名はイベントごとに違う
+
+    偶数の event_id のイベントにはコンテント記述子と拡張形式イベント記述子も
+    付ける"""
+
+    events = []
+    for index in range(EVENTS):
+        event_id = number * EVENTS + index
+        title = bytes([0x0E, 0x41 + event_id % 26, 0x41 + event_id // 26])
+        descriptors = [(ShortEventDescriptor, {
+            'ISO_639_language_code': 'jpn',
+            'event_name_char': title,
+            'text_char': b'\x0E\x41',
+        })]
+        if event_id % 2 == 0:
+            descriptors.append((ContentDescriptor, {'nibbles': [{
+                'content_nibble_level_1': 0x7,
+                'content_nibble_level_2': 0x0,
+                'user_nibble': 0xFF,
+            }]}))
+            descriptors.append((ExtendedEventDescriptor, {
+                'ISO_639_language_code': 'jpn',
+                # items の長さは lambda で宣言しているので与える
+                'length_of_items': 10,
+                'items': [
+                    {'item_description_char': b'\x0E\x41',
+                     'item_char': b'\x0E\x42'},
+                    {'item_description_char': b'',
+                     'item_char': b'\x0E\x43'},
+                ],
+            }))
+        events.append({
+            'event_id': event_id,
+            'start_time': START + timedelta(minutes=30 * event_id),
+            'duration': timedelta(minutes=30),
+            'descriptors': descriptors,
+        })
+    return encode(ActualStreamEventInformationSection, {
+        'table_id': 0x50 + number // 8,
+        'service_id': 0x0400,
+        'transport_stream_id': 0x7FE0,
+        'original_network_id': 4,
+        'section_number': number % 8 * 8,
+        'last_section_number': 0xF8,
+        'events': events,
+    })
+
+
+def summary(event):
+    return (event.event_id, event.start_time, str(event.title))
+
+
+class EventsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tempdir = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.tempdir, 'eit.ts')
+        stream = Stream()
+        for number in range(SECTIONS):
+            stream.section(0x12, eit(number))
+        stream.write(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tempdir)
+
+    def setUp(self):
+        enabled = stats.enabled
+        self.addCleanup(setattr, stats, 'enabled', enabled)
+        self.addCleanup(stats.reset)
+        stats.disable()
+
+    def events(self, **kwargs):
+        with tsopen(self.path) as ts:
+            return [summary(event) for event in events(ts, **kwargs)]
+
+    def counters(self, **kwargs):
+        """events() で数えたセクションの組み立て数と解析数、記述子の解析数"""
+
+        stats.enable()
+        stats.reset()
+        self.events(**kwargs)
+        counters = stats.snapshot()['counters']
+        stats.disable()
+        return {name: counters.get(name)
+                for name in ('sections_assembled', 'sections_parsed',
+                             'descriptors')}
+
+    def test_serial(self):
+        result = self.events()
+        self.assertEqual([event_id for event_id, _, _ in result],
+                         list(range(SECTIONS * EVENTS)))
+        self.assertEqual(result[27][2], 'BB')
+
+    def test_workers(self):
+        # バッチの区切りや終わる順によらず、読み込んだ順に返す
+        serial = self.events()
+        self.assertEqual(self.events(workers=1, batch_size=3), serial)
+        self.assertEqual(self.events(workers=2, batch_size=3), serial)
+        with ProcessPoolExecutor(2) as executor:
+            self.assertEqual(
+                self.events(workers=executor, batch_size=7), serial)
+
+    def test_lazy_workers(self):
+        with tsopen(self.path) as ts:
+            with self.assertRaises(ValueError):
+                next(events(ts, lazy=True, workers=2))
+
+    def test_stats(self):
+        # プロセスプールで数えた計測値も足し込む
+        serial = self.counters()
+        self.assertEqual(serial['descriptors'], {
+            '0x4D': SECTIONS * EVENTS, '0x4E': SECTIONS * EVENTS // 2,
+            '0x54': SECTIONS * EVENTS // 2})
+        self.assertEqual(serial['sections_parsed'],
+                         {'ActualStreamEventInformationSection': SECTIONS})
+        self.assertEqual(self.counters(workers=2, batch_size=3), serial)
+        # 同じプロセスで実行しても、セクションを二重に数えない
+        with ThreadPoolExecutor(2) as executor:
+            self.assertEqual(
+                self.counters(workers=executor, batch_size=3), serial)
+
+
+class LazyEventTest(unittest.TestCase):
+
+    def setUp(self):
+        self.eit = ActualStreamEventInformationSection(eit(0))
+        enabled = stats.enabled
+        self.addCleanup(setattr, stats, 'enabled', enabled)
+        self.addCleanup(stats.reset)
+        stats.enable()
+        stats.reset()
+
+    def event(self, index=0):
+        return LazyEvent(self.eit, self.eit.events[index])
+
+    def descriptors(self):
+        """解析した記述子のタグごとの数"""
+
+        return dict(stats.counters['descriptors'])
+
+    def test_on_demand(self):
+        event = self.event()
+        self.assertEqual((event.event_id, event.service_id),
+                         (0, 0x0400))
+        self.assertEqual(event.start_time, START)
+        # 記述子は参照されるまで解析しない
+        self.assertEqual(self.descriptors(), {})
+        self.assertEqual(event._loaded, set())
+
+        self.assertEqual(str(event.title), 'AA')
+        self.assertEqual(event._loaded, {'_load_short_event'})
+        self.assertEqual(self.descriptors(), {0x4D: 1})
+        # 同じローダーのプロパティは一緒にデコードしてある
+        self.assertIn('desc', vars(event))
+        self.assertNotIn('genre', vars(event))
+
+        self.assertEqual(event.genre, ['アニメ／特撮'])
+        self.assertEqual(event._loaded,
+                         {'_load_short_event', '_load_content'})
+        self.assertEqual(self.descriptors(), {0x4D: 1, 0x54: 1})
+
+    def test_missing_descriptor(self):
+        event = self.event(1)
+        with self.assertRaises(AttributeError):
+            event.genre
+        # ローダーは一度しか呼ばない
+        self.assertIn('_load_content', event._loaded)
+        with self.assertRaises(AttributeError):
+            event.genre
+        self.assertFalse(hasattr(event, 'detail'))
+        with self.assertRaises(AttributeError):
+            event.unknown
+        self.assertEqual(str(event.title), 'BA')
+
+    def test_load(self):
+        event = self.event()
+        self.assertIs(event.load(), event)
+        properties = event.properties()
+        self.assertFalse(any(key.startswith('_') for key in properties))
+        self.assertEqual(properties['event_id'], 0)
+        self.assertEqual(str(properties['title']), 'AA')
+        self.assertEqual(properties['subgenre'], ['国内アニメ'])
+        self.assertEqual(str(properties['detail']['A']), 'BC')
+        self.assertEqual(properties,
+                         vars(Event(self.eit, self.eit.events[0])))
+
+    def test_same_as_event(self):
+        path = os.path.join(tempfile.mkdtemp(), 'eit.ts')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        stream = Stream()
+        for number in range(4):
+            stream.section(0x12, eit(number))
+        stream.write(path)
+        with tsopen(path) as ts:
+            expected = [vars(event) for event in events(ts)]
+        with tsopen(path) as ts:
+            lazy = [event.load().properties()
+                    for event in events(ts, lazy=True)]
+        self.assertEqual(len(lazy), 4 * EVENTS)
+        self.assertEqual(lazy, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
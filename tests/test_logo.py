@@ -0,0 +1,350 @@
+from argparse import Namespace
+from contextlib import redirect_stderr, redirect_stdout
+import io
+import json
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+from ariblib.command.logo import logo
+from ariblib.descriptors import LogoTransmissionDescriptor
+from ariblib.encoder import SectionPacketizer, encode
+from ariblib.logo import (LOGO_SIZES, PNG_SIGNATURE, LogoCollector,
+                          LogoStore, fixed_colors, to_png)
+from ariblib.sections import (ActualStreamServiceDescriptionSection,
+                              CommonDataSection)
+
+from tests.tsutil import Stream
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+NETWORK_ID = 0x7FE0
+
+
+def chunk(name, data):
+    return (struct.pack('>L', len(data)) + name + data +
+            struct.pack('>L', zlib.crc32(name + data)))
+
+
+def logo_data(width=2, height=2, pixels=(1, 8, 2, 73)):
+    """CDT で送られるような PLTE の無い8ビットのパレットの PNG"""
+
+    rows = b''.join(b'\x00' + bytes(pixels[y * width:(y + 1) * width])
+                    for y in range(height))
+    header = struct.pack('>LLBBBBB', width, height, 8, 3, 0, 0, 0)
+    return (PNG_SIGNATURE + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+def chunks(png):
+    """PNG のチャンクを (名前, データ) で返す。CRC も確かめる"""
+
+    result = []
+    position = len(PNG_SIGNATURE)
+    while position < len(png):
+        length, = struct.unpack('>L', png[position:position + 4])
+        name = png[position + 4:position + 8]
+        data = png[position + 8:position + 8 + length]
+        crc, = struct.unpack(
+            '>L', png[position + 8 + length:position + 12 + length])
+        if crc != zlib.crc32(name + data):
+            raise ValueError('CRC error in {}'.format(name))
+        result.append((name, data))
+        position += 12 + length
+    return result
+
+
+def cdt(logo_id, logo_type, logo_version=1, data=None, data_type=0x01):
+    return encode(CommonDataSection, original_network_id=NETWORK_ID,
+                  data_type=data_type, logo_type=logo_type, logo_id=logo_id,
+                  logo_version=logo_version,
+                  data_byte=logo_data() if data is None else data)
+
+
+def sdt(logos):
+    """logos は service_id から (logo_id, logo_version) 。
+    logo_version が None なら logo_transmission_type 0x02 で送る"""
+
+    services = []
+    for service_id, (logo_id, logo_version) in sorted(logos.items()):
+        if logo_version is None:
+            descriptor = {'logo_transmission_type': 0x02, 'logo_id': logo_id}
+        else:
+            descriptor = {'logo_transmission_type': 0x01, 'logo_id': logo_id,
+                          'logo_version': logo_version,
+                          'download_data_id': logo_id}
+        services.append({
+            'service_id': service_id,
+            'descriptors': [(LogoTransmissionDescriptor, descriptor)],
+        })
+    return encode(ActualStreamServiceDescriptionSection,
+                  transport_stream_id=NETWORK_ID,
+                  original_network_id=NETWORK_ID, services=services)
+
+
+class ToPNGTest(unittest.TestCase):
+
+    def test_palette(self):
+        png = to_png(logo_data())
+        self.assertTrue(png.startswith(PNG_SIGNATURE))
+        names = [name for name, _ in chunks(png)]
+        self.assertEqual(names, [b'IHDR', b'PLTE', b'tRNS', b'IDAT', b'IEND'])
+        found = dict(chunks(png))
+        colors = fixed_colors()
+        self.assertEqual(len(colors), 128)
+        self.assertEqual(found[b'PLTE'],
+                         b''.join(bytes(color[:3]) for color in colors))
+        self.assertEqual(found[b'tRNS'], bytes(color[3] for color in colors))
+
+    def test_fixed_colors(self):
+        colors = fixed_colors()
+        self.assertEqual(colors[0], (0, 0, 0, 255))
+        self.assertEqual(colors[1], (255, 0, 0, 255))
+        self.assertEqual(colors[7], (255, 255, 255, 255))
+        self.assertEqual(colors[8], (0, 0, 0, 0))
+        self.assertEqual(colors[9], (170, 0, 0, 255))
+        self.assertEqual(colors[65], (0, 0, 0, 128))
+        self.assertEqual(colors[72], (255, 255, 255, 128))
+        self.assertEqual(colors[73], (170, 0, 0, 128))
+        self.assertEqual(len(set(colors)), 128)
+
+    def test_unchanged(self):
+        # PLTE があるもの、PNG でないものはそのまま
+        png = to_png(logo_data())
+        self.assertEqual(to_png(png), png)
+        self.assertEqual(to_png(b'not a png'), b'not a png')
+
+    @unittest.skipIf(Image is None, 'PIL is not installed')
+    def test_pil(self):
+        import io
+        image = Image.open(io.BytesIO(to_png(logo_data()))).convert('RGBA')
+        self.assertEqual(list(image.getdata()), [
+            (255, 0, 0, 255), (0, 0, 0, 0),
+            (0, 255, 0, 255), (170, 0, 0, 128)])
+
+
+class LogoStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.directory = os.path.join(self.tmp, 'logos')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_add(self):
+        store = LogoStore(self.directory)
+        path = store.add(CommonDataSection(cdt(5, 0x02, 3)))
+        self.assertEqual(os.path.basename(path), '7fe0_005_2_003.png')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), to_png(logo_data()))
+        self.assertTrue(store.known(NETWORK_ID, 5, 3, 0x02))
+        self.assertFalse(store.known(NETWORK_ID, 5, 3, 0x05))
+        self.assertEqual(store.version(NETWORK_ID, 5, 0x02), 3)
+
+        # 既知のロゴは保存しない
+        self.assertIsNone(store.add(CommonDataSection(cdt(5, 0x02, 3))))
+        # 新しい版は保存し直す
+        path = store.add(CommonDataSection(cdt(5, 0x02, 4)))
+        self.assertEqual(os.path.basename(path), '7fe0_005_2_004.png')
+        self.assertEqual(store.version(NETWORK_ID, 5, 0x02), 4)
+
+    def test_ignored(self):
+        store = LogoStore(self.directory)
+        self.assertIsNone(store.add(CommonDataSection(
+            cdt(5, 0x02, data_type=0x02))))
+        data = bytearray(cdt(5, 0x02))
+        data[-5] ^= 0xFF
+        self.assertIsNone(store.add(CommonDataSection(bytes(data))))
+        self.assertFalse(store.changed)
+        self.assertFalse(os.path.exists(self.directory))
+
+    def test_save_and_load(self):
+        store = LogoStore(self.directory)
+        store.add(CommonDataSection(cdt(5, 0x02, 3)))
+        store.add_service(NETWORK_ID, 0x0400, 5)
+        store.save()
+        self.assertFalse(store.changed)
+        with open(os.path.join(self.directory, 'index.json')) as f:
+            index = json.load(f)
+        self.assertEqual(index['logos'], [{
+            'original_network_id': NETWORK_ID, 'logo_id': 5,
+            'logo_type': 2, 'logo_version': 3, 'file': '7fe0_005_2_003.png',
+        }])
+        self.assertEqual(index['services'], [{
+            'original_network_id': NETWORK_ID, 'service_id': 0x0400,
+            'logo_id': 5,
+        }])
+
+        loaded = LogoStore(self.directory)
+        self.assertTrue(loaded.known(NETWORK_ID, 5, 3, 0x02))
+        self.assertEqual(loaded.services, {(NETWORK_ID, 0x0400): 5})
+        self.assertIsNone(loaded.add(CommonDataSection(cdt(5, 0x02, 3))))
+        # 変わっていなければ書き出さない
+        loaded.add_service(NETWORK_ID, 0x0400, 5)
+        self.assertFalse(loaded.changed)
+
+
+class LogoCollectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = LogoStore(self.tmp)
+        self.cdt = SectionPacketizer(0x29)
+        self.sdt = SectionPacketizer(0x11)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def feed(self, collector, packets):
+        saved = []
+        for packet in packets:
+            saved.extend(collector.feed(packet))
+        return saved
+
+    def carousel(self, logos):
+        """logos の (logo_id, logo_type) を1周送る CDT のパケット"""
+
+        return self.cdt.packetize(*(cdt(logo_id, logo_type)
+                                    for logo_id, logo_type in logos))
+
+    def test_all_types(self):
+        collector = LogoCollector(self.store, [0x02, 0x05])
+        self.feed(collector, self.sdt.packetize(
+            sdt({0x0400: (5, 1), 0x0401: (5, 1), 0x0408: (6, None)})))
+        self.assertEqual(self.store.services, {
+            (NETWORK_ID, 0x0400): 5, (NETWORK_ID, 0x0401): 5,
+            (NETWORK_ID, 0x0408): 6})
+        saved = self.feed(collector, self.carousel(
+            [(5, 0x02), (5, 0x05), (6, 0x02)]))
+        self.assertEqual(len(saved), 3)
+        self.assertFalse(collector.done)
+        self.feed(collector, self.carousel([(6, 0x05)]))
+        self.assertTrue(collector.done)
+        self.assertTrue(collector.collected())
+        self.assertFalse(collector.cycled)
+
+    def test_needs_sdt(self):
+        collector = LogoCollector(self.store, [0x02])
+        self.feed(collector, self.carousel([(5, 0x02)] * 2))
+        self.assertFalse(collector.done)
+        self.feed(collector, self.sdt.packetize(sdt({0x0400: (5, 1)})))
+        self.assertTrue(collector.done)
+
+    def test_version(self):
+        # SDT の logo_version と異なる版しか無ければ揃っていない
+        collector = LogoCollector(self.store, [0x02])
+        self.feed(collector, self.sdt.packetize(sdt({0x0400: (5, 2)})))
+        self.feed(collector, self.carousel([(5, 0x02)]))
+        self.assertFalse(collector.done)
+        self.feed(collector, self.cdt.packetize(cdt(5, 0x02, 2)))
+        self.assertTrue(collector.done)
+
+    def test_cycle(self):
+        # 既定では 0-5 の全てを待つが、送られていない種類は一巡で諦める
+        collector = LogoCollector(self.store)
+        self.assertEqual(collector.logo_types, tuple(LOGO_SIZES))
+        self.feed(collector, self.sdt.packetize(sdt({0x0400: (5, 1)})))
+        logos = [(5, 0x02), (5, 0x05), (7, 0x02)]
+        self.assertEqual(len(self.feed(collector, self.carousel(logos))), 3)
+        self.assertFalse(collector.done)
+        saved = self.feed(collector, self.carousel(logos[:1]))
+        self.assertEqual(saved, [])
+        self.assertTrue(collector.cycled)
+        self.assertTrue(collector.done)
+        self.assertFalse(collector.collected())
+
+    def test_cycle_after_crc_error(self):
+        collector = LogoCollector(self.store, [0x00])
+        self.feed(collector, self.sdt.packetize(sdt({0x0400: (5, 1)})))
+        broken = bytearray(cdt(5, 0x02))
+        broken[-5] ^= 0xFF
+        self.feed(collector, self.cdt.packetize(bytes(broken)))
+        # 読めなかったロゴは一巡したことにならない
+        saved = self.feed(collector, self.carousel([(5, 0x02)]))
+        self.assertEqual(len(saved), 1)
+        self.assertFalse(collector.done)
+        self.feed(collector, self.carousel([(5, 0x02)]))
+        self.assertTrue(collector.done)
+
+    def test_reset(self):
+        # 一巡した状態は次のストリームに持ち越さない
+        collector = LogoCollector(self.store)
+        self.feed(collector, self.sdt.packetize(sdt({0x0400: (5, 1)})))
+        self.feed(collector, self.carousel([(5, 0x02)] * 2))
+        self.assertTrue(collector.done)
+        collector.reset()
+        self.assertFalse(collector.done)
+        self.assertFalse(collector.cycled)
+        self.feed(collector, self.sdt.packetize(sdt({0x0408: (6, 1)})))
+        self.assertEqual(len(self.feed(collector, self.carousel(
+            [(6, 0x02), (5, 0x02)]))), 1)
+        self.assertFalse(collector.done)
+        self.feed(collector, self.carousel([(6, 0x02)]))
+        self.assertTrue(collector.done)
+        self.assertEqual(set(collector.wanted),
+                         {(NETWORK_ID, 5), (NETWORK_ID, 6)})
+
+
+class LogoCommandTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def recording(self, name, service_id, logo_id, cycles=3):
+        """SDT と、logo_id の種類 2 のロゴを cycles 回送る CDT の TS"""
+
+        stream = Stream()
+        stream.section(0x11, sdt({service_id: (logo_id, 1)}))
+        for _ in range(cycles):
+            stream.section(0x29, cdt(logo_id, 0x02))
+        path = os.path.join(self.tmp, name)
+        stream.write(path)
+        return path
+
+    def run_logo(self, inpaths, types=(0x02,)):
+        outdir = os.path.join(self.tmp, 'logos')
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            logo(Namespace(inpaths=inpaths, outdir=outdir,
+                           types=list(types), all=False))
+        return (sorted(os.path.basename(path)
+                       for path in stdout.getvalue().split()),
+                stderr.getvalue())
+
+    def test_two_files(self):
+        # 最初のファイルの CDT が一巡しても、次のファイルも読む
+        inpaths = [self.recording('a.ts', 0x0400, 5),
+                   self.recording('b.ts', 0x0408, 6)]
+        saved, stderr = self.run_logo(inpaths, LOGO_SIZES)
+        self.assertEqual(saved, ['7fe0_005_2_001.png', '7fe0_006_2_001.png'])
+        self.assertEqual(stderr, 'some logo types are not sent\n')
+        store = LogoStore(os.path.join(self.tmp, 'logos'))
+        self.assertEqual(store.services, {(NETWORK_ID, 0x0400): 5,
+                                          (NETWORK_ID, 0x0408): 6})
+
+    def test_collected(self):
+        inpaths = [self.recording('a.ts', 0x0400, 5, cycles=1),
+                   self.recording('b.ts', 0x0408, 6, cycles=1)]
+        saved, stderr = self.run_logo(inpaths)
+        self.assertEqual(len(saved), 2)
+        self.assertEqual(stderr, '')
+
+    def test_not_found(self):
+        # ロゴの揃わなかったファイルがあれば知らせる
+        inpaths = [self.recording('a.ts', 0x0400, 5, cycles=0),
+                   self.recording('b.ts', 0x0408, 6, cycles=1)]
+        saved, stderr = self.run_logo(inpaths)
+        self.assertEqual(saved, ['7fe0_006_2_001.png'])
+        self.assertEqual(stderr, 'some logos are not found\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
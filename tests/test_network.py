@@ -0,0 +1,208 @@
+from argparse import Namespace
+from contextlib import redirect_stderr, redirect_stdout
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from ariblib import tsopen
+from ariblib.command.network import network
+from ariblib.descriptors import (BroadcasterNameDescriptor,
+                                 NetworkNameDescriptor, ServiceDescriptor,
+                                 ServiceListDescriptor)
+from ariblib.encoder import build, raw_bytes
+from ariblib.network import NetworkDatabase
+from ariblib.sections import (BroadcasterInformationSection,
+                              NetworkInformationSection,
+                              ServiceDescriptionSection)
+
+from tests.tsutil import Stream
+
+NETWORK_ID = 0x7FE0
+
+
+def nit(streams, table_id=0x40, network_id=NETWORK_ID, version=0,
+        name=b'\x0E\x41'):
+    """streams は (transport_stream_id, [service_id, ...]) のリスト"""
+
+    return build(NetworkInformationSection, {
+        'table_id': table_id,
+        'network_id': network_id,
+        'version_number': version,
+        'network_descriptors': [(NetworkNameDescriptor, {'char': name})],
+        'transport_streams': [{
+            'transport_stream_id': stream_id,
+            'original_network_id': NETWORK_ID,
+            'descriptors': [(ServiceListDescriptor, {'services': [
+                {'service_id': service_id, 'service_type': 0x01}
+                for service_id in service_ids]})],
+        } for stream_id, service_ids in streams],
+    })
+
+
+def sdt(stream_id, services, table_id=0x42, version=0):
+    """services は service_id から8単位符号のサービス名"""
+
+    return build(ServiceDescriptionSection, {
+        'table_id': table_id,
+        'transport_stream_id': stream_id,
+        'original_network_id': NETWORK_ID,
+        'version_number': version,
+        'services': [{
+            'service_id': service_id,
+            'descriptors': [(ServiceDescriptor, {
+                'service_type': 0x01, 'service_name': name})],
+        } for service_id, name in sorted(services.items())],
+    })
+
+
+def bit(name=b'\x0E\x41'):
+    return build(BroadcasterInformationSection, {
+        'original_network_id': NETWORK_ID,
+        'broadcasters': [{
+            'broadcaster_id': 1,
+            'descriptors': [(BroadcasterNameDescriptor, {'char': name})],
+        }],
+    })
+
+
+def service_ids(database):
+    return [service.service_id for service in database.services()]
+
+
+class NetworkDatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.database = NetworkDatabase()
+
+    def add(self, *sections):
+        return [self.database.add(section) for section in sections]
+
+    def test_same_version(self):
+        self.assertEqual(self.add(sdt(0x7FE0, {0x0400: b'\x0E\x41'}),
+                                  sdt(0x7FE0, {0x0400: b'\x0E\x42'})),
+                         [True, False])
+        service, = self.database.services()
+        self.assertEqual(service.name, 'A')
+
+    def test_sdt_version_change(self):
+        self.add(sdt(0x7FE0, {0x0400: b'\x0E\x41', 0x0401: b'\x0E\x42'}))
+        self.assertEqual(service_ids(self.database), [0x0400, 0x0401])
+        self.add(sdt(0x7FE0, {0x0400: b'\x0E\x43'}, version=1))
+        service, = self.database.services()
+        self.assertEqual((service.service_id, service.name), (0x0400, 'C'))
+
+    def test_nit_version_change(self):
+        self.add(nit([(0x7FE0, [0x0400]), (0x7FE1, [0x0408])]),
+                 sdt(0x7FE0, {0x0400: b'\x0E\x41'}))
+        service, = self.database.services()
+        self.assertIs(service.transport_stream,
+                      self.database.transport_streams[(NETWORK_ID, 0x7FE0)])
+        self.assertEqual(self.database.networks[NETWORK_ID].name, 'A')
+
+        self.add(nit([(0x7FE1, [0x0408])], version=1, name=b'\x0E\x42'))
+        self.assertEqual(list(self.database.transport_streams),
+                         [(NETWORK_ID, 0x7FE1)])
+        self.assertEqual(self.database.networks[NETWORK_ID].name, 'B')
+        # 消えた TS への参照は残さない
+        self.assertIsNone(service.transport_stream)
+
+    def test_other_network_nit(self):
+        # 自ネットワークと他ネットワークの NIT に同じ TS がある
+        self.add(nit([(0x7FE0, [0x0400]), (0x7FE1, [0x0408])]),
+                 nit([(0x7FE0, [0x0400])], table_id=0x41, network_id=0x7FE8))
+        self.add(nit([(0x7FE1, [0x0408])], version=1))
+        # 他ネットワークの NIT にまだある TS は消さない
+        self.assertEqual(sorted(self.database.transport_streams),
+                         [(NETWORK_ID, 0x7FE0), (NETWORK_ID, 0x7FE1)])
+        self.assertEqual(sorted(self.database.networks),
+                         [NETWORK_ID, 0x7FE8])
+
+        self.add(nit([], table_id=0x41, network_id=0x7FE8, version=1))
+        self.assertEqual(list(self.database.transport_streams),
+                         [(NETWORK_ID, 0x7FE1)])
+        self.assertEqual(sorted(self.database.networks),
+                         [NETWORK_ID, 0x7FE8])
+
+    def test_other_stream_sdt(self):
+        # 同じ TS のサービスが自 TS と他 TS の SDT の両方にある
+        self.add(sdt(0x7FE0, {0x0400: b'\x0E\x41', 0x0401: b'\x0E\x42'}),
+                 sdt(0x7FE0, {0x0400: b'\x0E\x41', 0x0401: b'\x0E\x42'},
+                     table_id=0x46))
+        self.add(sdt(0x7FE0, {0x0400: b'\x0E\x41'}, version=1))
+        self.assertEqual(service_ids(self.database), [0x0400, 0x0401])
+        self.add(sdt(0x7FE0, {0x0400: b'\x0E\x41'}, table_id=0x46,
+                     version=3))
+        self.assertEqual(service_ids(self.database), [0x0400])
+
+        # 残ったサービスは次の版で消えれば消える
+        self.add(sdt(0x7FE0, {}, version=2))
+        self.assertEqual(service_ids(self.database), [0x0400])
+        self.add(sdt(0x7FE0, {}, table_id=0x46, version=4))
+        self.assertEqual(service_ids(self.database), [])
+
+    def test_complete(self):
+        self.database = NetworkDatabase(tables=(0x40, 0x42))
+        self.add(nit([(0x7FE0, [0x0400])]))
+        self.assertFalse(self.database.complete)
+        self.add(sdt(0x7FE0, {0x0400: b'\x0E\x41'}))
+        self.assertTrue(self.database.complete)
+
+
+# 2つのトランスポンダの NIT
+STREAMS = [(0x7FE0, [0x0400]), (0x7FE1, [0x0408])]
+
+
+class ScanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def recording(self, name, stream_id, services):
+        """NIT, SDT, BIT と、揃った後に届く SDT の新しい版を持つ TS"""
+
+        stream = Stream()
+        stream.section(0x10, raw_bytes(nit(STREAMS)))
+        stream.section(0x11, raw_bytes(sdt(stream_id, services)))
+        stream.section(0x24, raw_bytes(bit()))
+        renamed = {service_id: b'\x0E\x5A' for service_id in services}
+        stream.section(0x11, raw_bytes(sdt(stream_id, renamed, version=1)))
+        path = os.path.join(self.tmp, name)
+        stream.write(path)
+        return path
+
+    def test_scan(self):
+        # 揃った時点でその TS の読み込みを止め、次の TS も読める
+        database = NetworkDatabase()
+        with tsopen(self.recording('a.ts', 0x7FE0,
+                                   {0x0400: b'\x0E\x41'})) as ts:
+            self.assertTrue(database.scan(ts))
+        self.assertEqual([service.name for service in database.services()],
+                         ['A'])
+        with tsopen(self.recording('b.ts', 0x7FE1,
+                                   {0x0408: b'\x0E\x42'})) as ts:
+            self.assertTrue(database.scan(ts))
+        self.assertEqual([(service.service_id, service.name)
+                          for service in database.services()],
+                         [(0x0400, 'A'), (0x0408, 'B')])
+
+    def test_command(self):
+        inpaths = [self.recording('a.ts', 0x7FE0, {0x0400: b'\x0E\x41'}),
+                   self.recording('b.ts', 0x7FE1, {0x0408: b'\x0E\x42'})]
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            network(Namespace(inpaths=inpaths, other_streams=False))
+        self.assertEqual(stderr.getvalue(), '')
+        result = json.loads(stdout.getvalue())
+        self.assertEqual([(item['transport_stream_id'], item['service_id'],
+                           item['name']) for item in result['services']],
+                         [(0x7FE0, 0x0400, 'A'), (0x7FE1, 0x0408, 'B')])
+        self.assertEqual([item['name'] for item in result['broadcasters']],
+                         ['A'])
+
+
+if __name__ == '__main__':
+    unittest.main()
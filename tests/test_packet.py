@@ -0,0 +1,340 @@
+from datetime import datetime, timedelta
+import unittest
+
+from ariblib.encoder import SectionPacketizer, encode, raw_bytes
+from ariblib.packet import (PESParser, PacketizedElementaryStream,
+                            SectionParser,
+                            SynchronizedPacketizedElementaryStream, pcr,
+                            pes_dts, pes_pts)
+from ariblib.sections import (EventInformationSection,
+                              TimeOffsetSection)
+
+from tests.tsutil import (data_group, drcs_unit, pes, pes_packets, text_unit,
+                          timestamp, ts_packet)
+
+
+class PESHeaderTest(unittest.TestCase):
+
+    def parse(self, data):
+        return PacketizedElementaryStream(data)
+
+    def test_no_optional_fields(self):
+        packet = self.parse(pes(0x00, payload=b'\x80\x81'))
+        self.assertEqual(packet.stream_id, 0xBD)
+        self.assertEqual(packet.PES_packet_length, 5)
+        self.assertEqual(packet.PES_header_data_length, 0)
+        self.assertEqual(packet.header_length, 9)
+        self.assertIsNone(packet.pts)
+        self.assertIsNone(packet.dts)
+        self.assertEqual(packet.PES_packet_data_byte, b'\x80\x81')
+        self.assertEqual(bytes(packet.payload), b'\x80\x81')
+        self.assertTrue(packet.isfull())
+
+    def test_pts(self):
+        value = (1 << 32) + 12345
+        packet = self.parse(pes(0x80, timestamp(0b0010, value), b'\x80'))
+        self.assertEqual(packet.PTS_DTS_flags, 0b10)
+        self.assertEqual(packet.should_be_0010, 0b0010)
+        self.assertEqual(
+            packet.PTS_1 << 30 | packet.PTS_2 << 15 | packet.PTS_3, value)
+        self.assertEqual(packet.pts, timedelta(seconds=value / 90000))
+        self.assertIsNone(packet.dts)
+        self.assertEqual(packet.PES_packet_data_byte, b'\x80')
+
+    def test_pts_dts(self):
+        pts, dts = 900000, 896400
+        optional = timestamp(0b0011, pts) + timestamp(0b0001, dts)
+        packet = self.parse(pes(0xC0, optional, b'\x80'))
+        self.assertEqual(
+            packet.DTS_1 << 30 | packet.DTS_2 << 15 | packet.DTS_3, dts)
+        self.assertEqual(packet.pts, timedelta(seconds=10))
+        self.assertEqual(packet.dts, timedelta(seconds=9.96))
+        self.assertEqual(packet.PES_packet_data_byte, b'\x80')
+
+    def test_escr_es_rate(self):
+        # ESCR_base 0, ESCR_extension 0x1FF
+        escr = bytes([0x04, 0x00, 0x04, 0x00, 0x07, 0xFF])
+        es_rate = ((1 << 23) | (1000 << 1) | 1).to_bytes(3, 'big')
+        packet = self.parse(pes(0x30, escr + es_rate, b'\x80'))
+        self.assertEqual(packet.ESCR_extension, 0x1FF)
+        self.assertEqual(packet.ES_rate, 1000)
+        self.assertEqual(packet.header_length, 18)
+        self.assertEqual(packet.PES_packet_data_byte, b'\x80')
+
+    def test_trick_mode_copy_info_crc(self):
+        optional = bytes([0b00100101, 0x80 | 0x2A, 0x12, 0x34])
+        packet = self.parse(pes(0x0E, optional, b'\x80'))
+        self.assertEqual(packet.trick_mode_control, 0b001)
+        self.assertEqual(packet.rep_cntrl, 5)
+        self.assertEqual(packet.additional_copy_info, 0x2A)
+        self.assertEqual(packet.previous_PES_packet_CRC, 0x1234)
+        self.assertEqual(packet.PES_packet_data_byte, b'\x80')
+
+    def test_extension(self):
+        optional = bytes([
+            0b01101111,  # pack_header, sequence_counter, extension_2
+            3, 0xAA, 0xBB, 0xCC,  # pack_header
+            0x80 | 0x11, 0x80 | 0x40 | 0x05,  # sequence counter
+            0x80 | 2, 0xDD, 0xEE,  # extension_2
+        ])
+        packet = self.parse(pes(0x01, optional, b'\x80\x81'))
+        self.assertEqual(packet.pack_header, b'\xAA\xBB\xCC')
+        self.assertEqual(packet.program_packet_sequence_counter, 0x11)
+        self.assertEqual(packet.MPEG1_MPEG2_identifier, 1)
+        self.assertEqual(packet.original_stuff_length, 5)
+        self.assertEqual(packet.PES_extension_field, b'\xDD\xEE')
+        self.assertEqual(packet.stuffing_byte, b'')
+        self.assertEqual(packet.PES_packet_data_byte, b'\x80\x81')
+
+    def test_private_data_and_p_std(self):
+        private_data = bytes(range(16))
+        optional = bytes([0b10011110]) + private_data + b'\x60\x23'
+        packet = self.parse(pes(0x01, optional, b'\x80\x81', stuffing=2))
+        self.assertEqual(packet.PES_private_data, private_data)
+        self.assertEqual(packet.P_STD_buffer_scale, 1)
+        self.assertEqual(packet.P_STD_buffer_size, 35)
+        self.assertEqual(packet.stuffing_byte, b'\xFF\xFF')
+        self.assertEqual(packet.PES_packet_data_byte, b'\x80\x81')
+
+    def test_stuffing(self):
+        data = pes(0x80, timestamp(0b0010, 90000), b'\x80', stuffing=3)
+        packet = self.parse(data)
+        self.assertEqual(packet.stuffing_byte, b'\xFF\xFF\xFF')
+        self.assertEqual(packet.pts, timedelta(seconds=1))
+        self.assertEqual(packet.PES_packet_data_byte, b'\x80')
+
+    def test_without_header(self):
+        data = b'\x00\x00\x01\xBE\x00\x03\xFF\xFF\xFF'
+        packet = self.parse(data)
+        self.assertEqual(packet.stream_id, 0xBE)
+        self.assertEqual(packet.header_length, 6)
+        self.assertIsNone(packet.pts)
+        self.assertEqual(packet.PES_packet_data_byte, b'\xFF\xFF\xFF')
+
+
+class TimestampTest(unittest.TestCase):
+
+    def test_pes_pts(self):
+        data = pes(0x80, timestamp(0b0010, (1 << 33) - 1))
+        self.assertEqual(pes_pts(data),
+                         timedelta(seconds=((1 << 33) - 1) / 90000))
+        self.assertIsNone(pes_dts(data))
+
+    def test_pes_dts(self):
+        data = pes(0xC0, timestamp(0b0011, 180000) + timestamp(0b0001, 90000))
+        self.assertEqual(pes_pts(data), timedelta(seconds=2))
+        self.assertEqual(pes_dts(data), timedelta(seconds=1))
+
+    def test_no_timestamp(self):
+        data = pes(0x00)
+        self.assertIsNone(pes_pts(data))
+        self.assertIsNone(pes_dts(data))
+
+
+def pcr_field(flags, base, extension=0):
+    return bytes([
+        flags,
+        (base >> 25) & 0xFF, (base >> 17) & 0xFF, (base >> 9) & 0xFF,
+        (base >> 1) & 0xFF, (base & 1) << 7 | 0x7E | extension >> 8,
+        extension & 0xFF,
+    ])
+
+
+class PCRTest(unittest.TestCase):
+
+    def test_pcr(self):
+        base = (1 << 33) - 90000
+        packet = ts_packet(0x100, adaptation=pcr_field(0x10, base, 0x12C))
+        self.assertEqual(pcr(packet), timedelta(seconds=base / 90000))
+
+    def test_opcr_only(self):
+        # OPCR_flag だけが立っている場合は PCR ではない
+        packet = ts_packet(0x100, adaptation=pcr_field(0x08, 90000))
+        self.assertIsNone(pcr(packet))
+
+    def test_pcr_and_opcr(self):
+        adaptation = pcr_field(0x18, 90000) + pcr_field(0, 180000)[1:]
+        packet = ts_packet(0x100, adaptation=adaptation)
+        self.assertEqual(pcr(packet), timedelta(seconds=1))
+
+    def test_without_pcr(self):
+        self.assertIsNone(pcr(ts_packet(0x100, b'\x00')))
+        self.assertIsNone(pcr(ts_packet(0x100, adaptation=b'\x10')))
+        self.assertIsNone(pcr(ts_packet(0x100, adaptation=b'')))
+
+
+class PESParserTest(unittest.TestCase):
+
+    PID = 0x130
+
+    def setUp(self):
+        self.parser = PESParser()
+        self.parser.add(PacketizedElementaryStream, [self.PID])
+
+    def feed(self, packets):
+        result = []
+        for packet in packets:
+            result.extend(self.parser.feed(packet))
+        return result
+
+    def test_multiple_packets(self):
+        data = pes(0x80, timestamp(0b0010, 90000), bytes(range(250)))
+        result = self.feed(pes_packets(self.PID, data))
+        self.assertEqual(len(result), 1)
+        # PES_packet_length の後のスタッフィングは含まない
+        self.assertEqual(bytes(result[0]._packet), data)
+        self.assertEqual(bytes(result[0].payload), bytes(range(250)))
+        self.assertEqual(self.parser.dropped, 0)
+
+    def test_discontinuity(self):
+        data = pes(0x80, timestamp(0b0010, 90000), bytes(range(250)))
+        first, second = pes_packets(self.PID, data)
+        second = ts_packet(self.PID, second[4:], counter=2)
+        self.assertEqual(self.feed([first, second]), [])
+        self.assertEqual(self.parser.dropped, 1)
+        self.assertEqual(self.parser.buffers, {})
+
+    def test_duplicate_packet(self):
+        data = pes(0x80, timestamp(0b0010, 90000), bytes(range(250)))
+        first, second = pes_packets(self.PID, data)
+        result = self.feed([first, first, second])
+        self.assertEqual(len(result), 1)
+        self.assertEqual(bytes(result[0]._packet), data)
+        self.assertEqual(self.parser.dropped, 0)
+
+    def test_complete_without_next_start(self):
+        data = pes(0x00, payload=b'\x80\x81')
+        result = self.feed(pes_packets(self.PID, data))
+        self.assertEqual([bytes(p._packet) for p in result], [data])
+        self.assertEqual(self.parser.buffers, {})
+
+    def test_unbounded_length(self):
+        data = bytearray(pes(0x00, payload=b'\x80\x81\x82'))
+        data[4:6] = b'\x00\x00'
+        self.assertEqual(self.feed(pes_packets(self.PID, data)), [])
+        result = self.feed(pes_packets(self.PID, data, counter=1))
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0].PES_packet_length, 0)
+        self.assertEqual(bytes(result[0].payload[:3]), b'\x80\x81\x82')
+        self.assertEqual(len(self.parser.flush()), 1)
+
+    def test_other_pid(self):
+        data = pes(0x00, payload=b'\x80')
+        self.assertEqual(self.feed(pes_packets(0x131, data)), [])
+
+
+def tot(second=0):
+    return encode(TimeOffsetSection,
+                  JST_time=datetime(2020, 1, 1, 19, 0, second))
+
+
+def eit(event_id, padding=0):
+    return encode(EventInformationSection, service_id=0x0400, events=[{
+        'event_id': event_id,
+        'descriptors': [bytes([0x4D, padding]) + b'\x00' * padding]}])
+
+
+class SectionParserTest(unittest.TestCase):
+
+    """揃ったセクションを次のセクションの開始を待たずに返すこと
+
+    TOT をその直前の PCR と組にする (ariblib.clock) ため、セクションは
+    最後のバイトを含むパケットを与えた時点で返す"""
+
+    def setUp(self):
+        self.parser = SectionParser(TimeOffsetSection,
+                                    EventInformationSection)
+
+    def feed(self, packets):
+        """パケットごとに返したセクションのバイト列のリスト"""
+
+        return [[raw_bytes(section) for section in self.parser.feed(p)]
+                for p in packets]
+
+    def test_single_packet(self):
+        data = tot()
+        packets = SectionPacketizer(0x14).packetize(data)
+        self.assertEqual(self.feed(packets), [[data]])
+        self.assertEqual(self.parser.buffers[0x14], b'')
+        # 次のセクションの開始で同じセクションを返し直さない
+        following = tot(1)
+        packets = SectionPacketizer(0x14, 1).packetize(following)
+        self.assertEqual(self.feed(packets), [[following]])
+
+    def test_several_packets(self):
+        data = eit(0x0100, padding=250)
+        packets = SectionPacketizer(0x12).packetize(data)
+        self.assertEqual(len(packets), 2)
+        self.assertEqual(self.feed(packets), [[], [data]])
+        self.assertEqual(self.parser.flush(), [])
+
+    def test_sections_in_one_packet(self):
+        first = eit(0x0100)
+        second = eit(0x0101)
+        packets = SectionPacketizer(0x12).packetize(first, second)
+        self.assertEqual(self.feed(packets), [[first, second]])
+
+    def test_section_continues_in_next_start(self):
+        # 2つ目のセクションの残りと3つ目のセクションが同じパケットにある
+        first = eit(0x0100, padding=100)
+        second = eit(0x0101, padding=100)
+        third = eit(0x0102)
+        packets = SectionPacketizer(0x12).packetize(first, second, third)
+        self.assertEqual(len(packets), 2)
+        self.assertEqual(self.feed(packets), [[first], [second, third]])
+
+    def test_other_table_id(self):
+        # 対象でない table_id (TDT) は読み飛ばす
+        tdt = bytearray(tot())
+        tdt[0] = 0x70
+        data = tot(1)
+        packets = SectionPacketizer(0x14).packetize(bytes(tdt), data)
+        self.assertEqual(self.feed(packets), [[data]])
+
+
+class CaptionDataGroupTest(unittest.TestCase):
+
+    def parse(self, data_units):
+        data = pes(0x80, timestamp(0b0010, 90000),
+                   data_group(data_units))
+        return SynchronizedPacketizedElementaryStream(data)
+
+    def test_text(self):
+        spes = self.parse([text_unit(b'\x41\x42')])
+        self.assertEqual(spes.data_group_id, 0x01)
+        self.assertEqual(spes.data_group.data_identifier, 0x80)
+        self.assertEqual([unit.data_unit_data for unit in spes.data_units],
+                         [b'\x41\x42'])
+        self.assertEqual(spes.pts, timedelta(seconds=1))
+
+    def drcs(self, depth, bits):
+        # 18x3 は 1 行がバイト境界で終わらない
+        size = (bits * 18 * 3 + 7) // 8
+        first = bytes(range(1, size + 1))
+        second = bytes(range(0x81, 0x81 + size))
+        spes = self.parse([
+            drcs_unit([(0x4121, depth, 18, 3, first),
+                       (0x4122, depth, 18, 3, second)]),
+            text_unit(b'\x41'),
+        ])
+        units = spes.data_units
+        self.assertEqual(len(units), 2)
+        codes = units[0].codes
+        self.assertEqual([code.character_code for code in codes],
+                         [0x4121, 0x4122])
+        fonts = [code.fonts[0] for code in codes]
+        self.assertEqual([font.pattern_data for font in fonts],
+                         [first, second])
+        self.assertEqual([font.depth for font in fonts], [depth, depth])
+        self.assertEqual(units[1].data_unit_data, b'\x41')
+        return size
+
+    def test_drcs_2_levels(self):
+        self.assertEqual(self.drcs(0, 1), 7)
+
+    def test_drcs_4_levels(self):
+        self.assertEqual(self.drcs(2, 2), 14)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,246 @@
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+import threading
+import time
+import unittest
+
+from ariblib.ring import (RingBufferReader, RingBufferWriter,
+                          SharedMemoryTransportStreamFile)
+
+from tests.tsutil import ts_packet
+
+
+def packet(number):
+    """番号 number を埋め込んだパケット"""
+
+    return ts_packet(0x0100, number.to_bytes(4, 'big') * 40, number)
+
+
+def packets(start, stop):
+    return b''.join(packet(number) for number in range(start, stop))
+
+
+def numbers(data):
+    """パケットのバイト列から埋め込んだ番号のリストを返す (壊れていれば失敗)"""
+
+    result = []
+    for start in range(0, len(data), 188):
+        number = int.from_bytes(data[start + 4:start + 8], 'big')
+        if bytes(data[start:start + 188]) != packet(number):
+            raise AssertionError('broken packet at {}'.format(start))
+        result.append(number)
+    return result
+
+
+def consume(name, count, queue):
+    """別のプロセスで count パケットを読み、番号のリストを返す"""
+
+    result = []
+    with SharedMemoryTransportStreamFile(name, chunk_size=7) as ts:
+        queue.put('attached')
+        for p in ts:
+            result.extend(numbers(p))
+            if len(result) >= count:
+                break
+    queue.put(result)
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def writer(self, **kwargs):
+        writer = RingBufferWriter(**kwargs)
+        self.addCleanup(writer.close)
+        return writer
+
+    def reader(self, writer, slot=0, **kwargs):
+        ts = SharedMemoryTransportStreamFile(writer.name, slot, **kwargs)
+        self.addCleanup(ts.close)
+        return ts
+
+    def thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        return thread
+
+    def test_read(self):
+        writer = self.writer(capacity=64, consumers=1)
+        ts = self.reader(writer, chunk_size=10)
+        self.assertEqual(writer.attached(), 1)
+        writer.write(packets(0, 32))
+        writer.close()
+        chunks = list(ts.chunks())
+        self.assertEqual([len(chunk) // 188 for chunk in chunks],
+                         [10, 10, 10, 2])
+        self.assertTrue(all(isinstance(chunk, bytes) for chunk in chunks))
+        self.assertEqual(numbers(b''.join(chunks)), list(range(32)))
+        self.assertEqual(ts.ring.dropped, 0)
+
+    def test_read_method(self):
+        writer = self.writer(capacity=16, consumers=1)
+        # 閉じた読み込み側の枠は空く
+        other = RingBufferReader(writer.name)
+        self.assertEqual(writer.attached(), 1)
+        other.close()
+        self.assertEqual(writer.attached(), 0)
+        ring = RingBufferReader(writer.name)
+        self.addCleanup(ring.close)
+        writer.write(packets(0, 10))
+        writer.close()
+        buffer = bytearray(188 * 4)
+        self.assertEqual(ring.readinto(buffer), 188 * 4)
+        self.assertEqual(numbers(buffer), [0, 1, 2, 3])
+        with self.assertRaises(ValueError):
+            ring.readinto(bytearray(100))
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            RingBufferWriter(overrun='wait')
+        writer = self.writer(capacity=8, consumers=2)
+        with self.assertRaises(ValueError):
+            RingBufferReader(writer.name, slot=2)
+        with self.assertRaises(ValueError):
+            writer.write(b'\x47' * 100)
+        memory = SharedMemory(create=True, size=1024)
+        self.addCleanup(memory.unlink)
+        self.addCleanup(memory.close)
+        with self.assertRaises(ValueError):
+            RingBufferReader(memory.name)
+
+    def test_block_keeps_packets(self):
+        # 書き込み側は読み込み側を待ち、コピーしたパケットは上書きされない
+        writer = self.writer(capacity=8, consumers=1)
+        ts = self.reader(writer, chunk_size=3)
+
+        def write():
+            writer.write(packets(0, 40))
+            writer.close()
+
+        thread = self.thread(write)
+        time.sleep(0.05)
+        # 読み込み側が読むまで capacity 以上は書かない
+        self.assertEqual(writer.written, 8)
+        kept = list(ts)
+        thread.join(5)
+        self.assertEqual([numbers(p)[0] for p in kept], list(range(40)))
+        self.assertEqual(ts.ring.dropped, 0)
+
+    def test_view_lifetime(self):
+        # copy=False の batch は次の batch を求めた後は上書きされうる
+        writer = self.writer(capacity=8, consumers=1)
+        ring = RingBufferReader(writer.name)
+        self.addCleanup(ring.close)
+
+        def write():
+            writer.write(packets(0, 16))
+            writer.close()
+
+        thread = self.thread(write)
+        views = []
+        for batch in ring.batches(4):
+            views.append(batch)
+            self.assertEqual(numbers(batch)[0], 4 * (len(views) - 1))
+        thread.join(5)
+        self.assertEqual(numbers(views[0]), [8, 9, 10, 11])
+        for view in views:
+            view.release()
+
+    def test_drop(self):
+        writer = self.writer(capacity=16, consumers=1, overrun='drop')
+        ts = self.reader(writer)
+        writer.write(packets(0, 100))
+        self.assertEqual(writer.written, 100)
+        writer.close()
+        # 最新から capacity の半分だけ戻った位置から読む
+        self.assertEqual(numbers(b''.join(ts.chunks())), list(range(92, 100)))
+        self.assertEqual(ts.ring.dropped, 92)
+
+    def test_drop_while_copying(self):
+        # 書き込み側が書いている途中かもしれない位置はコピーしても読み飛ばす
+        writer = self.writer(capacity=16, consumers=1, overrun='drop')
+        ts = self.reader(writer)
+        writer.write(packets(0, 14))
+        writer.close()
+        self.assertEqual(numbers(b''.join(ts.chunks())), list(range(6, 14)))
+        self.assertEqual(ts.ring.dropped, 6)
+
+    def test_drop_keeps_up(self):
+        writer = self.writer(capacity=16, consumers=1, overrun='drop')
+        ts = self.reader(writer)
+        writer.write(packets(0, 10))
+        self.assertEqual(numbers(next(ts.chunks())), list(range(10)))
+        self.assertEqual(ts.ring.dropped, 0)
+
+    def test_stall_timeout(self):
+        writer = self.writer(capacity=8, consumers=1, stall_timeout=0.05)
+        ts = self.reader(writer)
+        thread = self.thread(writer.write, packets(0, 20))
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(writer.attached(), 0)
+        # 切り離された読み込み側は次に読む時に最新の位置から読み直す
+        result = []
+        reader = self.thread(
+            lambda: result.extend(numbers(b''.join(ts.chunks()))))
+        self.assertTrue(writer.wait(1, timeout=5))
+        writer.write(packets(20, 23))
+        writer.close()
+        reader.join(5)
+        self.assertEqual(result, [20, 21, 22])
+        self.assertEqual(ts.ring.dropped, 20)
+
+    def test_slots(self):
+        writer = self.writer(capacity=8, consumers=2)
+        first = self.reader(writer, 0, chunk_size=5)
+        second = self.reader(writer, 1, chunk_size=3)
+        self.assertEqual(writer.attached(), 2)
+        self.assertTrue(writer.wait(2, timeout=0))
+        results = {}
+
+        def read(name, ts):
+            results[name] = numbers(b''.join(ts.chunks()))
+
+        threads = [self.thread(read, 'first', first),
+                   self.thread(read, 'second', second)]
+        writer.write(packets(0, 30))
+        writer.close()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, {'first': list(range(30)),
+                                   'second': list(range(30))})
+
+    def test_wait_timeout(self):
+        writer = self.writer(capacity=8, consumers=2)
+        self.assertFalse(writer.wait(1, timeout=0.01))
+
+    def attach_from(self, method):
+        context = multiprocessing.get_context(method)
+        writer = self.writer(capacity=16, consumers=1)
+        queue = context.Queue()
+        process = context.Process(target=consume,
+                                  args=(writer.name, 20, queue))
+        process.start()
+        self.addCleanup(process.join, 5)
+        self.assertEqual(queue.get(timeout=30), 'attached')
+        self.assertTrue(writer.wait(1, timeout=5))
+        writer.write(packets(0, 20))
+        self.assertEqual(queue.get(timeout=30), list(range(20)))
+        process.join(10)
+        self.assertEqual(process.exitcode, 0)
+        # 読み込み側が終わっても共有メモリは消えない
+        memory = SharedMemory(writer.name)
+        memory.close()
+        self.assertEqual(writer.attached(), 0)
+        writer.write(packets(20, 40))
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(),
+                         'fork is not available')
+    def test_fork(self):
+        self.attach_from('fork')
+
+    def test_spawn(self):
+        self.attach_from('spawn')
+
+
+if __name__ == '__main__':
+    unittest.main()
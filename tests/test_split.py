@@ -0,0 +1,193 @@
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from ariblib import tsopen
+from ariblib.command.split import Splitter
+from ariblib.encoder import encode
+from ariblib.packet import SectionParser, pid
+from ariblib.sections import (EventInformationSection,
+                              ProgramAssociationSection, ProgramMapSection,
+                              TimeOffsetSection)
+
+from tests.tsutil import Stream
+
+# service_id: (PMT の PID, 映像の PID, 音声の PID)
+SERVICES = {
+    0x0400: (0x01F0, 0x0111, 0x0112),
+    0x0408: (0x01F8, 0x0121, 0x0122),
+}
+
+# データ放送 (残さない)
+DATA_PID = 0x0130
+
+
+def pat(services, version=0):
+    pids = [{'program_number': 0, 'program_map_PID': 0x10}]
+    pids.extend({'program_number': service_id, 'program_map_PID': pmt_pid}
+                for service_id, pmt_pid in services)
+    return encode(ProgramAssociationSection, transport_stream_id=0x7FE0,
+                  version_number=version, pids=pids)
+
+
+def pmt(service_id, video, audio):
+    return encode(ProgramMapSection, program_number=service_id,
+                  PCR_PID=video, maps=[
+                      {'stream_type': 0x02, 'elementary_PID': video},
+                      {'stream_type': 0x0F, 'elementary_PID': audio},
+                      {'stream_type': 0x0D, 'elementary_PID': DATA_PID},
+                  ])
+
+
+def eit(service_id, event_id, section_number=0, padding=0):
+    # padding を大きくするとセクションが複数のパケットにまたがる
+    descriptors = [bytes([0x4D, padding]) + b'\x00' * padding]
+    return encode(EventInformationSection, service_id=service_id,
+                  section_number=section_number, last_section_number=1,
+                  transport_stream_id=0x7FE0, original_network_id=4,
+                  last_table_id=0x4E, events=[
+                      {'event_id': event_id, 'descriptors': descriptors}])
+
+
+def tot():
+    return encode(TimeOffsetSection, JST_time=datetime(2020, 1, 1, 19))
+
+
+def read_packets(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return [data[i:i + 188] for i in range(0, len(data), 188)]
+
+
+def read_sections(packets, *Sections):
+    parser = SectionParser(*Sections)
+    result = []
+    for p in packets:
+        result.extend(parser.feed(p))
+    return result
+
+
+class SplitterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.outpath = os.path.join(self.tmp, 'out.ts')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def path(self, service_id):
+        return os.path.join(self.tmp, 'out_{}.ts'.format(service_id))
+
+    def two_services(self, rounds=3):
+        stream = Stream()
+        for index in range(rounds):
+            stream.section(0x00, pat((service_id, pids[0])
+                                     for service_id, pids in SERVICES.items()))
+            for service_id, (pmt_pid, video, audio) in SERVICES.items():
+                stream.section(pmt_pid, pmt(service_id, video, audio))
+            for service_id in SERVICES:
+                stream.section(0x12, eit(service_id, service_id + index,
+                                         padding=200 * (index % 2)))
+            stream.section(0x14, tot())
+            for service_id, (_, video, audio) in SERVICES.items():
+                stream.es(video, index)
+                stream.es(audio, index)
+            stream.es(DATA_PID, index)
+        return stream
+
+    def split(self, stream, services):
+        inpath = os.path.join(self.tmp, 'in.ts')
+        stream.write(inpath)
+        splitter = Splitter(self.outpath, services)
+        with tsopen(inpath) as ts:
+            for p in ts:
+                splitter.feed(p)
+        splitter.close()
+        return splitter
+
+    def test_all_services(self):
+        self.split(self.two_services(), 'all')
+        for service_id, (pmt_pid, video, audio) in SERVICES.items():
+            packets = read_packets(self.path(service_id))
+            pids = set(pid(p) for p in packets)
+            self.assertEqual(pids, {0x00, pmt_pid, video, audio, 0x12, 0x14})
+
+            pats = read_sections(packets, ProgramAssociationSection)
+            self.assertEqual(len(pats), 3)
+            for section in pats:
+                self.assertEqual(list(section.pmt_items),
+                                 [(service_id, pmt_pid)])
+
+            # 他のサービスの EIT は含まない
+            eits = read_sections(packets, EventInformationSection)
+            self.assertEqual(
+                [(section.service_id, section.events[0].event_id)
+                 for section in eits],
+                [(service_id, service_id + index) for index in range(3)])
+
+            # 映像・音声はそのまま
+            for PID in (video, audio):
+                self.assertEqual(
+                    [p[4] for p in packets if pid(p) == PID], [0, 1, 2])
+
+    def test_selected_service(self):
+        self.split(self.two_services(), {0x0408, 0x0999})
+        self.assertTrue(os.path.exists(self.path(0x0408)))
+        self.assertFalse(os.path.exists(self.path(0x0400)))
+
+    def test_default(self):
+        # 既定では最初のサービスの PMT・映像・音声だけを残す
+        self.split(self.two_services(), None)
+        packets = read_packets(self.outpath)
+        pmt_pid, video, audio = SERVICES[0x0400]
+        self.assertEqual(set(pid(p) for p in packets),
+                         {0x00, pmt_pid, video, audio})
+
+    def test_pat_update(self):
+        stream = self.two_services(rounds=1)
+        # 0x0408 が消え、0x0400 の PMT の PID が変わる
+        stream.section(0x00, pat([(0x0400, 0x01F1)], version=1))
+        stream.section(0x01F1, pmt(0x0400, 0x0113, 0x0114))
+        stream.section(0x01F0, pmt(0x0400, 0x0111, 0x0112))
+        for service_id in SERVICES:
+            stream.section(0x12, eit(service_id, 0x1000))
+        for PID in (0x0111, 0x0113, 0x0121):
+            stream.es(PID, 0xAA)
+        splitter = self.split(stream, 'all')
+        self.assertEqual(list(splitter.outputs), [0x0400])
+        self.assertNotIn(0x01F8, splitter.parser.table_map)
+        self.assertNotIn(0x01F0, splitter.parser.table_map)
+
+        packets = read_packets(self.path(0x0400))
+        pats = read_sections(packets, ProgramAssociationSection)
+        self.assertEqual([list(section.pmt_items) for section in pats],
+                         [[(0x0400, 0x01F0)], [(0x0400, 0x01F1)]])
+        after = packets[[pid(p) for p in packets].index(0x01F1):]
+        self.assertIn(0x0113, [pid(p) for p in after])
+        self.assertNotIn(0x0111, [pid(p) for p in after])
+
+        # 消えたサービスの出力はそこで閉じる
+        packets = read_packets(self.path(0x0408))
+        self.assertNotIn(0xAA, [p[4] for p in packets if pid(p) == 0x0121])
+        eits = read_sections(packets, EventInformationSection)
+        self.assertEqual([section.events[0].event_id for section in eits],
+                         [0x0408])
+
+    def test_default_follows_first_service(self):
+        stream = self.two_services(rounds=1)
+        stream.section(0x00, pat([(0x0408, 0x01F8)], version=1))
+        stream.section(0x01F8, pmt(0x0408, 0x0121, 0x0122))
+        stream.es(0x0121, 0xAA)
+        self.split(stream, None)
+        packets = read_packets(self.outpath)
+        pats = read_sections(packets, ProgramAssociationSection)
+        self.assertEqual([list(section.pmt_items) for section in pats],
+                         [[(0x0400, 0x01F0)], [(0x0408, 0x01F8)]])
+        self.assertIn(0xAA, [p[4] for p in packets if pid(p) == 0x0121])
+
+
+if __name__ == '__main__':
+    unittest.main()
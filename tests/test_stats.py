@@ -0,0 +1,125 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from ariblib import stats
+from ariblib.encoder import SectionPacketizer, encode
+from ariblib.packet import SectionParser
+from ariblib.sections import TimeOffsetSection
+
+
+class StatsTest(unittest.TestCase):
+
+    def setUp(self):
+        enabled = stats.enabled
+        self.addCleanup(setattr, stats, 'enabled', enabled)
+        self.addCleanup(stats.reset)
+        stats.reset()
+        stats.enable()
+
+    def test_count(self):
+        stats.count('packets', n=3)
+        stats.count('packets')
+        stats.count('sections_assembled', 0x73)
+        stats.count('sections_parsed', 'TimeOffsetSection', 2)
+        counters = stats.snapshot()['counters']
+        self.assertEqual(counters['packets'], 4)
+        self.assertEqual(counters['sections_assembled'], {'0x73': 1})
+        self.assertEqual(counters['sections_parsed'],
+                         {'TimeOffsetSection': 2})
+
+    def test_timer(self):
+        with mock.patch('ariblib.stats.perf_counter',
+                        side_effect=[1.0, 1.25, 2.0, 2.5]):
+            with stats.timer('read'):
+                pass
+            with self.assertRaises(ValueError):
+                with stats.timer('read'):
+                    raise ValueError
+        self.assertEqual(stats.snapshot()['timers'],
+                         {'read': {'seconds': 0.75, 'calls': 2}})
+
+    def test_take_and_merge(self):
+        stats.count('packets', n=5)
+        stats.count('descriptors', 0x4D, 2)
+        stats.timers['aribstr'] += 0.5
+        stats.calls['aribstr'] += 1
+        taken = stats.take()
+        self.assertEqual(taken, ({'packets': {None: 5},
+                                  'descriptors': {0x4D: 2}},
+                                 {'aribstr': 0.5}, {'aribstr': 1}))
+        self.assertEqual(stats.snapshot()['counters'], {})
+
+        stats.count('packets', n=1)
+        stats.count('descriptors', 0x4D)
+        stats.count('descriptors', 0x54)
+        stats.timers['aribstr'] += 0.25
+        stats.calls['aribstr'] += 1
+        stats.merge(taken)
+        stats.merge(({'descriptors': {0x4D: 1}}, {'read': 1.0}, {'read': 3}))
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot['counters'], {
+            'packets': 6, 'descriptors': {'0x4D': 4, '0x54': 1}})
+        self.assertEqual(snapshot['timers'], {
+            'aribstr': {'seconds': 0.75, 'calls': 2},
+            'read': {'seconds': 1.0, 'calls': 3}})
+
+    def test_disabled(self):
+        # 無効の間は各所で数えない
+        stats.disable()
+        data = encode(TimeOffsetSection)
+        parser = SectionParser(TimeOffsetSection)
+        sections = [section for packet in
+                    SectionPacketizer(0x14).packetize(data)
+                    for section in parser.feed(packet)]
+        self.assertEqual(len(sections), 1)
+        snapshot = stats.snapshot()
+        self.assertFalse(snapshot['enabled'])
+        self.assertEqual(snapshot['counters'], {})
+        self.assertEqual(snapshot['timers'], {})
+        self.assertEqual(stats.prometheus(), '\n')
+
+        stats.enable()
+        TimeOffsetSection(data)
+        self.assertEqual(stats.snapshot()['counters'],
+                         {'sections_parsed': {'TimeOffsetSection': 1}})
+
+    def test_snapshot(self):
+        snapshot = stats.snapshot()
+        self.assertTrue(snapshot['enabled'])
+        self.assertEqual(set(snapshot['aribstr_cache']),
+                         {'hits', 'misses', 'maxsize', 'currsize'})
+
+    def test_prometheus(self):
+        stats.count('packets', n=10)
+        stats.count('sections_assembled', 0x4E, 2)
+        stats.count('sections_assembled', 0x14)
+        stats.timers['read'] += 1.5
+        stats.calls['read'] += 3
+        self.assertEqual(stats.prometheus('test'), '\n'.join([
+            '# TYPE test_packets_total counter',
+            'test_packets_total 10',
+            '# TYPE test_sections_assembled_total counter',
+            'test_sections_assembled_total{table_id="0x14"} 1',
+            'test_sections_assembled_total{table_id="0x4E"} 2',
+            '# TYPE test_stage_seconds_total counter',
+            'test_stage_seconds_total{stage="read"} 1.5',
+            '# TYPE test_stage_calls_total counter',
+            'test_stage_calls_total{stage="read"} 3',
+        ]) + '\n')
+
+    def test_write_prometheus(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'ariblib.prom')
+        stats.count('packets', n=2)
+        stats.write_prometheus(path)
+        with open(path) as f:
+            self.assertEqual(f.read(), stats.prometheus())
+        self.assertEqual(os.listdir(tmp), ['ariblib.prom'])
+
+
+if __name__ == '__main__':
+    unittest.main()
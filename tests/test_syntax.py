@@ -0,0 +1,66 @@
+import unittest
+
+from ariblib.mnemonics import bslbf, case, uimsbf
+from ariblib.syntax import Syntax
+
+
+class Sample(Syntax):
+
+    """条件の重なる if シンタックスを持つシンタックス"""
+
+    kind = uimsbf(8)
+
+    @case(lambda self: self.kind == 1)
+    class first(Syntax):
+        value = uimsbf(8)
+        flag = bslbf(1)
+        reserved = bslbf(7)
+
+        # 条件に合わなければ None になる
+        @case(flag)
+        class nested(Syntax):
+            extra = uimsbf(8)
+
+    @case(lambda self: self.kind >= 1)
+    class second(Syntax):
+        nested = uimsbf(8)
+        value = uimsbf(8)
+        extra = uimsbf(8)
+
+
+class SyntaxTest(unittest.TestCase):
+
+    def test_first_case(self):
+        sample = Sample(bytes([1, 0x12, 0x00, 0x34]))
+        self.assertEqual(sample.value, 0x12)
+        # 最初に条件に合った if シンタックスの値は None でもそのまま返す
+        self.assertIsNone(sample.nested)
+        self.assertIsNone(sample.extra)
+        self.assertIsNone(sample.extra)
+
+    def test_nested(self):
+        sample = Sample(bytes([1, 0x12, 0x80, 0x34]))
+        self.assertEqual(sample.extra, 0x34)
+        self.assertEqual(sample.nested.extra, 0x34)
+
+    def test_second_case(self):
+        sample = Sample(bytes([2, 0x12, 0x34, 0x56]))
+        self.assertEqual((sample.nested, sample.value, sample.extra),
+                         (0x12, 0x34, 0x56))
+
+    def test_cache(self):
+        # if シンタックス直下の値だけを保存する
+        sample = Sample(bytes([1, 0x12, 0x80, 0x34]))
+        sample.value
+        sample.extra
+        self.assertEqual(vars(sample)['value'], 0x12)
+        self.assertNotIn('extra', vars(sample))
+
+    def test_missing(self):
+        sample = Sample(bytes([0, 0, 0, 0]))
+        self.assertIsNone(sample.value)
+        self.assertIsNone(sample.unknown)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+from argparse import Namespace
+from datetime import timedelta
+import os
+import shutil
+import tempfile
+import unittest
+
+from ariblib.command.vtt import LiveSegmenter, live, timestamp
+
+from tests.tsutil import Stream, caption_pes, caption_program, text_unit
+
+PCR_PID = 0x0111
+CAPTION_PID = 0x0130
+PCR_BASE = 90000 * 10
+
+HEADER = 'WEBVTT\nX-TIMESTAMP-MAP=MPEGTS:{},LOCAL:00:00:00.000\n\n'
+
+
+def cue(number, start, end, text):
+    return '{}\n{} --> {}\n{}\n\n'.format(number, start, end, text)
+
+
+class LiveSegmenterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.outdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.outdir)
+
+    def read(self, name):
+        with open(os.path.join(self.outdir, name)) as f:
+            return f.read()
+
+    def playlist(self, name='subtitles'):
+        return self.read(name + '.m3u8').splitlines()
+
+    def test_timestamp(self):
+        self.assertEqual(timestamp(3723.4567), '01:02:03.457')
+        self.assertEqual(timestamp(0), '00:00:00.000')
+
+    def test_segments(self):
+        segmenter = LiveSegmenter(self.outdir, timedelta(seconds=10))
+        segmenter.add(0.5, 'A')
+        # 次の字幕でセグメントをまたぐ
+        segmenter.add(2.5, 'B')
+        segmenter.add(3, '')
+        segmenter.advance(4)
+        self.assertEqual(self.read('subtitles00000.vtt'),
+                         HEADER.format(900000) +
+                         cue(1, '00:00:00.500', '00:00:02.000', 'A'))
+        self.assertEqual(self.read('subtitles00001.vtt'),
+                         HEADER.format(900000) +
+                         cue(2, '00:00:02.000', '00:00:02.500', 'A') +
+                         cue(3, '00:00:02.500', '00:00:03.000', 'B'))
+        self.assertEqual(self.playlist(), [
+            '#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:2',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXTINF:2.000,', 'subtitles00000.vtt',
+            '#EXTINF:2.000,', 'subtitles00001.vtt',
+        ])
+        segmenter.close(4.5)
+        self.assertEqual(self.read('subtitles00002.vtt'),
+                         HEADER.format(900000))
+        self.assertEqual(self.playlist()[-3:],
+                         ['#EXTINF:0.500,', 'subtitles00002.vtt',
+                          '#EXT-X-ENDLIST'])
+
+    def test_list_size(self):
+        # 古いセグメントを外し、MEDIA-SEQUENCE を進める
+        segmenter = LiveSegmenter(self.outdir, timedelta(seconds=10),
+                                  segment_duration=1.5, list_size=2,
+                                  name='live')
+        segmenter.advance(6)
+        self.assertEqual(self.playlist('live'), [
+            '#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:2',
+            '#EXT-X-MEDIA-SEQUENCE:2',
+            '#EXTINF:1.500,', 'live00002.vtt',
+            '#EXTINF:1.500,', 'live00003.vtt',
+        ])
+        self.assertFalse(os.path.exists(
+            os.path.join(self.outdir, 'live.m3u8.tmp')))
+
+    def test_mpegts_wraparound(self):
+        # MPEGTS は 33 ビットで一周させる
+        LiveSegmenter(self.outdir, timedelta(seconds=2 ** 33 / 90000 + 1))
+        self.assertEqual(self.read('subtitles00000.vtt'),
+                         HEADER.format(90000))
+
+
+class LiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def read(self, name):
+        with open(os.path.join(self.tmp, 'out', name)) as f:
+            return f.read()
+
+    def test_live(self):
+        # 0.5 秒ごとの PCR と、0.5 秒・1.5 秒・3 秒の字幕
+        stream = Stream()
+        caption_program(stream, pcr_pid=PCR_PID, caption_pid=CAPTION_PID)
+        captions = {1: b'\xa4\xa2', 3: b'\xa4\xa4', 6: b'\xa4\xa6'}
+        for index in range(11):
+            value = PCR_BASE + index * 45000
+            stream.pcr(PCR_PID, value)
+            if index in captions:
+                stream.pes(CAPTION_PID, caption_pes(
+                    value, [text_unit(captions[index])]))
+        inpath = os.path.join(self.tmp, 'in.ts')
+        stream.write(inpath)
+
+        live(Namespace(inpath=inpath, outpath=os.path.join(self.tmp, 'out'),
+                       segment_duration=2, list_size=0, idle_timeout=0))
+        header = HEADER.format(PCR_BASE)
+        self.assertEqual(self.read('subtitles00000.vtt'), header +
+                         cue(1, '00:00:00.500', '00:00:01.500', 'あ</c>') +
+                         cue(2, '00:00:01.500', '00:00:02.000', 'い</c>'))
+        self.assertEqual(self.read('subtitles00001.vtt'), header +
+                         cue(3, '00:00:02.000', '00:00:03.000', 'い</c>') +
+                         cue(4, '00:00:03.000', '00:00:04.000', 'う</c>'))
+        # 最後の PCR (5 秒) で閉じる
+        self.assertEqual(self.read('subtitles00002.vtt'), header +
+                         cue(5, '00:00:04.000', '00:00:05.000', 'う</c>'))
+        self.assertEqual(self.read('subtitles.m3u8').splitlines(), [
+            '#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:2',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXTINF:2.000,', 'subtitles00000.vtt',
+            '#EXTINF:2.000,', 'subtitles00001.vtt',
+            '#EXTINF:1.000,', 'subtitles00002.vtt',
+            '#EXT-X-ENDLIST',
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import unittest
+
+from ariblib.encoder import SectionPacketizer, encode
+from ariblib.sections import \
+    ActualStreamPresentFollowingEventInformationSection
+from ariblib.watch import ProgramWatcher
+
+from tests.tsutil import ts_packet
+
+SERVICE_ID = 0x0400
+
+
+def eit(event_id, section_number=0, version=0, service_id=SERVICE_ID,
+        padding=0, table_id=0x4E):
+    """EIT[p/f] のセクション。event_id が None ならイベントループは空"""
+
+    events = []
+    if event_id is not None:
+        events.append({'event_id': event_id, 'descriptors': [
+            bytes([0x4D, padding]) + b'\x00' * padding]})
+    return encode(ActualStreamPresentFollowingEventInformationSection,
+                  table_id=table_id, service_id=service_id,
+                  section_number=section_number, last_section_number=1,
+                  version_number=version, transport_stream_id=0x7FE0,
+                  original_network_id=4, events=events)
+
+
+class ProgramWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.packetizer = SectionPacketizer(0x12)
+
+    def packets(self, *sections):
+        return self.packetizer.packetize(*sections)
+
+    def feed(self, watcher, packets):
+        result = []
+        for packet in packets:
+            result.extend(watcher.feed(packet))
+        return result
+
+    def changes(self, watcher, *sections):
+        """(service_id, section_number, event_id, previous) のリスト"""
+
+        return [(change.service_id, change.section_number, change.event_id,
+                 change.previous)
+                for change in self.feed(watcher, self.packets(*sections))]
+
+    def test_first_sections(self):
+        watcher = ProgramWatcher()
+        changes = self.feed(watcher, self.packets(
+            eit(0x0100, 0), eit(0x0101, 1)))
+        self.assertEqual([(c.section_number, c.event_id, c.previous)
+                          for c in changes],
+                         [(0, 0x0100, None), (1, 0x0101, None)])
+        present, following = changes
+        self.assertTrue(present.present)
+        self.assertFalse(following.present)
+        self.assertEqual(present.event.event_id, 0x0100)
+        self.assertEqual(present.version_number, 0)
+        self.assertEqual((present.packets, present.latency), (0, 0))
+        self.assertEqual(watcher.programs, {
+            (SERVICE_ID, 0): (0x0100, 0), (SERVICE_ID, 1): (0x0101, 0)})
+
+    def test_unchanged(self):
+        watcher = ProgramWatcher()
+        self.changes(watcher, eit(0x0100, 0), eit(0x0101, 1))
+        self.assertEqual(
+            self.changes(watcher, eit(0x0100, 0), eit(0x0101, 1)), [])
+
+    def test_version_bump(self):
+        # イベントは同じでも版が変われば返す (延長など)
+        watcher = ProgramWatcher()
+        self.changes(watcher, eit(0x0100, 0), eit(0x0101, 1))
+        self.assertEqual(
+            self.changes(watcher, eit(0x0100, 0, version=1),
+                         eit(0x0101, 1)),
+            [(SERVICE_ID, 0, 0x0100, (0x0100, 0))])
+
+    def test_present_following_swap(self):
+        watcher = ProgramWatcher()
+        self.changes(watcher, eit(0x0100, 0), eit(0x0101, 1))
+        self.assertEqual(
+            self.changes(watcher, eit(0x0101, 0, version=1),
+                         eit(0x0102, 1, version=1)),
+            [(SERVICE_ID, 0, 0x0101, (0x0100, 0)),
+             (SERVICE_ID, 1, 0x0102, (0x0101, 0))])
+
+    def test_no_event(self):
+        watcher = ProgramWatcher()
+        self.changes(watcher, eit(0x0100, 0))
+        changes = self.feed(watcher, self.packets(eit(None, 0, version=1)))
+        self.assertEqual([(c.event_id, c.previous) for c in changes],
+                         [(None, (0x0100, 0))])
+        self.assertIsNone(changes[0].event)
+
+    def test_several_packets(self):
+        watcher = ProgramWatcher()
+        packets = [ts_packet(0x11)] + self.packets(eit(0x0100, padding=250))
+        changes = self.feed(watcher, packets)
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0].event_id, 0x0100)
+        self.assertEqual((changes[0].packets, changes[0].latency), (2, 1))
+        self.assertEqual(watcher.count, 3)
+
+    def test_filters(self):
+        watcher = ProgramWatcher(service_ids=[SERVICE_ID],
+                                 section_numbers=[0])
+        self.assertEqual(self.changes(
+            watcher, eit(0x0200, 0, service_id=0x0408), eit(0x0101, 1),
+            eit(0x0100, 0, table_id=0x50), eit(0x0100, 0)),
+            [(SERVICE_ID, 0, 0x0100, None)])
+
+    def test_other_pid(self):
+        watcher = ProgramWatcher()
+        packets = SectionPacketizer(0x13).packetize(eit(0x0100))
+        self.assertEqual(self.feed(watcher, packets), [])
+
+    def test_dropped_packet(self):
+        watcher = ProgramWatcher()
+        first, second = self.packets(eit(0x0100, padding=250))
+        self.assertEqual(self.feed(watcher, [first]), [])
+        # 2つ目のパケットが抜けたセクションは捨てる
+        self.assertEqual(self.changes(watcher, eit(0x0101, 1)),
+                         [(SERVICE_ID, 1, 0x0101, None)])
+        self.assertEqual(watcher.programs, {(SERVICE_ID, 1): (0x0101, 0)})
+        self.assertEqual(self.changes(watcher, eit(0x0100, 0)),
+                         [(SERVICE_ID, 0, 0x0100, None)])
+
+    def test_crc_error(self):
+        watcher = ProgramWatcher()
+        data = bytearray(eit(0x0100))
+        data[-1] ^= 0xFF
+        self.assertEqual(self.changes(watcher, bytes(data)), [])
+        # 壊れたセクションは覚えないので、正しいものを受信すれば返す
+        self.assertEqual(self.changes(watcher, eit(0x0100)),
+                         [(SERVICE_ID, 0, 0x0100, None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
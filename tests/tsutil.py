@@ -0,0 +1,178 @@
+"""テスト用の TS パケットの組み立て"""
+
+from ariblib.descriptors import StreamIdentifierDescriptor
+from ariblib.encoder import SectionPacketizer, encode
+from ariblib.sections import ProgramAssociationSection, ProgramMapSection
+
+PACKET_SIZE = 188
+
+
+def ts_packet(pid, payload=b'', counter=0, pusi=False, adaptation=None):
+    """TS パケットを一つ作る
+
+    adaptation は adaptation_field_length に続くバイト列。
+    パケットの残りは 0xFF で埋める"""
+
+    header = bytearray(4)
+    header[0] = 0x47
+    header[1] = (0x40 if pusi else 0) | (pid >> 8) & 0x1F
+    header[2] = pid & 0xFF
+    control = 0x10 if payload else 0
+    if adaptation is not None:
+        control |= 0x20
+        header.append(len(adaptation))
+        header.extend(adaptation)
+    header[3] = control | counter & 0x0F
+    packet = bytes(header) + bytes(payload)
+    if len(packet) > PACKET_SIZE:
+        raise ValueError('payload too long')
+    return packet + b'\xFF' * (PACKET_SIZE - len(packet))
+
+
+def section_packets(pid, data, counter=0):
+    """セクションを pointer_field 付きでパケットに分ける"""
+
+    data = b'\x00' + bytes(data)
+    packets = []
+    for start in range(0, len(data), PACKET_SIZE - 4):
+        packets.append(ts_packet(pid, data[start:start + PACKET_SIZE - 4],
+                                 counter + len(packets), pusi=not start))
+    return packets
+
+
+def pes_packets(pid, data, counter=0):
+    """PES をパケットに分ける"""
+
+    packets = []
+    for start in range(0, len(data), PACKET_SIZE - 4):
+        packets.append(ts_packet(pid, data[start:start + PACKET_SIZE - 4],
+                                 counter + len(packets), pusi=not start))
+    return packets
+
+
+def timestamp(prefix, value):
+    """PTS/DTS の 5 バイトを作る"""
+
+    return bytes([
+        prefix << 4 | (value >> 29) & 0x0E | 1,
+        (value >> 22) & 0xFF,
+        (value >> 14) & 0xFE | 1,
+        (value >> 7) & 0xFF,
+        (value << 1) & 0xFE | 1,
+    ])
+
+
+def pes(flags, optional=b'', payload=b'', stream_id=0xBD, stuffing=0):
+    """PES ヘッダの任意フィールドのバイト列から PES を作る"""
+
+    header = bytes([0x80, flags, len(optional) + stuffing])
+    body = header + optional + b'\xFF' * stuffing + payload
+    return (b'\x00\x00\x01' + bytes([stream_id]) +
+            len(body).to_bytes(2, 'big') + body)
+
+
+def data_group(data_units, data_group_id=0x01):
+    """字幕文データのデータグループを作る"""
+
+    loop = b''.join(data_units)
+    body = b'\x00' + len(loop).to_bytes(3, 'big') + loop
+    return (bytes([0x80, 0xFF, 0xF0, data_group_id << 2, 0, 0]) +
+            len(body).to_bytes(2, 'big') + body + b'\x00\x00')
+
+
+def drcs_unit(fonts):
+    """(character_code, depth, width, height, pattern_data) の DRCS データユニット"""
+
+    data = bytes([len(fonts)])
+    for character_code, depth, width, height, pattern_data in fonts:
+        data += character_code.to_bytes(2, 'big')
+        data += bytes([1, 0x00, depth, width, height]) + pattern_data
+    return b'\x1F\x30' + len(data).to_bytes(3, 'big') + data
+
+
+def text_unit(text):
+    return b'\x1F\x20' + len(text).to_bytes(3, 'big') + text
+
+
+def caption_pes(pts, data_units, data_group_id=0x01):
+    """PTS (90kHz) と字幕文のデータユニットのリストから字幕 PES を作る"""
+
+    return pes(0x80, timestamp(0b0010, pts),
+               data_group(data_units, data_group_id))
+
+
+def caption_program(stream, service_id=0x0400, pmt_pid=0x01F0,
+                    pcr_pid=0x0111, caption_pid=0x0130):
+    """PAT と、映像・文字スーパー・字幕を含む PMT を stream に加える"""
+
+    stream.section(0x00, encode(
+        ProgramAssociationSection, transport_stream_id=0x7FE0,
+        pids=[{'program_number': service_id, 'program_map_PID': pmt_pid}]))
+    stream.section(pmt_pid, encode(
+        ProgramMapSection, program_number=service_id, PCR_PID=pcr_pid,
+        maps=[
+            {'stream_type': 0x02, 'elementary_PID': pcr_pid},
+            # 文字スーパー (component_tag 0x88) は字幕ではない
+            {'stream_type': 0x06, 'elementary_PID': caption_pid + 1,
+             'descriptors': [
+                 (StreamIdentifierDescriptor, {'component_tag': 0x88})]},
+            {'stream_type': 0x06, 'elementary_PID': caption_pid,
+             'descriptors': [
+                 (StreamIdentifierDescriptor, {'component_tag': 0x87})]},
+        ]))
+
+
+def pcr_adaptation(base, random_access=False):
+    """PCR を持つ adaptation field (adaptation_field_length の後) を作る"""
+
+    flags = 0x10 | (0x40 if random_access else 0)
+    return bytes([
+        flags,
+        (base >> 25) & 0xFF, (base >> 17) & 0xFF, (base >> 9) & 0xFF,
+        (base >> 1) & 0xFF, (base & 1) << 7 | 0x7E, 0x00,
+    ])
+
+
+class Stream(object):
+
+    """テスト用の TS を組み立てる"""
+
+    def __init__(self):
+        self.packets = []
+        self.packetizers = {}
+        self.counters = {}
+
+    def section(self, PID, data):
+        packetizer = self.packetizers.get(PID)
+        if packetizer is None:
+            packetizer = self.packetizers[PID] = SectionPacketizer(PID)
+        self.packets.extend(packetizer.packetize(data))
+
+    def _counter(self, PID):
+        counter = self.counters.get(PID, 0)
+        self.counters[PID] = (counter + 1) & 0x0F
+        return counter
+
+    def pes(self, PID, data):
+        counter = self.counters.get(PID, 0)
+        packets = pes_packets(PID, data, counter)
+        self.counters[PID] = (counter + len(packets)) & 0x0F
+        self.packets.extend(packets)
+
+    def es(self, PID, marker, adaptation=None):
+        self.packets.append(ts_packet(PID, bytes([marker]) * 10,
+                                      self._counter(PID),
+                                      adaptation=adaptation))
+
+    def pcr(self, PID, base, random_access=False, marker=0):
+        self.es(PID, marker, pcr_adaptation(base, random_access))
+
+    @property
+    def position(self):
+        """次のパケットのバイト位置"""
+
+        return len(self.packets) * PACKET_SIZE
+
+    def write(self, path):
+        with open(path, 'wb') as f:
+            f.write(b''.join(self.packets))